@@ -8,6 +8,8 @@ from django.db.models.signals import post_save
 from django.db import models
 from django.apps import apps
 
+from outbox.models import queue_email
+
 
 class ShelterlyUserManager(BaseUserManager):
     def create_user(self, email, cell_phone, password=None, **extra_fields):
@@ -87,8 +89,8 @@ def email_new_user(sender, **kwargs):
             user=user,
         )
 
-        # Send email here.
-        send_mail(
+        # Queue email here.
+        queue_email(
             # title:
             "User Registered for Shelterly",
             # message:
@@ -103,8 +105,7 @@ def email_new_user(sender, **kwargs):
             "DoNotReply@shelterly.org",
             # to:
             [user.email],
-            fail_silently=False,
-            html_message = render_to_string(
+            html_body = render_to_string(
                 'registration_email.html',
                 {
                 'site': Site.objects.get_current(),
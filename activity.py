@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.contenttypes.models import ContentType
+from actstream import action
+from actstream.models import Action
+
+# Actions collected by the innermost active buffered_actions() block.
+action_buffer = ContextVar('action_buffer', default=None)
+
+def build_action(actor, verb, target=None, action_object=None):
+    """
+    Returns an unsaved Action like the one action.send records, for writing many at once with Action.objects.bulk_create.
+    """
+    fields = {'actor_content_type': ContentType.objects.get_for_model(actor), 'actor_object_id': actor.pk, 'verb': verb}
+    for name, instance in (('target', target), ('action_object', action_object)):
+        if instance is not None:
+            fields[name + '_content_type'] = ContentType.objects.get_for_model(instance)
+            fields[name + '_object_id'] = instance.pk
+    return Action(**fields)
+
+def send_action(actor, verb, target=None, action_object=None):
+    """
+    Records an action like action.send, or adds it to the active buffered_actions() block.
+    """
+    buffer = action_buffer.get()
+    if buffer is None:
+        action.send(actor, verb=verb, target=target, action_object=action_object)
+    else:
+        buffer.append(build_action(actor, verb, target, action_object))
+
+@contextmanager
+def buffered_actions():
+    """
+    Collects the actions sent with send_action() inside the block, or inside a decorated
+    function, and writes them with one bulk_create when the outermost block exits.
+
+    Nothing is written if the block raises. Inside transaction.atomic the write is part of
+    the transaction.
+    """
+    if action_buffer.get() is not None:
+        yield
+        return
+    token = action_buffer.set([])
+    try:
+        yield
+        if action_buffer.get():
+            Action.objects.bulk_create(action_buffer.get())
+    finally:
+        action_buffer.reset(token)
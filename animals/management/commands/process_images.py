@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from images import get_image_models, process_pending_images
+
+
+class Command(BaseCommand):
+    help = 'Strips and recompresses uploaded images and generates their thumbnail and medium derivatives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process one batch of each image model and exit.')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when no images are pending.')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = sum(process_pending_images(model, options['batch_size']) for model in get_image_models())
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
@@ -1,10 +1,28 @@
 from django.db import models
-from managers import ActionHistoryQueryset
+from django.db.models.functions import JSONObject
+from managers import ActionHistoryQueryset, LocationQueryset, SearchVectorQueryset, UpdatedAtQueryset
 from ordered_model.models import OrderedModelQuerySet
 
 
-class AnimalQueryset(ActionHistoryQueryset, OrderedModelQuerySet):
+class AnimalQueryset(UpdatedAtQueryset, LocationQueryset, SearchVectorQueryset, ActionHistoryQueryset, OrderedModelQuerySet):
+    search_vector_fields = (
+        ('name', 'A'), ('microchip', 'A'), ('address', 'B'), ('city', 'C'), ('request__address', 'B'), ('request__city', 'C'),
+        ('owners__address', 'B'), ('owners__city', 'C'), ('owners__first_name', 'A'), ('owners__last_name', 'A'),
+        ('reporter__first_name', 'A'), ('reporter__last_name', 'A'),
+    )
+
     def with_images(self):
         return self.prefetch_related(
             models.Prefetch("animalimage_set", to_attr="images")
         )
+
+    def with_latest_vitals(self):
+        """
+        Annotates latest_vitals with the weight, weight_unit, weight_estimated, temperature and pulse
+        of each animal's most recent exam, or None if it has not been examined.
+        """
+        from vet.models import Exam
+        exams = Exam.objects.filter(medical_record_id=models.OuterRef('medical_record_id')).order_by('-open', '-id').values(
+            vitals=JSONObject(weight='weight', weight_unit='weight_unit', weight_estimated='weight_estimated', temperature='temperature', pulse='pulse')
+        )
+        return self.annotate(latest_vitals=models.Subquery(exams[:1], output_field=models.JSONField()))
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0036_auto_20241101_1254'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['order', 'id'], name='animal_keyset_idx'),
+        ),
+    ]
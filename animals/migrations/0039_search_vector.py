@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from managers import build_search_vector
+
+
+SEARCH_VECTOR_FIELDS = (
+    ('name', 'A'), ('microchip', 'A'), ('address', 'B'), ('city', 'C'), ('request__address', 'B'), ('request__city', 'C'),
+    ('owners__address', 'B'), ('owners__city', 'C'), ('owners__first_name', 'A'), ('owners__last_name', 'A'),
+    ('reporter__first_name', 'A'), ('reporter__last_name', 'A'),
+)
+
+def populate_search_vector(apps, schema_editor):
+    Animal = apps.get_model('animals', 'Animal')
+    Animal.objects.update(search_vector=build_search_vector(Animal, SEARCH_VECTOR_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0038_updated_at'),
+        ('hotline', '0029_caltopo_feature_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='animal_search_idx'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0041_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animalimage',
+            name='original_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
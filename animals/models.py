@@ -1,4 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_save
+from images import ImageDerivatives
 from location.models import Location
 from ordered_model.models import OrderedModel
 
@@ -6,7 +10,7 @@ from animals.choices import ALL_AGE_CHOICES, ALL_SIZE_CHOICES, SEX_CHOICES, STAT
 from animals.colors import ALL_COLOR_CHOICES
 from .managers import AnimalQueryset
 from hotline.models import ServiceRequest
-from incident.models import Incident
+from incident.models import Incident, IncidentCounter
 from people.models import Person
 from shelter.models import Room, Shelter
 
@@ -69,6 +73,8 @@ class Animal(Location, OrderedModel):
     intake_date = models.DateTimeField(auto_now=False, auto_now_add=False, blank=True, null=True)
     microchip = models.CharField(max_length=50, blank=True)
     animal_count = models.IntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     order_with_respect_to = 'room'
     objects = AnimalQueryset.as_manager()
@@ -84,18 +90,39 @@ class Animal(Location, OrderedModel):
 
     def save(self, *args, **kwargs):
         if not self.pk:
-            total_animals = Animal.objects.select_for_update().filter(incident=self.incident).values_list('id', flat=True)
             with transaction.atomic():
-                count = len(total_animals)
-                self.id_for_incident = count + 1
+                self.id_for_incident = IncidentCounter.next_value(Animal, self.incident_id)
                 super(Animal, self).save(*args, **kwargs)
         else:
             super(Animal, self).save(*args, **kwargs)
 
     class Meta:
         ordering = ('order', 'id')
-
-class AnimalImage(models.Model):
+        indexes = [
+            # Keyset pagination for AnimalViewSet.
+            models.Index(fields=['order', 'id'], name='animal_keyset_idx'),
+            GinIndex(fields=['search_vector'], name='animal_search_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='animal_latlon_idx'),
+        ]
+
+# Reindex the animal and the SR and people that index its name.
+def refresh_search_vector(sender, instance, **kwargs):
+    Animal.objects.filter(pk=instance.pk).refresh_search_vector()
+    ServiceRequest.objects.filter(pk=instance.request_id).refresh_search_vector()
+    Person.objects.filter(models.Q(animal=instance) | models.Q(reporter_animals=instance)).refresh_search_vector()
+
+post_save.connect(refresh_search_vector, sender=Animal)
+
+def owners_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        animal_ids = (pk_set or []) if reverse else [instance.pk]
+        person_ids = [instance.pk] if reverse else (pk_set or [])
+        Animal.objects.filter(pk__in=animal_ids).refresh_search_vector()
+        Person.objects.filter(pk__in=person_ids).refresh_search_vector()
+
+m2m_changed.connect(owners_changed, sender=Animal.owners.through)
+
+class AnimalImage(ImageDerivatives):
 
     def get_upload_to(instance, filename):
         org_slug = instance.animal.incident.organization.slug
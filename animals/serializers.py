@@ -1,8 +1,11 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
 from rest_framework import serializers
 
 from .models import Animal, Species
-from location.utils import build_full_address, build_action_string
+from images import sign_image_urls
+from history import get_action_history
+from location.utils import build_full_address
 from people.serializers import SimplePersonSerializer
 from shelter.serializers import SimpleShelterSerializer
 from vet.models import Exam
@@ -28,8 +31,17 @@ class SimpleAnimalSerializer(serializers.ModelSerializer):
         model = Animal
         fields = ['id', 'id_for_incident', 'animal_count', 'species', 'species_string', 'category', 'aggressive', 'confined', 'injured', 'status', 'aco_required', 'name', 'sex', 'fixed', 'size', 'age', 'pcolor', 'scolor', 'last_seen', 'color_notes', 'behavior_notes', 'medical_notes']
 
+class AnimalListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # Sign the prefetched images of every animal together rather than one URL at a time.
+        animals = list(data.all() if isinstance(data, models.Manager) else data)
+        sign_image_urls([animal_image for animal in animals for animal_image in getattr(animal, 'images', [])])
+        return super(AnimalListSerializer, self).to_representation(animals)
+
 class ModestAnimalSerializer(SimpleAnimalSerializer):
     front_image = serializers.SerializerMethodField()
+    front_image_thumbnail = serializers.SerializerMethodField()
     found_location = serializers.SerializerMethodField()
     request_id_for_incident = serializers.SerializerMethodField()
     request_address = serializers.SerializerMethodField()
@@ -44,8 +56,9 @@ class ModestAnimalSerializer(SimpleAnimalSerializer):
 
     class Meta:
         model = Animal
+        list_serializer_class = AnimalListSerializer
         fields = ['id', 'id_for_incident', 'animal_count', 'name', 'species', 'species_string', 'confined', 'aggressive', 'injured', 'fixed', 'request', 'request_id_for_incident', 'found_location', 'request_address', 'request_lat_lon', 'shelter_object', 'shelter', 'status', 'aco_required', 'color_notes',
-        'microchip', 'front_image', 'intake_date', 'owners', 'owner_names', 'active_dispatch', 'sex', 'size', 'age', 'pcolor', 'scolor', 'medical_notes', 'medical_record', 'behavior_notes', 'room', 'room_name', 'category', 'latitude', 'longitude', 'weight', 'reporter', 'reporter_object']
+        'microchip', 'front_image', 'front_image_thumbnail', 'intake_date', 'owners', 'owner_names', 'active_dispatch', 'sex', 'size', 'age', 'pcolor', 'scolor', 'medical_notes', 'medical_record', 'behavior_notes', 'room', 'room_name', 'category', 'latitude', 'longitude', 'weight', 'reporter', 'reporter_object']
 
     def get_found_location(self, obj):
         return build_full_address(obj)
@@ -69,11 +82,15 @@ class ModestAnimalSerializer(SimpleAnimalSerializer):
 
     # Custom field for the current animal weight.
     def get_weight(self, obj):
-        exams = Exam.objects.filter(medical_record__patient=obj)
-        if exams:
-            exam = exams.latest('open')
-            text = '~' if exam.weight_estimated else ''
-            return text + str(exam.weight) + exam.weight_unit
+        if hasattr(obj, 'latest_vitals'):
+            vitals = obj.latest_vitals
+        else:
+            vitals = Exam.objects.filter(medical_record__patient=obj).order_by('-open', '-id').values('weight', 'weight_unit', 'weight_estimated').first()
+        if vitals:
+            text = '~' if vitals['weight_estimated'] else ''
+            # jsonb drops the fraction of whole floats, so restore it to match the FloatField value.
+            weight = float(vitals['weight']) if vitals['weight'] is not None else None
+            return text + str(weight) + (vitals['weight_unit'] or '')
         return ''
 
     def get_front_image(self, obj):
@@ -89,6 +106,11 @@ class ModestAnimalSerializer(SimpleAnimalSerializer):
             except AttributeError:
                 return ''
 
+    # Custom field for a small copy of the front image, falling back to the original until it is processed.
+    def get_front_image_thumbnail(self, obj):
+        images = obj.images if hasattr(obj, 'images') else obj.animalimage_set.all()
+        return next((animal_image.get_url('thumbnail') for animal_image in images if animal_image.category == 'front_image'), '')
+
     def get_side_image(self, obj):
         try:
             return [animal_image.image.url for animal_image in obj.images if animal_image.category == 'side_image'][0]
@@ -112,7 +134,8 @@ class AnimalSerializer(ModestAnimalSerializer):
 
     class Meta:
         model = Animal
-        fields = ['id', 'id_for_incident', 'animal_count', 'species', 'species_string', 'status', 'aco_required', 'front_image', 'side_image', 'extra_images', 'last_seen', 'intake_date', 'address', 'city', 'state', 'zip_code',
+        list_serializer_class = AnimalListSerializer
+        fields = ['id', 'id_for_incident', 'animal_count', 'species', 'species_string', 'status', 'aco_required', 'front_image', 'front_image_thumbnail', 'side_image', 'extra_images', 'last_seen', 'intake_date', 'address', 'city', 'state', 'zip_code',
         'aggressive', 'injured', 'fixed', 'confined', 'found_location', 'owner_names', 'owners', 'shelter_object', 'shelter', 'reporter', 'reporter_object', 'request', 'request_id_for_incident', 'request_address',
         'action_history', 'building_name', 'room', 'room_name', 'name', 'sex', 'size', 'age', 'pcolor', 'scolor', 'color_notes', 'behavior_notes', 'medical_notes',
         'latitude', 'longitude', 'medical_record', 'microchip', 'active_dispatch', 'vet_requests']
@@ -158,4 +181,4 @@ class AnimalSerializer(ModestAnimalSerializer):
                 return ''
 
     def get_action_history(self, obj):
-        return [build_action_string(action) for action in obj.target_actions.all()]
+        return get_action_history(self, obj)
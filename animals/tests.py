@@ -1,9 +1,37 @@
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 
 from accounts.models import ShelterlyUser
-from animals.models import Animal
-from incident.models import Incident
+from PIL import Image
+from actstream import action
+from actstream.models import Action
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from animals.models import Animal, AnimalImage
+from custom_storage import MediaStorage
+from images import url_matches_file
+from location.utils import build_action_string
+from incident.models import Incident, Organization
 from people.models import Person
+from shelter.models import Building, Room, Shelter
+from vet.models import Exam, MedicalRecord
+
+class OverwritingStorage(FileSystemStorage):
+    # Replaces existing files, like S3Boto3Storage with AWS_S3_FILE_OVERWRITE.
+    def get_available_name(self, name, max_length=None):
+        self.delete(name)
+        return name
 
 class TestViews(APITestCase):
 
@@ -53,3 +81,156 @@ class TestViews(APITestCase):
         response = self.client.post('/animals/api/animal/', {'new_owner':[self.new_owner.pk], 'name':'Phineas', 'incident_slug':self.incident.slug})
         self.assertEqual(response.status_code, 201)
         self.assertTrue(Animal.objects.filter(owners=self.new_owner, name='Phineas', status="REPORTED").exists())
+
+    def test_get_animals_paginated(self):
+        for name in ['Einstein', 'Darwin', 'Curie']:
+            Animal.objects.create(name=name, incident=self.incident)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/animals/api/animal/', {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNone(response.json()['next'])
+
+    def test_get_animals_invalid_cursor(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/animals/api/animal/', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_animals_latest_weight(self):
+        def add_animal(name):
+            animal = Animal.objects.create(name=name, incident=self.incident, medical_record=MedicalRecord.objects.create())
+            Exam.objects.create(medical_record=animal.medical_record, weight=10, weight_unit='lbs')
+            Exam.objects.create(medical_record=animal.medical_record, weight=12.5, weight_unit='lbs', weight_estimated=True)
+            return animal
+
+        def list_animals():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/animals/api/animal/')
+            return {animal['name']: animal['weight'] for animal in response.json()}, len(queries)
+
+        self.client.force_authenticate(self.user)
+        add_animal('Einstein')
+        weights, small = list_animals()
+        self.assertEqual(weights, {'bella': '', 'Einstein': '~12.5lbs'})
+        for name in ['Darwin', 'Curie', 'Turing']:
+            add_animal(name)
+        weights, large = list_animals()
+        self.assertEqual(weights['Turing'], '~12.5lbs')
+        # Weights are annotated, so the list costs the same number of queries at any size.
+        self.assertEqual(small, large)
+        self.assertEqual(Animal.objects.with_latest_vitals().get(name='Darwin').latest_vitals['weight'], 12.5)
+        # Whole weights keep their fraction, as the FloatField value does.
+        Exam.objects.create(medical_record=Animal.objects.get(name='Curie').medical_record, weight=12, weight_unit='lbs')
+        weights, _ = list_animals()
+        self.assertEqual(weights['Curie'], '12.0lbs')
+
+    def test_process_images(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        exif = Image.Exif()
+        # Rotated 90 degrees, with a GPS position.
+        exif[0x0112] = 6
+        exif[0x8825] = {2: (37.0, 46.0, 30.0)}
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (200, 100, 50)).save(buffer, 'JPEG', exif=exif)
+        with override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=media_root, MEDIA_URL='/media/'):
+            self.incident.organization = Organization.objects.create(name='Test', slug='test')
+            self.incident.save()
+            animal_image = AnimalImage.objects.create(image=SimpleUploadedFile('front.jpg', buffer.getvalue()), animal=self.animal, category='front_image')
+            self.client.force_authenticate(self.user)
+            # Lists use the original until the image is processed.
+            response = self.client.get('/animals/api/animal/')
+            self.assertEqual(response.json()[0]['front_image_thumbnail'], response.json()[0]['front_image'])
+            call_command('process_images', '--once')
+            animal_image.refresh_from_db()
+            self.assertIsNotNone(animal_image.processed_at)
+            with Image.open(animal_image.thumbnail.path) as thumbnail:
+                self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (171, 256)))
+            with Image.open(animal_image.image.path) as original:
+                self.assertEqual((original.format, original.size, len(original.getexif())), ('JPEG', (800, 1200), 0))
+            response = self.client.get('/animals/api/animal/')
+            self.assertEqual(response.json()[0]['front_image_thumbnail'], animal_image.thumbnail.url)
+            # Processed rows are not picked up again.
+            call_command('process_images', '--once')
+            self.assertEqual(AnimalImage.objects.get().image.name, animal_image.image.name)
+
+    def test_process_images_overwriting_storage(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), (200, 100, 50)).save(buffer, 'JPEG')
+        with override_settings(DEFAULT_FILE_STORAGE='animals.tests.OverwritingStorage', MEDIA_ROOT=media_root, MEDIA_URL='/media/'):
+            self.incident.organization = Organization.objects.create(name='Test', slug='test')
+            self.incident.save()
+            animal_image = AnimalImage.objects.create(image=SimpleUploadedFile('dog.jpg', buffer.getvalue()), animal=self.animal, category='front_image')
+            original_name = animal_image.image.name
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('process_images', '--once')
+            animal_image.refresh_from_db()
+            # The recompressed copy doesn't replace the upload in place, and the upload is removed after commit.
+            self.assertNotEqual(animal_image.image.name, original_name)
+            self.assertTrue(animal_image.image.storage.exists(animal_image.image.name))
+            self.assertFalse(animal_image.image.storage.exists(original_name))
+            # An extra image is kept when a form loaded before processing sends back its old URL.
+            extra_image = AnimalImage.objects.create(image=SimpleUploadedFile('extra.jpg', buffer.getvalue()), animal=self.animal, category='extra')
+            extra_url = extra_image.image.url
+            call_command('process_images', '--once')
+            self.client.force_authenticate(self.user)
+            response = self.client.patch(f'/animals/api/animal/{self.animal.pk}/', {'extra_images': [extra_url], 'front_image': 'keep'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(AnimalImage.objects.filter(id=extra_image.id).exists())
+
+    def test_signed_url_cache(self):
+        cache.clear()
+        storage = MediaStorage(access_key='key', secret_key='secret', bucket_name='bucket', region_name='us-west-2')
+        with patch.object(S3Boto3Storage, 'url', autospec=True, side_effect=S3Boto3Storage.url) as sign:
+            url = storage.url('images/test/1/front.jpg')
+            urls = storage.urls(['images/test/1/front.jpg', 'images/test/1/side.jpg'])
+            self.assertEqual(storage.url('images/test/1/side.jpg'), urls['images/test/1/side.jpg'])
+        # Each file is signed once, and then reused.
+        self.assertEqual(sign.call_count, 2)
+        self.assertEqual(urls['images/test/1/front.jpg'], url)
+        self.assertIn('Signature=', url)
+        # Uploaded images are matched by storage name rather than their signed URL.
+        animal_image = AnimalImage(image='images/test/1/front.jpg')
+        self.assertTrue(url_matches_file(url, animal_image.image))
+        self.assertFalse(url_matches_file(urls['images/test/1/side.jpg'], animal_image.image))
+
+    def test_animal_history(self):
+        for index in range(30):
+            action.send(self.user, verb='updated animal', target=self.animal)
+        self.client.force_authenticate(self.user)
+        # Lists don't load history.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/animals/api/animal/')
+        self.assertFalse([query for query in queries if 'actstream_action' in query['sql']])
+        response = self.client.get(f'/animals/api/animal/{self.animal.pk}/')
+        self.assertEqual(len(response.json()['action_history']), 30)
+        # The history route pages through actions newest first.
+        response = self.client.get(f'/animals/api/animal/{self.animal.pk}/history/')
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()['results']
+        self.assertEqual(len(first_page), 25)
+        self.assertEqual(first_page[0]['description'], build_action_string(Action.objects.get(id=first_page[0]['id'])))
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIsNone(response.json()['next'])
+        ids = [item['id'] for item in first_page + response.json()['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(self.client.get('/animals/api/animal/0/history/').status_code, 404)
+
+    def test_update_animal_buffers_actions(self):
+        shelter = Shelter.objects.create(name='Shelter', incident=self.incident)
+        room = Room.objects.create(name='Room', building=Building.objects.create(name='Building', shelter=shelter))
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/animals/api/animal/{self.animal.pk}/', {'shelter':shelter.pk, 'room':room.pk, 'name':'Darwin'})
+        self.assertEqual(response.status_code, 200)
+        # Every action of the update is written with one INSERT.
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "actstream_action"')]), 1)
+        self.assertEqual(sorted(Action.objects.values_list('verb', flat=True)), [
+            'changed animal status to SHELTERED', 'roomed animal', 'roomed animal', 'roomed animal in', 'sheltered animal', 'sheltered animal in', 'updated animal',
+        ])
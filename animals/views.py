@@ -7,15 +7,21 @@ from functools import reduce
 from django.shortcuts import get_object_or_404
 from copy import deepcopy
 from datetime import datetime
-from rest_framework import filters, permissions, viewsets
-from actstream import action
+from rest_framework import permissions, viewsets
 
 from animals.models import Animal, AnimalImage, Species
 from animals.serializers import AnimalSerializer, ModestAnimalSerializer, SpeciesSerializer
+from activity import buffered_actions, send_action
+from history import ActionHistoryMixin
+from images import url_matches_image
 from incident.models import Incident
+from location.filters import LocationFilter
 from shelter.models import IntakeSummary
 from people.serializers import SimplePersonSerializer
 from vet.models import MedicalRecord, VetRequest
+from pagination import KeysetPagination
+from search import FullTextSearchFilter
+from sync import DeltaSyncMixin
 
 class MultipleFieldLookupMixin(object):
     def get_object(self):
@@ -28,11 +34,15 @@ class MultipleFieldLookupMixin(object):
         obj = get_object_or_404(queryset, **filter)
         return obj
 
-class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
+class AnimalPagination(KeysetPagination):
+    ordering = ('order', 'id')
+
+class AnimalViewSet(ActionHistoryMixin, DeltaSyncMixin, MultipleFieldLookupMixin, viewsets.ModelViewSet):
     queryset = Animal.objects.with_images().exclude(status="CANCELED").order_by('order')
     lookup_fields = ['pk', 'incident', 'id_for_incident']
-    search_fields = ['name', 'microchip', 'address', 'city', 'request__address', 'request__city', 'owners__address', 'owners__city', 'owners__last_name', 'reporter__last_name']
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (FullTextSearchFilter, LocationFilter)
+    pagination_class = AnimalPagination
+    sync_related_fields = ('request',)
     permission_classes = [permissions.IsAuthenticated, ]
     serializer_class = ModestAnimalSerializer
     detail_serializer_class = AnimalSerializer
@@ -43,15 +53,14 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                 return self.detail_serializer_class
         return super(AnimalViewSet, self).get_serializer_class()
 
-    # @transaction.atomic
+    @transaction.atomic
+    @buffered_actions()
     def perform_create(self, serializer):
 
             if serializer.is_valid():
 
-                total_animals = Animal.objects.select_for_update().filter(incident__slug=self.request.data.get('incident_slug')).values_list('id', flat=True)
+                # id_for_incident is allocated by Animal.save().
                 with transaction.atomic():
-                    count = len(total_animals)
-                    serializer.validated_data['id_for_incident'] = count + 1
 
                     # Set status to SHELTERED if a shelter is added.
                     if serializer.validated_data.get('shelter'):
@@ -63,7 +72,7 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
 
                     animal = serializer.save()
                     animals = [animal]
-                    action.send(self.request.user, verb='created animal', target=animal)
+                    send_action(self.request.user, verb='created animal', target=animal)
 
                     # Add Owner to new animals if included.
                     if self.request.data.get('new_owner', 'undefined') != 'undefined':
@@ -82,13 +91,13 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                         vet_request.presenting_complaints.add(*self.request.data.get('presenting_complaints').split(','))
 
                     if animal.shelter:
-                        action.send(self.request.user, verb='sheltered animal in', target=animal, action_object=animal.shelter)
-                        action.send(self.request.user, verb='sheltered animal', target=animal.shelter, action_object=animal)
+                        send_action(self.request.user, verb='sheltered animal in', target=animal, action_object=animal.shelter)
+                        send_action(self.request.user, verb='sheltered animal', target=animal.shelter, action_object=animal)
 
                     if animal.room:
-                        action.send(self.request.user, verb='roomed animal in', target=animal, action_object=animal.room)
-                        action.send(self.request.user, verb='roomed animal', target=animal.room, action_object=animal)
-                        action.send(self.request.user, verb='roomed animal', target=animal.room.building, action_object=animal)
+                        send_action(self.request.user, verb='roomed animal in', target=animal, action_object=animal.room)
+                        send_action(self.request.user, verb='roomed animal', target=animal.room, action_object=animal)
+                        send_action(self.request.user, verb='roomed animal', target=animal.room.building, action_object=animal)
 
                     images_data = self.request.FILES
                     for key, image_data in images_data.items():
@@ -105,6 +114,8 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                     if animal.request:
                         animal.request.update_status(self.request.user)
 
+    @transaction.atomic
+    @buffered_actions()
     def perform_update(self, serializer):
         from evac.models import AssignedRequest
 
@@ -117,46 +128,36 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
             if serializer.validated_data.get('shelter') and not serializer.instance.shelter:
                 serializer.validated_data['status'] = 'SHELTERED'
                 serializer.validated_data['intake_date'] = datetime.now()
-                action.send(self.request.user, verb='sheltered animal in', target=serializer.instance, action_object=serializer.validated_data.get('shelter'))
-                action.send(self.request.user, verb='sheltered animal', target=serializer.validated_data.get('shelter'), action_object=serializer.instance)
+                send_action(self.request.user, verb='sheltered animal in', target=serializer.instance, action_object=serializer.validated_data.get('shelter'))
+                send_action(self.request.user, verb='sheltered animal', target=serializer.validated_data.get('shelter'), action_object=serializer.instance)
 
             # If animal already had a shelter and now has a different shelter.
             if serializer.validated_data.get('shelter') and serializer.instance.shelter and serializer.instance.shelter != serializer.validated_data.get('shelter'):
-                action.send(self.request.user, verb='sheltered animal in', target=serializer.instance, action_object=serializer.validated_data.get('shelter'))
-                action.send(self.request.user, verb='sheltered animal', target=serializer.validated_data.get('shelter'), action_object=serializer.instance)
+                send_action(self.request.user, verb='sheltered animal in', target=serializer.instance, action_object=serializer.validated_data.get('shelter'))
+                send_action(self.request.user, verb='sheltered animal', target=serializer.validated_data.get('shelter'), action_object=serializer.instance)
 
             # If animal had a shelter and now doesn't or has a different shelter.
             if serializer.instance.shelter and (serializer.instance.shelter != serializer.validated_data.get('shelter', serializer.instance.shelter)):
-                action.send(self.request.user, verb='removed animal', target=serializer.instance.shelter, action_object=serializer.instance)
+                send_action(self.request.user, verb='removed animal', target=serializer.instance.shelter, action_object=serializer.instance)
 
             # If animal had a room and now doesn't or has a different room.
             if serializer.instance.room and (not serializer.validated_data.get('room') or serializer.instance.room != serializer.validated_data.get('room')):
-                action.send(self.request.user, verb='removed animal', target=serializer.instance.room, action_object=serializer.instance)
-                action.send(self.request.user, verb='removed animal', target=serializer.instance.room.building, action_object=serializer.instance)
+                send_action(self.request.user, verb='removed animal', target=serializer.instance.room, action_object=serializer.instance)
+                send_action(self.request.user, verb='removed animal', target=serializer.instance.room.building, action_object=serializer.instance)
 
             # If animal is added to a new room from no room or a different room.
             if serializer.validated_data.get('room') and (serializer.instance.room != serializer.validated_data.get('room')):
-                action.send(self.request.user, verb='roomed animal in', target=serializer.instance, action_object=serializer.validated_data.get('room'))
-                action.send(self.request.user, verb='roomed animal', target=serializer.validated_data.get('room'), action_object=serializer.instance)
-                action.send(self.request.user, verb='roomed animal', target=serializer.validated_data.get('room').building, action_object=serializer.instance)
+                send_action(self.request.user, verb='roomed animal in', target=serializer.instance, action_object=serializer.validated_data.get('room'))
+                send_action(self.request.user, verb='roomed animal', target=serializer.validated_data.get('room'), action_object=serializer.instance)
+                send_action(self.request.user, verb='roomed animal', target=serializer.validated_data.get('room').building, action_object=serializer.instance)
 
             # Record status change if appplicable.
             if serializer.instance.status != serializer.validated_data.get('status', serializer.instance.status):
                 new_status = serializer.validated_data.get('status')
                 if serializer.instance.request:
                     serializer.instance.request.update_status(self.request.user)
-                    for assigned_request in AssignedRequest.objects.filter(service_request=serializer.instance.request, dispatch_assignment__end_time=None):
-                        assigned_request.animals[str(serializer.instance.id)]['status'] = new_status
-                        assigned_request.save()
-
-                    # AssignedRequest.objects.filter(service_request=serializer.instance.request, dispatch_assignment__end_time=None).update(animals=Func(
-                    #   F("animals"),
-                    #   Value([str(serializer.instance.id)]),
-                    #   Value(["status"]),
-                    #   Value("REUNITED", JSONField()),
-                    #   function="jsonb_set",
-                    # ))
-                action.send(self.request.user, verb=f'changed animal status to {new_status}', target=serializer.instance)
+                    AssignedRequest.objects.filter(service_request=serializer.instance.request, dispatch_assignment__end_time=None).patch_animal_fields([serializer.instance.id], status=new_status)
+                send_action(self.request.user, verb=f'changed animal status to {new_status}', target=serializer.instance)
 
             # Identify if there were any animal changes that aren't status, shelter, room, or owner.
             changed_fields = []
@@ -172,9 +173,7 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
             if self.request.data.get('remove_animal'):
                 Animal.objects.filter(id=self.request.data.get('remove_animal')).update(status='CANCELED', shelter=None, room=None)
                 animal = Animal.objects.get(id=self.request.data.get('remove_animal'))
-                for assigned_request in AssignedRequest.objects.filter(service_request=animal.request, dispatch_assignment__end_time=None):
-                    assigned_request.animals[str(self.request.data.get('remove_animal'))]['status'] = 'CANCELED'
-                    assigned_request.save()
+                AssignedRequest.objects.filter(service_request=animal.request, dispatch_assignment__end_time=None).patch_animal_fields([animal.id], status='CANCELED')
 
             # Set order if present, add 1 to avoid 0 index since order is a PositiveIntergerField.
             if type(self.request.data.get('set_order', '')) == int:
@@ -182,20 +181,17 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
 
             # Only record animal update if a field other than status, shelter, room, order, or owner has changed.
             if len(changed_fields) > 0:
-                action.send(self.request.user, verb='updated animal', target=animal)
+                send_action(self.request.user, verb='updated animal', target=animal)
 
             # Remove Owner from animal.
             if self.request.data.get('remove_owner'):
                 animal.owners.remove(self.request.data.get('remove_owner'))
             # Split group
             elif self.request.data.get('group_2'):
-                total_animals = Animal.objects.select_for_update().filter(incident__slug=self.request.data.get('incident')).values_list('id', flat=True)
                 with transaction.atomic():
-                    count = len(total_animals)
                     new_animal = deepcopy(animal)
                     new_animal.id = None
                     new_animal.animal_count = self.request.data.get('group_2')
-                    new_animal.id_for_incident = count
                     new_animal.save()
                     new_animal.owners.set(animal.owners.all())
 
@@ -204,16 +200,12 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                 if key in self.request.FILES.keys() or not self.request.data.get(key, ''):
                     AnimalImage.objects.filter(animal=animal, category=key).delete()
 
-            def strip_s3(url):
-                return url.split("?AWSAccessKeyId")[0]
-
             # Remove extra images that have been removed.
             if 'extra_images' in self.request.data:
                 extra_data = self.request.data.get('extra_images', '')
-                extra_images_list = extra_data if type(extra_data) is list else extra_data.split(',')
-                remaining_extra_urls = [strip_s3(url) for url in extra_images_list]
+                remaining_extra_urls = [url for url in (extra_data if type(extra_data) is list else extra_data.split(',')) if url]
                 for extra_image in AnimalImage.objects.filter(animal=animal, category="extra"):
-                    if strip_s3(extra_image.image.url) not in remaining_extra_urls:
+                    if not any(url_matches_image(url, extra_image) for url in remaining_extra_urls):
                         extra_image.delete()
 
             #Create new files from uploads
@@ -232,7 +224,7 @@ class AnimalViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
             images (List of AnimalImages)
         """
         queryset = (
-            Animal.objects.with_images().with_history().exclude(status="CANCELED").distinct()
+            Animal.objects.with_images().with_latest_vitals().exclude(status="CANCELED").distinct()
             .prefetch_related("owners")
             .select_related("reporter", "room", "request", "shelter")
             .order_by('order')
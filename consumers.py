@@ -1,20 +1,123 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+def map_group_name(incident_slug):
+    # Channel layer group names only allow ASCII alphanumerics, hyphens, underscores and periods.
+    return 'map.%s' % re.sub(r'[^a-zA-Z0-9_.-]', '_', incident_slug)[:90]
+
+def build_map_event(instance, entity):
+    """
+    Returns a change event for a ServiceRequest or EvacAssignment that map clients can
+    apply to their local state without refetching.
+    """
+    event = {
+        'entity': entity,
+        'id': instance.id,
+        'id_for_incident': instance.id_for_incident,
+    }
+    if entity == 'service_request':
+        event['status'] = instance.status
+        event['priority'] = instance.priority
+        event['latitude'] = float(instance.latitude) if instance.latitude is not None else None
+        event['longitude'] = float(instance.longitude) if instance.longitude is not None else None
+    elif entity == 'evac_assignment':
+        event['status'] = 'closed' if instance.end_time else 'open'
+        event['team'] = instance.team.name if instance.team else None
+    return event
+
+def threads_available():
+    # Lambda freezes the process once an invocation returns, so a pending timer may never fire.
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        return False
+    try:
+        import uwsgi
+    except ImportError:
+        return True
+    # uwsgi only runs threads started by the app with enable-threads (or threads) set.
+    return bool(uwsgi.opt.get('enable-threads') or uwsgi.opt.get('threads'))
+
+def send_map_events(incident_slug, events):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(map_group_name(incident_slug), {"type":"map_events", "events":events})
+
+class MapEventCoalescer(object):
+    """
+    Buffers map events per incident and broadcasts them as one merged message per window.
+
+    Broadcasting happens on a timer thread, so request latency does not depend on the
+    channel layer. Where background threads can't run (uwsgi without enable-threads, or
+    Lambda), or the window is 0, events are broadcast immediately instead. A later event
+    for the same entity and id replaces the buffered one.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.threaded = window > 0 and threads_available()
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.timers = {}
+
+    def add(self, incident_slug, events):
+        with self.lock:
+            buffer = self.buffers.setdefault(incident_slug, OrderedDict())
+            for event in events:
+                key = (event['entity'], event['id'])
+                buffer.pop(key, None)
+                buffer[key] = event
+            if self.threaded and incident_slug not in self.timers:
+                timer = threading.Timer(self.window, self.flush, args=[incident_slug])
+                timer.daemon = True
+                self.timers[incident_slug] = timer
+                timer.start()
+        if not self.threaded:
+            self.flush(incident_slug)
+
+    def flush(self, incident_slug):
+        with self.lock:
+            timer = self.timers.pop(incident_slug, None)
+            buffer = self.buffers.pop(incident_slug, None)
+        if timer:
+            timer.cancel()
+        if buffer:
+            try:
+                send_map_events(incident_slug, list(buffer.values()))
+            except Exception:
+                logger.exception('Unable to send map events for incident %s', incident_slug)
+
+map_event_coalescer = MapEventCoalescer(getattr(settings, 'MAP_EVENT_WINDOW', 0.5))
+
+def queue_map_events(incident_slug, events):
+    # Only notify maps once the change is committed and visible to their refetches.
+    transaction.on_commit(lambda: map_event_coalescer.add(incident_slug, events))
 
 class WSConsumer(AsyncWebsocketConsumer):
 
     async def connect(self):
+        self.group_name = map_group_name(self.scope['url_route']['kwargs']['incident_slug'])
         await self.channel_layer.group_add(
-            "map",
+            self.group_name,
             self.channel_name
         )
         await self.accept()
 
     async def disconnect(self, message):
         await self.channel_layer.group_discard(
-            "map",
+            self.group_name,
             self.channel_name
         )
         pass
 
-    async def new_data(self, message):
-        await self.send(text_data="new data")
\ No newline at end of file
+    async def map_events(self, message):
+        await self.send(text_data=json.dumps({"events":message["events"]}))
@@ -1,10 +1,41 @@
+import hashlib
+
 from storages.backends.s3boto3 import S3Boto3Storage
 from django.conf import settings
+from django.core.cache import cache
+
+# Signed URLs are reused until this fraction of their lifetime has passed, so clients always get some validity left.
+SIGNED_URL_REUSE = 0.8
 
 class MediaStorage(S3Boto3Storage):
 
     location = 'media'
 
+    def get_url_cache_key(self, name, expire):
+        return 'signed-url:%s' % hashlib.sha1(('%s:%s:%s:%s' % (self.bucket_name, self.location, expire, name)).encode('utf-8')).hexdigest()
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if parameters or http_method or not self.querystring_auth:
+            return super(MediaStorage, self).url(name, parameters, expire, http_method)
+        return self.urls([name], expire)[name]
+
+    def urls(self, names, expire=None):
+        """
+        Returns {name: signed url} for many files, signing only those without a cached URL.
+        """
+        expire = expire or self.querystring_expire
+        keys = {name: self.get_url_cache_key(name, expire) for name in names}
+        cached = cache.get_many(keys.values())
+        urls = {name: cached[key] for name, key in keys.items() if key in cached}
+        signed = {}
+        for name in keys:
+            if name not in urls:
+                signed[name] = super(MediaStorage, self).url(name, expire=expire)
+        if signed:
+            cache.set_many({keys[name]: url for name, url in signed.items()}, int(expire * SIGNED_URL_REUSE))
+        urls.update(signed)
+        return urls
+
 class StaticStorage(S3Boto3Storage):
     
     location = 'static/%s' % (settings.SHELTERLY_VERSION)
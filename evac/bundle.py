@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from animals.models import Animal, AnimalImage
+from hotline.models import ServiceRequest, ServiceRequestNote, VisitNote
+from people.models import Person
+from .models import AssignedRequest, EvacTeamMember
+
+# Bumped whenever the bundle layout changes, so clients can tell old bundles apart.
+BUNDLE_FORMAT = 1
+
+LOCATION_FIELDS = ['address', 'apartment', 'city', 'state', 'zip_code', 'latitude', 'longitude']
+
+def group_ids(pairs):
+    grouped = {}
+    for key, value in pairs:
+        grouped.setdefault(key, []).append(value)
+    return grouped
+
+def build_bundle(evac_assignment):
+    """
+    Returns everything a field team needs to work a DA offline as a flat dict of row lists.
+
+    Rows refer to each other by id, so people and animals shared between SRs are sent once.
+    """
+    assigned_requests = list(AssignedRequest.objects.filter(dispatch_assignment=evac_assignment).values(
+        'id', 'service_request', 'animals', 'followup_date', 'timestamp', 'route_order', 'visit_note', 'owner_contact',
+    ))
+    sr_ids = [assigned_request['service_request'] for assigned_request in assigned_requests if assigned_request['service_request']]
+
+    service_requests = list(ServiceRequest.objects.filter(id__in=sr_ids).order_by('id').values(
+        'id', 'id_for_incident', *LOCATION_FIELDS, 'directions', 'status', 'priority', 'followup_date', 'verbal_permission', 'key_provided',
+        'accessible', 'turn_around', 'sip', 'utl', 'reporter',
+    ))
+    sr_owners = group_ids(ServiceRequest.owners.through.objects.filter(servicerequest_id__in=sr_ids).order_by('id').values_list('servicerequest_id', 'person_id'))
+
+    animals = list(Animal.objects.filter(request_id__in=sr_ids).order_by('id').values(
+        'id', 'id_for_incident', 'request', 'name', 'species__name', 'status', 'sex', 'age', 'size', 'pcolor', 'scolor', 'color_notes',
+        'behavior_notes', 'medical_notes', 'aggressive', 'aco_required', 'injured', 'fixed', 'confined', 'animal_count', 'last_seen', 'reporter',
+    ))
+    animal_ids = [animal['id'] for animal in animals]
+    animal_owners = group_ids(Animal.owners.through.objects.filter(animal_id__in=animal_ids).order_by('id').values_list('animal_id', 'person_id'))
+
+    person_ids = set()
+    for service_request in service_requests:
+        service_request['owners'] = sr_owners.get(service_request['id'], [])
+        person_ids.update(service_request['owners'])
+        person_ids.add(service_request['reporter'])
+    for animal in animals:
+        animal['species'] = animal.pop('species__name')
+        animal['owners'] = animal_owners.get(animal['id'], [])
+        person_ids.update(animal['owners'])
+        person_ids.add(animal['reporter'])
+    people = list(Person.objects.filter(id__in=person_ids).order_by('id').values(
+        'id', 'first_name', 'last_name', 'phone', 'alt_phone', 'email', 'agency', *LOCATION_FIELDS,
+    ))
+
+    # Earlier visits to the same SRs, from this or other DAs.
+    visit_notes = list(VisitNote.objects.filter(assigned_request__service_request_id__in=sr_ids).order_by('id').values(
+        'id', 'assigned_request__service_request', 'date_completed', 'notes', 'forced_entry',
+    ))
+    for visit_note in visit_notes:
+        visit_note['service_request'] = visit_note.pop('assigned_request__service_request')
+    notes = list(ServiceRequestNote.objects.filter(service_request_id__in=sr_ids).order_by('id').values(
+        'id', 'service_request', 'open', 'urgent', 'notes',
+    ))
+    # Images are only referenced, for clients to download separately.
+    images = list(AnimalImage.objects.filter(animal_id__in=animal_ids).order_by('id').values('id', 'animal', 'category', 'image', 'thumbnail'))
+
+    team = None
+    team_members = []
+    if evac_assignment.team_id:
+        team = {'id': evac_assignment.team_id, 'name': evac_assignment.team.name}
+        team_members = list(EvacTeamMember.objects.filter(dispatchteam=evac_assignment.team_id).order_by('id').values('id', 'first_name', 'last_name', 'phone', 'agency_id'))
+        team['team_members'] = [team_member['id'] for team_member in team_members]
+
+    return {
+        'format': BUNDLE_FORMAT,
+        'evac_assignment': {
+            'id': evac_assignment.id, 'id_for_incident': evac_assignment.id_for_incident, 'start_time': evac_assignment.start_time,
+            'end_time': evac_assignment.end_time, 'closed': evac_assignment.closed, 'team': evac_assignment.team_id,
+        },
+        'team': team,
+        'team_members': team_members,
+        'assigned_requests': assigned_requests,
+        'service_requests': service_requests,
+        'animals': animals,
+        'people': people,
+        'visit_notes': visit_notes,
+        'notes': notes,
+        'images': images,
+    }
+
+def get_bundle_version(bundle):
+    """
+    Returns a short hash of the bundle's contents, for use as its ETag.
+    """
+    encoded = json.dumps(bundle, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+def add_image_urls(bundle):
+    # Signed storage URLs differ on every request, so they are added after the version is taken.
+    storage = AnimalImage._meta.get_field('image').storage
+    if hasattr(storage, 'urls'):
+        storage.urls([name for image in bundle['images'] for name in (image['image'], image['thumbnail']) if name])
+    for image in bundle['images']:
+        image['url'] = storage.url(image['image'])
+        image['thumbnail_url'] = storage.url(image['thumbnail'] or image['image'])
+
+def encode_bundle(bundle, compress=False):
+    encoded = json.dumps(bundle, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(encoded, compresslevel=6) if compress else encoded
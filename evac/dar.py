@@ -0,0 +1,291 @@
+from collections import defaultdict
+from copy import deepcopy
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from actstream.models import Action
+
+from activity import build_action
+from consumers import build_map_event, queue_map_events
+from animals.models import Animal, Species
+from hotline.models import ServiceRequest, VisitNote
+from incident.models import IncidentCounter
+from people.models import OwnerContact, Person
+from shelter.models import Room, Shelter
+from .models import DISPATCH_ANIMAL_STATUSES, AssignedRequest
+
+# Fields written back to existing animals from a DAR form.
+ANIMAL_FIELDS = ['animal_count', 'status', 'shelter', 'room', 'intake_date', 'address', 'city', 'state', 'zip_code', 'latitude', 'longitude']
+# Keys the DAR form sends with new animals that are not Animal fields.
+EXTRA_ANIMAL_KEYS = ['animal_notes', 'priority', 'presenting_complaints', 'concern', 'caution', 'new']
+
+def build_form_snapshot(animal_dict, id_for_incident, animal_count):
+    return {
+        'id_for_incident': id_for_incident,
+        'animal_count': animal_count,
+        'name': animal_dict.get('name'),
+        'age': animal_dict.get('age'),
+        'sex': animal_dict.get('sex'),
+        'size': animal_dict.get('size'),
+        'species': animal_dict.get('species'),
+        'status': animal_dict.get('status'),
+        'color_notes': animal_dict.get('color_notes'),
+        'pcolor': animal_dict.get('pcolor'),
+        'scolor': animal_dict.get('scolor'),
+        'last_seen': animal_dict.get('last_seen'),
+        'shelter': animal_dict.get('shelter'),
+        'room': animal_dict.get('room'),
+        'animal_notes': animal_dict.get('animal_notes'),
+        'medical_notes': animal_dict.get('medical_notes'),
+        'aggressive': animal_dict.get('aggressive'),
+        'aco_required': animal_dict.get('aco_required'),
+        'injured': animal_dict.get('injured'),
+        'fixed': animal_dict.get('fixed'),
+        'confined': animal_dict.get('confined'),
+    }
+
+class DARSubmission(object):
+    """
+    Applies the sr_updates of a Dispatch Assignment Result form to a DA.
+
+    Every SR, animal, AssignedRequest and lookup the form refers to is loaded with one
+    query per type, the changes are made in memory, and they are written back with
+    bulk_create/bulk_update in a single transaction.
+    """
+
+    def __init__(self, evac_assignment, user):
+        self.evac_assignment = evac_assignment
+        self.user = user
+        self.actions = []
+        # Animals created from the form, by id() of the form's animal dict.
+        self.created = {}
+
+    def load(self, sr_updates):
+        sr_ids = {service_request['id'] for service_request in sr_updates}
+        animal_dicts = [animal_dict for service_request in sr_updates for animal_dict in service_request['animals']]
+        new_dicts = [animal_dict for animal_dict in animal_dicts if not animal_dict.get('id') and not animal_dict.get('original_id')]
+        sr_ids.update(animal_dict.get('request') for animal_dict in new_dicts)
+
+        self.service_requests = ServiceRequest.objects.in_bulk(sr_ids)
+        self.map_events = {sr_id: build_map_event(sr, 'service_request') for sr_id, sr in self.service_requests.items()}
+        self.animals = Animal.objects.in_bulk([animal_dict.get('id') or animal_dict.get('original_id') for animal_dict in animal_dicts if animal_dict.get('id') or animal_dict.get('original_id')])
+        self.assigned_requests = {
+            assigned_request.service_request_id: assigned_request
+            for assigned_request in AssignedRequest.objects.filter(dispatch_assignment=self.evac_assignment, service_request_id__in=sr_ids).select_related('visit_note', 'owner_contact')
+        }
+        self.owners = Person.objects.in_bulk([service_request['owner_contact_id'] for service_request in sr_updates if service_request.get('owner_contact_id')])
+        self.species = {species.name: species for species in Species.objects.filter(name__in=[animal_dict.get('species') for animal_dict in new_dicts])}
+        self.rooms = Room.objects.in_bulk([animal_dict['room'] for animal_dict in new_dicts if animal_dict.get('room')])
+
+    def create_animals(self, sr_updates):
+        """
+        Builds the copies of split animals and the animals newly found in the field, and bulk creates them with their owners.
+        """
+        new_animals = []
+        owner_sources = []
+        for service_request in sr_updates:
+            for animal_dict in service_request['animals']:
+                if animal_dict.get('id'):
+                    continue
+                if animal_dict.get('original_id'):
+                    original = self.animals[animal_dict['original_id']]
+                    animal = deepcopy(original)
+                    animal.id = None
+                    animal.medical_record = None
+                    animal.animal_count = animal_dict['animal_count']
+                    owner_sources.append(('animal', original.id))
+                else:
+                    fields = {key: value for key, value in animal_dict.items() if key not in EXTRA_ANIMAL_KEYS}
+                    fields.update(
+                        request=self.service_requests[animal_dict.get('request')],
+                        room=self.rooms.get(animal_dict.get('room')),
+                        shelter=None,
+                        species=self.species[animal_dict.get('species')],
+                        incident_id=self.evac_assignment.incident_id,
+                        behavior_notes=animal_dict.get('animal_notes'),
+                    )
+                    animal = Animal(**fields)
+                    owner_sources.append(('service_request', animal.request_id))
+                self.created[id(animal_dict)] = animal
+                new_animals.append(animal)
+        if not new_animals:
+            return
+
+        for animal, id_for_incident in zip(new_animals, IncidentCounter.next_values(Animal, self.evac_assignment.incident_id, len(new_animals))):
+            animal.id_for_incident = id_for_incident
+        # New animals go to the end of their room's ordering, as OrderedModel.save() would place them.
+        rooms = {animal.room_id for animal in new_animals if animal.order is None}
+        max_orders = dict(Animal.objects.filter(Q(room_id__in=rooms) | Q(room=None)).order_by().values('room_id').annotate(max_order=Max('order')).values_list('room_id', 'max_order'))
+        for animal in new_animals:
+            if animal.order is None:
+                max_orders[animal.room_id] = animal.order = (max_orders.get(animal.room_id) if max_orders.get(animal.room_id) is not None else -1) + 1
+        Animal.objects.bulk_create(new_animals)
+
+        # Copies keep the owners of the animal they were split from, new animals take the SR's owners.
+        owners = defaultdict(list)
+        for servicerequest_id, person_id in ServiceRequest.owners.through.objects.filter(servicerequest_id__in=[source_id for kind, source_id in owner_sources if kind == 'service_request']).values_list('servicerequest_id', 'person_id'):
+            owners[('service_request', servicerequest_id)].append(person_id)
+        for animal_id, person_id in Animal.owners.through.objects.filter(animal_id__in=[source_id for kind, source_id in owner_sources if kind == 'animal']).values_list('animal_id', 'person_id'):
+            owners[('animal', animal_id)].append(person_id)
+        Animal.owners.through.objects.bulk_create([
+            Animal.owners.through(animal_id=animal.id, person_id=person_id) for animal, source in zip(new_animals, owner_sources) for person_id in owners[source]
+        ])
+        # bulk_create skips the post_save and m2m_changed reindexing.
+        Animal.objects.filter(id__in=[animal.id for animal in new_animals]).refresh_search_vector()
+        ServiceRequest.objects.filter(id__in={animal.request_id for animal in new_animals}).refresh_search_vector()
+        Person.objects.filter(id__in={person_id for person_ids in owners.values() for person_id in person_ids}).refresh_search_vector()
+
+    def update_animals(self, sr_updates):
+        updated = []
+        relocated = []
+        for service_request in sr_updates:
+            sr = self.service_requests[service_request['id']]
+            animals_dict = {}
+            for animal_dict in service_request['animals']:
+                if animal_dict.get('id'):
+                    animal = self.animals[animal_dict['id']]
+                    animal.animal_count = animal_dict.get('animal_count', 1)
+                    animals_dict[animal.id] = build_form_snapshot(animal_dict, animal_dict.get('id_for_incident'), animal_dict.get('animal_count', 1))
+                else:
+                    animal = self.created[id(animal_dict)]
+                    animals_dict[animal.id] = build_form_snapshot(animal_dict, animal.id_for_incident, animal_dict.get('animal_count', 1))
+
+                # Record status change if applicable.
+                new_status = animal_dict.get('status')
+                if animal.status != new_status:
+                    self.actions.append(build_action(self.user, f'changed animal status to {new_status}', animal))
+                new_shelter = animal_dict.get('shelter') or None
+                if new_shelter and animal.shelter_id != new_shelter:
+                    self.actions.append(build_action(self.user, 'sheltered animal', animal))
+                    self.actions.append(build_action(self.user, 'sheltered animal', Shelter(id=new_shelter), action_object=animal))
+                    animal.intake_date = animal.intake_date or timezone.now()
+                # Update shelter, room, and intake_date info.
+                animal.status = new_status
+                animal.shelter_id = new_shelter
+                animal.room_id = animal_dict.get('room') or None
+                # Update animal found location with SR location if blank.
+                if not animal.address:
+                    animal.address, animal.city, animal.state, animal.zip_code, animal.latitude, animal.longitude = sr.address, sr.city, sr.state, sr.zip_code, sr.latitude, sr.longitude
+                    relocated.append(animal.id)
+                updated.append(animal)
+            self.assigned_requests[sr.id].animals = animals_dict
+
+        Animal.objects.bulk_update_values(updated, ANIMAL_FIELDS)
+        Animal.objects.filter(id__in=relocated).refresh_search_vector()
+
+    def update_assigned_requests(self, sr_updates, is_dar_form):
+        new_visit_notes = []
+        new_owner_contacts = []
+        visit_notes = []
+        owner_contacts = []
+        for service_request in sr_updates:
+            sr = self.service_requests[service_request['id']]
+            assigned_request = self.assigned_requests[sr.id]
+            # Only make these changes if saving a DAR Form.
+            if not is_dar_form:
+                continue
+            sr_followup_date = service_request.get('followup_date', sr.followup_date)
+            assigned_request.followup_date = sr_followup_date
+            sr.followup_date = sr_followup_date
+            sr.priority = service_request['priority']
+            sr.directions = service_request['directions']
+            # Only create VisitNote on first update, otherwise update existing VisitNote.
+            if service_request.get('date_completed'):
+                if not assigned_request.visit_note:
+                    assigned_request.visit_note = VisitNote(date_completed=service_request['date_completed'], notes=service_request['notes'], forced_entry=service_request['forced_entry'])
+                    new_visit_notes.append(assigned_request)
+                else:
+                    assigned_request.visit_note.date_completed = service_request['date_completed']
+                    assigned_request.visit_note.notes = service_request.get('notes', '')
+                    assigned_request.visit_note.forced_entry = service_request.get('forced_entry', False)
+                    visit_notes.append(assigned_request.visit_note)
+
+            # Create OwnerContact object if provided.
+            owner = self.owners.get(service_request.get('owner_contact_id'))
+            owner_contact_time = service_request['owner_contact_time'] if service_request.get('owner_contact_time') else None
+            owner_contact_note = service_request['owner_contact_note'] if service_request.get('owner_contact_note') else ''
+            if owner or owner_contact_time or owner_contact_note:
+                # Only create OwnerContact on first update, otherwise update existing OwnerContact.
+                if not assigned_request.owner_contact:
+                    assigned_request.owner_contact = OwnerContact(owner=owner, owner_contact_note=owner_contact_note, owner_contact_time=owner_contact_time)
+                    new_owner_contacts.append(assigned_request)
+                else:
+                    assigned_request.owner_contact.owner = owner
+                    assigned_request.owner_contact.owner_contact_note = owner_contact_note
+                    assigned_request.owner_contact.owner_contact_time = owner_contact_time
+                    owner_contacts.append(assigned_request.owner_contact)
+
+        # Save the new VisitNotes and OwnerContacts first so their ids can be set on the AssignedRequests.
+        VisitNote.objects.bulk_create([assigned_request.visit_note for assigned_request in new_visit_notes])
+        OwnerContact.objects.bulk_create([assigned_request.owner_contact for assigned_request in new_owner_contacts])
+        # Reassigning copies the new primary keys onto the foreign key columns.
+        for assigned_request in new_visit_notes:
+            assigned_request.visit_note = assigned_request.visit_note
+        for assigned_request in new_owner_contacts:
+            assigned_request.owner_contact = assigned_request.owner_contact
+        VisitNote.objects.bulk_update(visit_notes, ['date_completed', 'notes', 'forced_entry'])
+        OwnerContact.objects.bulk_update(owner_contacts, ['owner', 'owner_contact_note', 'owner_contact_time'])
+        AssignedRequest.objects.bulk_update(self.assigned_requests.values(), ['animals', 'followup_date', 'visit_note', 'owner_contact'])
+
+        # SRs the team could not complete are removed from the DA.
+        incomplete = [self.assigned_requests[service_request['id']].id for service_request in sr_updates if service_request.get('unable_to_complete', False)]
+        if incomplete:
+            AssignedRequest.objects.filter(id__in=incomplete).delete()
+
+    def update_service_requests(self, sr_updates):
+        """
+        Sets the SIP/UTL flags and status of each SR the way update_sip_utl() and update_status() do, from one query of its animals.
+        """
+        sr_ids = [service_request['id'] for service_request in sr_updates]
+        statuses = defaultdict(list)
+        for request_id, status in Animal.objects.filter(request_id__in=sr_ids).order_by().values_list('request_id', 'status'):
+            statuses[request_id].append(status)
+        assigned = set(AssignedRequest.objects.filter(service_request_id__in=sr_ids, dispatch_assignment__end_time=None).values_list('service_request_id', flat=True))
+
+        canceled = []
+        for sr_id in dict.fromkeys(sr_ids):
+            sr = self.service_requests[sr_id]
+            animal_statuses = statuses[sr_id]
+            # Update SIP/UTL.
+            if not sr.sip and 'SHELTERED IN PLACE' in animal_statuses:
+                sr.sip = True
+            elif not sr.sip and 'UNABLE TO LOCATE' in animal_statuses:
+                sr.utl = True
+
+            # Identify proper status based on DAs and Animals.
+            animals = any(status in DISPATCH_ANIMAL_STATUSES for status in animal_statuses)
+            all_canceled = animal_statuses.count('CANCELED') == len(animal_statuses)
+            status = 'closed'
+            if animals and sr_id in assigned:
+                status = 'assigned'
+            elif all_canceled:
+                status = 'canceled'
+            elif animals:
+                status = 'open'
+            # Remove SR from any active DAs if all animals are canceled.
+            if all_canceled:
+                canceled.append(sr_id)
+            if sr.status != status:
+                status_verb = 'opened' if status == 'open' else status
+                self.actions.append(build_action(self.user, f'{status_verb} service request', sr))
+            sr.status = status
+
+        if canceled:
+            AssignedRequest.objects.filter(service_request_id__in=canceled, dispatch_assignment__end_time=None).delete()
+        ServiceRequest.objects.bulk_update([self.service_requests[sr_id] for sr_id in dict.fromkeys(sr_ids)], ['sip', 'utl', 'status', 'followup_date', 'priority', 'directions'])
+
+    @transaction.atomic
+    def submit(self, sr_updates, is_dar_form=False):
+        if not sr_updates:
+            return
+        self.load(sr_updates)
+        self.create_animals(sr_updates)
+        self.update_animals(sr_updates)
+        self.update_assigned_requests(sr_updates, is_dar_form)
+        self.update_service_requests(sr_updates)
+        Action.objects.bulk_create(self.actions)
+        # Notify maps of the SRs whose status or priority the form changed.
+        events = [build_map_event(sr, 'service_request') for sr_id, sr in self.service_requests.items() if build_map_event(sr, 'service_request') != self.map_events[sr_id]]
+        if events:
+            queue_map_events(self.evac_assignment.incident.slug, events)
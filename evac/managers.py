@@ -0,0 +1,35 @@
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+
+from managers import UpdatedAtQueryset
+
+
+class PatchJSONValues(models.Func):
+    """
+    Merges patch into the values stored under the given keys of a jsonb object column, leaving other keys untouched.
+    """
+    output_field = models.JSONField()
+
+    def __init__(self, expression, keys, patch):
+        super().__init__(
+            expression,
+            models.Value(keys, output_field=ArrayField(models.TextField())),
+            models.Value(patch, output_field=models.JSONField()),
+        )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        (column, column_params), (keys, keys_params), (patch, patch_params) = [compiler.compile(expression) for expression in self.source_expressions]
+        sql = '(SELECT jsonb_object_agg(key, CASE WHEN key = ANY(%s::text[]) THEN value || %s::jsonb ELSE value END) FROM jsonb_each(%s))' % (keys, patch, column)
+        return sql, [*keys_params, *patch_params, *column_params]
+
+
+class AssignedRequestQueryset(UpdatedAtQueryset):
+    def patch_animal_fields(self, animal_ids, **fields):
+        """
+        Sets fields on the animals snapshots of every AssignedRequest in the queryset with one UPDATE,
+        e.g. patch_animal_fields([animal.id], status='CANCELED'). Snapshots of other animals are unchanged.
+        """
+        keys = [str(animal_id) for animal_id in animal_ids]
+        if not keys:
+            return 0
+        return self.filter(animals__has_any_keys=keys).update(animals=PatchJSONValues(models.F('animals'), keys, fields))
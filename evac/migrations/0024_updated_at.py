@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evac', '0023_populate_id_for_incident'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignedrequest',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
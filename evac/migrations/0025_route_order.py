@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:21
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evac', '0024_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='assignedrequest',
+            options={'ordering': [django.db.models.expressions.OrderBy(django.db.models.expressions.F('route_order'), nulls_last=True), 'id']},
+        ),
+        migrations.AddField(
+            model_name='assignedrequest',
+            name='route_order',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
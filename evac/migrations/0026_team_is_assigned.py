@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+def populate_is_assigned(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    DispatchTeam = apps.get_model("evac", "DispatchTeam")
+    EvacTeamMember = apps.get_model("evac", "EvacTeamMember")
+    EvacAssignment = apps.get_model("evac", "EvacAssignment")
+
+    open_assignments = EvacAssignment.objects.using(db_alias).filter(end_time=None, service_requests__isnull=False)
+    DispatchTeam.objects.using(db_alias).filter(models.Exists(open_assignments.filter(team_id=models.OuterRef('id')))).update(is_assigned=True)
+    EvacTeamMember.objects.using(db_alias).filter(dispatchteam__is_assigned=True).update(is_assigned=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evac', '0025_route_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchteam',
+            name='is_assigned',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='evacteammember',
+            name='is_assigned',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(populate_is_assigned, migrations.RunPython.noop),
+    ]
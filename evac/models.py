@@ -1,14 +1,19 @@
+import json
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
-from django.core.mail import send_mass_mail
 from django.db import models, transaction
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_delete, post_save, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.template.loader import render_to_string
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
 
 
+from hotline.geojson import stream_geojson
 from hotline.models import ServiceRequest
-from incident.models import Incident, IncidentNotification
+from incident.models import Incident, IncidentCounter, IncidentNotification
+from outbox.models import queue_email
+from .managers import AssignedRequestQueryset
 
 User = get_user_model()
 
@@ -20,6 +25,8 @@ class EvacTeamMember(models.Model):
     agency_id = models.CharField(max_length=50, blank=True)
     show = models.BooleanField(default=True)
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE)
+    # Maintained by refresh_team_assignments().
+    is_assigned = models.BooleanField(default=False, db_index=True, editable=False)
 
     def __str__(self):
         agency = " (%s)" % (self.agency_id) if self.agency_id else ""
@@ -35,6 +42,8 @@ class DispatchTeam(models.Model):
     dispatch_date = models.DateTimeField(auto_now_add=True)
     show = models.BooleanField(default=True)
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE)
+    # Maintained by refresh_team_assignments().
+    is_assigned = models.BooleanField(default=False, db_index=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -51,17 +60,28 @@ class EvacAssignment(models.Model):
     closed = models.BooleanField(default=False)
 
     def get_geojson(self):
-        geojson = {'features':[]}
-        for service_request in self.service_requests.all():
-            geojson['features'].append(service_request.get_feature_json())
-        return geojson
+        return json.loads(''.join(stream_geojson(self.service_requests.all())))
+
+    def order_route(self, start=None):
+        """
+        Stores a near-optimal visiting order on the DA's AssignedRequests, optionally starting
+        from a (latitude, longitude), and returns the route length in km.
+
+        SRs without coordinates are visited last, in their current order.
+        """
+        from .routes import optimize_route
+
+        stops = list(self.assigned_requests.values_list('id', 'service_request__latitude', 'service_request__longitude'))
+        located = [stop for stop in stops if stop[1] is not None and stop[2] is not None]
+        order, distance = optimize_route([(float(latitude), float(longitude)) for _, latitude, longitude in located], start)
+        ids = [located[index][0] for index in order] + [stop[0] for stop in stops if stop not in located]
+        AssignedRequest.objects.bulk_update([AssignedRequest(id=id, route_order=index) for index, id in enumerate(ids)], ['route_order'])
+        return distance
 
     def save(self, *args, **kwargs):
         if not self.pk:
-            total_das = EvacAssignment.objects.select_for_update().filter(incident=self.incident).values_list('id', flat=True)
             with transaction.atomic():
-                count = len(total_das)
-                self.id_for_incident = count + 1
+                self.id_for_incident = IncidentCounter.next_value(EvacAssignment, self.incident_id)
                 super(EvacAssignment, self).save(*args, **kwargs)
         else:
             super(EvacAssignment, self).save(*args, **kwargs)
@@ -78,6 +98,103 @@ class AssignedRequest(models.Model):
     owner_contact = models.ForeignKey('people.OwnerContact', null=True, on_delete=models.CASCADE, related_name='assigned_request')
     visit_note = models.ForeignKey('hotline.VisitNote', null=True, on_delete=models.CASCADE, related_name='assigned_request')
     timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    route_order = models.IntegerField(blank=True, null=True)
+
+    objects = AssignedRequestQueryset.as_manager()
+
+    class Meta:
+        ordering = [models.F('route_order').asc(nulls_last=True), 'id']
+
+# Mark the parent SR as changed for delta sync when it is removed from a DA.
+@receiver(post_delete, sender=AssignedRequest)
+def touch_service_request(sender, instance, **kwargs):
+    if instance.service_request_id:
+        ServiceRequest.objects.filter(id=instance.service_request_id).update(updated_at=timezone.now())
+
+def refresh_team_assignments(team_ids, member_ids=()):
+    """
+    Recomputes is_assigned for the given DispatchTeams, their members and any other given EvacTeamMembers.
+
+    A team is assigned while it has an open DA with at least one SR, and a member while
+    they are on an assigned team.
+    """
+    team_ids = [team_id for team_id in team_ids if team_id]
+    open_assignments = EvacAssignment.objects.filter(end_time=None, service_requests__isnull=False)
+    DispatchTeam.objects.filter(id__in=team_ids).update(is_assigned=models.Exists(open_assignments.filter(team_id=models.OuterRef('id'))))
+    members = DispatchTeam.team_members.through.objects.filter(dispatchteam_id__in=team_ids).values('evacteammember_id')
+    EvacTeamMember.objects.filter(models.Q(id__in=members) | models.Q(id__in=list(member_ids))).update(
+        is_assigned=models.Exists(DispatchTeam.team_members.through.objects.filter(evacteammember_id=models.OuterRef('id'), dispatchteam__is_assigned=True))
+    )
+
+@receiver(pre_save, sender=EvacAssignment)
+def remember_team(sender, instance, **kwargs):
+    instance.previous_team_id = EvacAssignment.objects.filter(pk=instance.pk).values_list('team_id', flat=True).first() if instance.pk else None
+
+@receiver(post_save, sender=EvacAssignment)
+@receiver(post_delete, sender=EvacAssignment)
+def evac_assignment_changed(sender, instance, **kwargs):
+    refresh_team_assignments({instance.team_id, getattr(instance, 'previous_team_id', None)})
+
+@receiver(post_save, sender=AssignedRequest)
+@receiver(post_delete, sender=AssignedRequest)
+def assigned_request_changed(sender, instance, **kwargs):
+    # A DA only counts once it has SRs, so adding the first or removing the last one can change its team.
+    if instance.dispatch_assignment_id and (kwargs.get('created', True)):
+        refresh_team_assignments(EvacAssignment.objects.filter(id=instance.dispatch_assignment_id).values_list('team_id', flat=True))
+
+@receiver(m2m_changed, sender=DispatchTeam.team_members.through)
+def team_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Remember who is being removed, as post_clear doesn't say.
+        instance.cleared_ids = list((instance.dispatchteam_set if reverse else instance.team_members).values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        related_ids = getattr(instance, 'cleared_ids', []) if action == 'post_clear' else list(pk_set or [])
+        if reverse:
+            refresh_team_assignments(related_ids, [instance.pk])
+        else:
+            refresh_team_assignments([instance.pk], related_ids)
+
+# Animal statuses that are snapshotted onto an AssignedRequest when its SR is dispatched.
+DISPATCH_ANIMAL_STATUSES = ['REPORTED', 'REPORTED (EVAC REQUESTED)', 'REPORTED (SIP REQUESTED)', 'SHELTERED IN PLACE', 'UNABLE TO LOCATE']
+
+def build_animal_snapshots(service_request_ids, include_location=False):
+    """
+    Returns {service_request_id: {animal_id: snapshot}} of the AssignedRequest.animals for each SR, using one query.
+    """
+    from animals.models import Animal
+
+    last_seen = DateTimeField()
+    snapshots = {service_request_id: {} for service_request_id in service_request_ids}
+    animals = Animal.objects.filter(request_id__in=service_request_ids, status__in=DISPATCH_ANIMAL_STATUSES).values(
+        'id', 'request_id', 'id_for_incident', 'animal_count', 'status', 'sex', 'age', 'name', 'size', 'species__name', 'color_notes', 'pcolor', 'scolor',
+        'shelter_id', 'room_id', 'behavior_notes', 'medical_notes', 'aggressive', 'aco_required', 'injured', 'fixed', 'confined', 'last_seen',
+    )
+    for animal in animals:
+        snapshots[animal['request_id']][animal['id']] = {
+            'id_for_incident':animal['id_for_incident'],
+            'animal_count':animal['animal_count'],
+            'status':animal['status'],
+            'sex':animal['sex'],
+            'age':animal['age'],
+            'name':animal['name'],
+            'size':animal['size'],
+            'species':animal['species__name'],
+            'color_notes':animal['color_notes'],
+            'pcolor':animal['pcolor'],
+            'scolor':animal['scolor'],
+            'shelter':animal['shelter_id'] if include_location else '',
+            'room':animal['room_id'] if include_location else '',
+            'animal_notes':animal['behavior_notes'],
+            'medical_notes':animal['medical_notes'],
+            'aggressive':animal['aggressive'],
+            'aco_required':animal['aco_required'],
+            'injured':animal['injured'],
+            'fixed':animal['fixed'],
+            'confined':animal['confined'],
+            'last_seen':last_seen.to_representation(animal['last_seen']) if animal['last_seen'] else None,
+        }
+    return snapshots
 
 def email_on_creation(evac_assignment):
     # Send email here.
@@ -98,7 +215,7 @@ def email_on_creation(evac_assignment):
             'sr_addresses': sr_adds,
             'da_creation_date': evac_assignment.start_time.strftime('%m/%d/%Y %H:%M:%S')
         }
-        message = (
+        queue_email(
             "Dispatch Assignment #" + str(evac_assignment.id_for_incident) + " Created for Shelterly",
             render_to_string(
                 'dispatch_assignment_creation_email.txt',
@@ -106,5 +223,4 @@ def email_on_creation(evac_assignment):
             ).strip(),
             "DoNotReply@shelterly.org",
             user_emails,
-        )
-        send_mass_mail((message,))
\ No newline at end of file
+        )
\ No newline at end of file
@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+
+from .routes import haversine_matrix, nearest_neighbor, optimize_route, path_length
+
+# Larger proposals are ordered by nearest neighbor only, as 2-opt grows too slow to plan within a second.
+MAX_OPTIMIZED_STOPS = 150
+
+def to_plane(points):
+    # Equirectangular projection to km around the points' mean latitude; accurate enough at incident scale.
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    scale = math.cos(math.radians(points[:, 0].mean())) if len(points) else 1
+    return np.column_stack([points[:, 1] * 111.32 * scale, points[:, 0] * 110.57])
+
+def capacitated_kmeans(points, k, capacity, iterations=25, seed=0):
+    """
+    Clusters an Nx2 array of (latitude, longitude) into k groups of at most capacity points.
+
+    Centers start from k-means++ and are refined by alternating a capacitated assignment
+    with a center update. Returns an array of cluster labels.
+    """
+    xy = to_plane(points)
+    count = len(xy)
+    k = min(k, count)
+    rng = np.random.default_rng(seed)
+
+    # k-means++ initialization.
+    centers = [xy[rng.integers(count)]]
+    for _ in range(1, k):
+        distances = ((xy[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        total = distances.sum()
+        centers.append(xy[rng.choice(count, p=distances / total) if total else rng.integers(count)])
+    centers = np.array(centers)
+
+    labels = np.full(count, -1)
+    for _ in range(iterations):
+        distances = (xy[:, 0, None] - centers[None, :, 0]) ** 2 + (xy[:, 1, None] - centers[None, :, 1]) ** 2
+        new_labels = np.argmin(distances, axis=1)
+        sizes = np.bincount(new_labels, minlength=k)
+        if sizes.max() > capacity:
+            # Overfull centers keep the points that would lose the most by moving to their
+            # second choice; the rest take their nearest center with room, most to lose first.
+            nearest = np.sqrt(distances[np.arange(count), new_labels])
+            second = np.sqrt(np.partition(distances, 1, axis=1)[:, 1]) if k > 1 else nearest
+            regret = second - nearest
+            displaced = []
+            for center in np.flatnonzero(sizes > capacity):
+                members = np.flatnonzero(new_labels == center)
+                displaced.extend(members[np.argsort(-regret[members], kind='stable')[capacity:]].tolist())
+            remaining = (capacity - np.minimum(sizes, capacity)).tolist()
+            displaced.sort(key=lambda point: -regret[point])
+            preferences = np.argsort(distances[displaced], axis=1).tolist()
+            for point, choices in zip(displaced, preferences):
+                for center in choices:
+                    if remaining[center]:
+                        remaining[center] -= 1
+                        new_labels[point] = center
+                        break
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros((k, 2))
+        np.add.at(sums, labels, xy)
+        sizes = np.bincount(labels, minlength=k)
+        occupied = sizes > 0
+        centers[occupied] = sums[occupied] / sizes[occupied][:, None]
+    return labels
+
+def plan_assignments(service_requests, teams, max_stops=None):
+    """
+    Proposes one DA per team from service_requests, a list of dicts with id, latitude,
+    longitude, priority, followup_date, aco_required, injured and animal_count.
+
+    When there are more SRs than the teams can take, the highest priority (then
+    earliest followup) SRs are planned and the rest are returned as unassigned. Each
+    proposal lists its SRs in route order.
+    """
+    max_stops = max_stops or max(math.ceil(len(service_requests) / max(len(teams), 1)), 1)
+    ranked = sorted(service_requests, key=lambda sr: (sr['priority'], sr['followup_date'] is None, sr['followup_date'] or 0, sr['id']))
+    planned = ranked[:len(teams) * max_stops]
+    unassigned = [sr['id'] for sr in ranked[len(planned):]]
+    if not planned:
+        return [], unassigned
+
+    points = np.array([(sr['latitude'], sr['longitude']) for sr in planned], dtype=float)
+    labels = capacitated_kmeans(points, len(teams), max_stops)
+    proposals = []
+    for label in range(min(len(teams), len(planned))):
+        members = np.flatnonzero(labels == label)
+        if not len(members):
+            continue
+        if len(members) > MAX_OPTIMIZED_STOPS:
+            matrix = haversine_matrix(points[members])
+            order = nearest_neighbor(matrix, [0])[0].tolist()
+            distance = path_length(matrix, order)
+        else:
+            order, distance = optimize_route(points[members])
+        stops = [planned[members[index]] for index in order]
+        proposals.append({
+            'team': teams[label],
+            'service_requests': [sr['id'] for sr in stops],
+            'stops': len(stops),
+            'animal_count': sum(sr['animal_count'] for sr in stops),
+            'aco_required': sum(1 for sr in stops if sr['aco_required']),
+            'injured': sum(1 for sr in stops if sr['injured']),
+            'highest_priority': min(sr['priority'] for sr in stops),
+            'distance_km': round(distance, 3),
+        })
+    return proposals, unassigned
@@ -0,0 +1,84 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_matrix(points):
+    """
+    Returns the NxN great-circle distance matrix in km for an Nx2 array of (latitude, longitude) degrees.
+    """
+    radians = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lat = radians[:, 0]
+    lon = radians[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def nearest_neighbor(matrix, starts):
+    """
+    Builds one nearest-neighbor path per start, stepping all of them at once. Returns an array of paths.
+    """
+    starts = np.asarray(starts)
+    rows = np.arange(len(starts))
+    paths = np.empty((len(starts), len(matrix)), dtype=int)
+    paths[:, 0] = starts
+    visited = np.zeros((len(starts), len(matrix)), dtype=bool)
+    visited[rows, starts] = True
+    for step in range(1, len(matrix)):
+        distances = np.where(visited, np.inf, matrix[paths[:, step - 1]])
+        paths[:, step] = np.argmin(distances, axis=1)
+        visited[rows, paths[:, step]] = True
+    return paths
+
+def two_opt(matrix, order, fixed_start=False, max_iterations=1000):
+    """
+    Improves an open path by repeatedly reversing the segment that shortens it the most.
+
+    The path is padded with a virtual node at zero distance from every stop so the
+    ends of the path can be reversed like any other segment.
+    """
+    size = len(order)
+    padded = np.zeros((size + 1, size + 1))
+    padded[:size, :size] = matrix
+    path = np.array([size] + list(order) + [size])
+    first = 2 if fixed_start else 1
+    positions = np.arange(first, size + 1)
+    for _ in range(max_iterations):
+        before, segment_start, after = path[positions - 1], path[positions], path[positions + 1]
+        # delta[i, j] is the change in length from reversing path[i..j].
+        delta = (
+            padded[before[:, None], segment_start[None, :]] + padded[segment_start[:, None], after[None, :]]
+            - padded[before, segment_start][:, None] - padded[segment_start, after][None, :]
+        )
+        delta[np.tril_indices(len(positions))] = 0
+        i, j = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[i, j] >= -1e-9:
+            break
+        path[positions[i]:positions[j] + 1] = path[positions[i]:positions[j] + 1][::-1]
+    return [int(node) for node in path[1:-1]]
+
+def path_length(matrix, order):
+    return float(matrix[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+def optimize_route(points, start=None):
+    """
+    Returns (order, distance_km): a near-optimal visiting order for points, as indexes
+    into points, and the length of that path.
+
+    When start (latitude, longitude) is given the path begins there, otherwise it may
+    begin at any stop.
+    """
+    points = [tuple(point) for point in points]
+    if not points:
+        return [], 0.0
+    if start is not None:
+        matrix = haversine_matrix([start] + points)
+        order = two_opt(matrix, nearest_neighbor(matrix, [0])[0], fixed_start=True)
+        return [index - 1 for index in order[1:]], path_length(matrix, order)
+
+    matrix = haversine_matrix(points)
+    # Try every stop as the nearest-neighbor starting point and improve the shortest.
+    paths = nearest_neighbor(matrix, np.arange(len(points)))
+    lengths = matrix[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+    order = two_opt(matrix, paths[np.argmin(lengths)])
+    return order, path_length(matrix, order)
@@ -1,5 +1,5 @@
 import re
-from django.db.models import Count, Exists, OuterRef, Prefetch, Q
+from django.db.models import Count, Prefetch, Q
 
 from rest_framework import serializers
 from actstream.models import target_stream
@@ -74,7 +74,9 @@ class SimpleAssignedRequestDispatchSerializer(serializers.ModelSerializer):
     visit_notes = serializers.SerializerMethodField()
 
     def get_visit_notes(self, obj):
-        #TODO: this triggers one request per SR
+        # Use the SR's AssignedRequests when they were prefetched with the DA.
+        if obj.service_request and 'assignedrequest_set' in getattr(obj.service_request, '_prefetched_objects_cache', {}):
+            return VisitNoteSerializer([assigned_request.visit_note for assigned_request in obj.service_request.assignedrequest_set.all() if assigned_request.visit_note_id and assigned_request.id != obj.id], many=True).data
         if VisitNote.objects.filter(assigned_request__service_request=obj.service_request).exclude(assigned_request=obj).exists():
             return VisitNoteSerializer(VisitNote.objects.filter(assigned_request__service_request=obj.service_request).exclude(assigned_request=obj), many=True).data
         return []
@@ -136,7 +138,7 @@ class DeployEvacAssignmentSerializer(SimpleEvacAssignmentSerializer):
     team_object = serializers.SerializerMethodField()
 
     def get_team_object(self, obj):
-        return DispatchTeamSerializer(DispatchTeam.objects.filter(id=obj.team.id).annotate(is_assigned=Exists(EvacAssignment.objects.filter(team_id=OuterRef("id"), end_time=None, service_requests__isnull=False, incident=obj.incident)))[0], required=False, read_only=True).data
+        return DispatchTeamSerializer(obj.team, required=False, read_only=True).data
     
     class Meta:
         model = EvacAssignment
@@ -1,5 +1,306 @@
+import gzip
+import json
+from unittest.mock import patch
+
+import numpy as np
+from actstream.models import Action
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase
 
 from accounts.models import ShelterlyUser
-from animals.models import Animal
+from consumers import map_event_coalescer
+from animals.models import Animal, Species, SpeciesCategory
 from people.models import Person
+from evac.models import AssignedRequest, DispatchTeam, EvacAssignment, EvacTeamMember
+from evac.planner import capacitated_kmeans
+from evac.routes import haversine_matrix, optimize_route, path_length
+from hotline.models import ServiceRequest, VisitNote
+from incident.models import Incident
+from shelter.models import Shelter
+
+class TestViews(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ShelterlyUser.objects.create_user(email="test@test.com", cell_phone="5555555", password="test", is_active=True)
+        cls.incident = Incident.objects.create(name='Test2', slug='test2', latitude=0, longitude=0)
+
+    def test_optimize_route(self):
+        # Stops along a line, given out of order.
+        points = [(38.0, -122.0 + offset / 100) for offset in (5, 0, 9, 2, 7, 1, 8, 3, 6, 4)]
+        order, distance = optimize_route(points)
+        self.assertIn([points[index][1] for index in order], [sorted(point[1] for point in points), sorted((point[1] for point in points), reverse=True)])
+        self.assertAlmostEqual(distance, haversine_matrix([points[1], points[2]])[0, 1], places=4)
+        # A fixed start visits the closest end first.
+        order, _ = optimize_route(points, start=(38.0, -121.9))
+        self.assertEqual(order[0], 2)
+        # Larger routes stay close to the lower bound of a grid walk.
+        grid = [(38 + row / 100, -122 + column / 100) for row in range(8) for column in range(8)]
+        order, distance = optimize_route(grid)
+        self.assertEqual(sorted(order), list(range(64)))
+        self.assertLess(distance, path_length(haversine_matrix(grid), list(range(64))))
+
+    def test_capacitated_kmeans(self):
+        # Two towns of 30 SRs each split cleanly between two teams.
+        rng = np.random.default_rng(1)
+        points = np.vstack([rng.normal((38.3, -122.3), 0.01, (30, 2)), rng.normal((38.6, -122.8), 0.01, (30, 2))])
+        labels = capacitated_kmeans(points, 2, 30)
+        self.assertEqual(len(set(labels[:30])), 1)
+        self.assertEqual(len(set(labels[30:])), 1)
+        self.assertNotEqual(labels[0], labels[30])
+        # Capacity is respected even when one town holds most of the SRs.
+        labels = capacitated_kmeans(points[:40], 2, 20)
+        self.assertEqual(sorted(np.bincount(labels)), [20, 20])
+        # Capacity also holds when planning a few thousand SRs.
+        points = rng.uniform((38.0, -123.0), (39.0, -122.0), (3000, 2))
+        labels = capacitated_kmeans(points, 30, 100)
+        self.assertEqual(np.bincount(labels).max(), 100)
+
+    def test_plan(self):
+        teams = [DispatchTeam.objects.create(name=name, incident=self.incident) for name in ('Team A', 'Team B')]
+        # Team C is already out on a DA.
+        busy = DispatchTeam.objects.create(name='Team C', incident=self.incident)
+        evac_assignment = EvacAssignment.objects.create(team=busy, incident=self.incident)
+        AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=ServiceRequest.objects.create(address="1 Main St.", status="assigned", incident=self.incident), animals={})
+        service_requests = {}
+        for name, latitude, longitude, priority in (('a1', 38.30, -122.30, 2), ('a2', 38.31, -122.31, 1), ('b1', 38.60, -122.80, 2), ('b2', 38.61, -122.81, 3), ('x', None, None, 1)):
+            service_requests[name] = ServiceRequest.objects.create(address=name, latitude=latitude, longitude=longitude, priority=priority, incident=self.incident)
+        Animal.objects.create(name='Rex', request=service_requests['a2'], status='REPORTED', injured='yes', incident=self.incident)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/evac/api/evacassignment/plan/?incident=test2')
+        self.assertEqual(response.status_code, 200)
+        proposals = response.json()['proposals']
+        self.assertEqual(sorted(proposal['team']['id'] for proposal in proposals), [team.id for team in teams])
+        self.assertEqual(sorted(sorted(sr['id'] for sr in proposal['service_requests']) for proposal in proposals), sorted([
+            sorted([service_requests['a1'].id, service_requests['a2'].id]), sorted([service_requests['b1'].id, service_requests['b2'].id]),
+        ]))
+        proposal = next(proposal for proposal in proposals if proposal['highest_priority'] == 1)
+        self.assertEqual((proposal['animal_count'], proposal['injured'], proposal['stops']), (1, 1, 2))
+        self.assertEqual(response.json()['unassigned'], [service_requests['x'].id])
+        # With a single stop per team only the highest priority SRs are planned.
+        response = self.client.get('/evac/api/evacassignment/plan/?incident=test2&teams=2&max_stops=1')
+        self.assertEqual(sorted(proposal['service_requests'][0]['id'] for proposal in response.json()['proposals']), sorted([service_requests['a2'].id, service_requests['a1'].id]))
+        self.assertEqual(response.json()['proposals'][0]['team'], None)
+
+    def test_team_is_assigned(self):
+        members = [EvacTeamMember.objects.create(first_name=name, last_name='Smith', phone='555-1234', incident=self.incident) for name in ('Ann', 'Bob')]
+        team = DispatchTeam.objects.create(name='Team A', incident=self.incident)
+        team.team_members.set(members[:1])
+        evac_assignment = EvacAssignment.objects.create(team=team, incident=self.incident)
+        # A team isn't assigned until its DA has an SR.
+        team.refresh_from_db()
+        self.assertFalse(team.is_assigned)
+        assigned_request = AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=ServiceRequest.objects.create(address="1 Main St.", incident=self.incident), animals={})
+        self.assertEqual(list(DispatchTeam.objects.filter(is_assigned=True)), [team])
+        self.assertEqual(list(EvacTeamMember.objects.filter(is_assigned=True)), members[:1])
+        # Members follow the team as they join and leave it.
+        members[1].dispatchteam_set.add(team)
+        team.team_members.remove(members[0])
+        self.assertEqual(list(EvacTeamMember.objects.filter(is_assigned=True)), members[1:])
+        team.team_members.clear()
+        self.assertFalse(EvacTeamMember.objects.filter(is_assigned=True).exists())
+        team.team_members.set(members)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/evac/api/evacteammember/')
+        self.assertEqual([member['is_assigned'] for member in response.json()], [True, True])
+        # Closing the DA or removing its last SR frees the team.
+        evac_assignment.end_time = timezone.now()
+        evac_assignment.save()
+        self.assertFalse(EvacTeamMember.objects.filter(is_assigned=True).exists())
+        evac_assignment.end_time = None
+        evac_assignment.save()
+        self.assertTrue(DispatchTeam.objects.get(id=team.id).is_assigned)
+        assigned_request.delete()
+        self.assertFalse(DispatchTeam.objects.get(id=team.id).is_assigned)
+        response = self.client.get('/evac/api/dispatchteam/?incident=test2&map=true')
+        self.assertEqual([(dispatch_team['id'], dispatch_team['is_assigned']) for dispatch_team in response.json()], [(team.id, False)])
+
+    def test_patch_animal_fields(self):
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+        first = AssignedRequest.objects.create(dispatch_assignment=evac_assignment, animals={'1': {'name': 'Rex', 'status': 'REPORTED'}, '2': {'name': 'Tom', 'status': 'REPORTED'}})
+        second = AssignedRequest.objects.create(dispatch_assignment=evac_assignment, animals={'3': {'name': 'Kit', 'status': 'REPORTED'}})
+        third = AssignedRequest.objects.create(dispatch_assignment=evac_assignment, animals={})
+        with self.assertNumQueries(1):
+            updated = AssignedRequest.objects.filter(dispatch_assignment=evac_assignment).patch_animal_fields([1, 3, 4], status='CANCELED', shelter='')
+        self.assertEqual(updated, 2)
+        for assigned_request in (first, second, third):
+            assigned_request.refresh_from_db()
+        self.assertEqual(first.animals, {'1': {'name': 'Rex', 'status': 'CANCELED', 'shelter': ''}, '2': {'name': 'Tom', 'status': 'REPORTED'}})
+        self.assertEqual(second.animals, {'3': {'name': 'Kit', 'status': 'CANCELED', 'shelter': ''}})
+        self.assertEqual(third.animals, {})
+
+    def test_order_route(self):
+        shelter = Shelter.objects.create(name='Fairgrounds', latitude=38.0, longitude=-121.9, incident=self.incident)
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+        service_requests = []
+        for longitude in (-122.0, -121.95, None, -121.98):
+            service_request = ServiceRequest.objects.create(address="1 Main St.", latitude=38.0 if longitude else None, longitude=longitude, incident=self.incident)
+            AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_request, animals={})
+            service_requests.append(service_request.id)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/evac/api/evacassignment/{evac_assignment.id}/route/', {'shelter': shelter.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Closest to the shelter first, then west, with the ungeolocated SR last.
+        self.assertEqual(response.json()['service_requests'], [service_requests[1], service_requests[3], service_requests[0], service_requests[2]])
+        self.assertAlmostEqual(response.json()['distance_km'], 8.78, places=1)
+        self.assertEqual(list(AssignedRequest.objects.filter(dispatch_assignment=evac_assignment).values_list('route_order', flat=True)), [0, 1, 2, 3])
+        response = self.client.post(f'/evac/api/evacassignment/{evac_assignment.id}/route/', {'start': 'north'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create(self):
+        def create(count):
+            service_requests = []
+            for index in range(count):
+                service_request = ServiceRequest.objects.create(address="1 Main St.", latitude=38 + index / 100, longitude=-122, incident=self.incident)
+                Animal.objects.create(name='Rex', request=service_request, status='REPORTED', species=species, incident=self.incident)
+                Animal.objects.create(name='Old', request=service_request, status='REUNITED', incident=self.incident)
+                service_requests.append(service_request.id)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/evac/api/evacassignment/', {'team_name': 'Team', 'incident': self.incident.id, 'service_requests': service_requests}, format='json')
+            self.assertEqual(response.status_code, 201)
+            return response.json()['id'], len(queries)
+
+        species = Species.objects.create(name='dog', category=SpeciesCategory.objects.create(name='dog'))
+        self.client.force_authenticate(self.user)
+        # Warm the ContentType cache.
+        create(1)
+        da_id, small = create(2)
+        _, large = create(20)
+        # DA creation takes the same number of queries regardless of size.
+        self.assertEqual(small, large)
+        assigned_request = AssignedRequest.objects.filter(dispatch_assignment_id=da_id).first()
+        self.assertEqual([animal['name'] for animal in assigned_request.animals.values()], ['Rex'])
+        self.assertEqual(list(assigned_request.animals.values())[0]['species'], 'dog')
+        self.assertEqual(Action.objects.filter(verb='assigned service request', target_object_id=str(assigned_request.service_request_id)).count(), 1)
+
+    def test_bundle(self):
+        team = DispatchTeam.objects.create(name='Team A', incident=self.incident)
+        team.team_members.add(EvacTeamMember.objects.create(first_name='Ann', last_name='Smith', phone='5551234', incident=self.incident))
+        evac_assignment = EvacAssignment.objects.create(team=team, incident=self.incident)
+        owner = Person.objects.create(first_name='Jane', last_name='Doe', incident=self.incident)
+        for address in ('1 Main St.', '2 Main St.'):
+            service_request = ServiceRequest.objects.create(address=address, incident=self.incident)
+            service_request.owners.add(owner)
+            Animal.objects.create(name='Rex', request=service_request, status='REPORTED', incident=self.incident).owners.add(owner)
+            AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_request, animals={})
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/evac/api/evacassignment/%s/bundle/' % evac_assignment.id, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response.status_code, response['Content-Encoding']), (200, 'gzip'))
+        bundle = json.loads(gzip.decompress(response.content))
+        self.assertEqual((len(bundle['service_requests']), len(bundle['animals']), len(bundle['assigned_requests'])), (2, 2, 2))
+        # The shared owner is sent once and referenced by id.
+        self.assertEqual([person['id'] for person in bundle['people']], [owner.id])
+        self.assertEqual({animal['owners'][0] for animal in bundle['animals']}, {owner.id})
+        self.assertEqual(bundle['team']['team_members'], [member['id'] for member in bundle['team_members']])
+        # Unchanged bundles revalidate against the ETag, and changes produce a new version.
+        etag = response['ETag']
+        response = self.client.get('/evac/api/evacassignment/%s/bundle/' % evac_assignment.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        owner.phone = '5550000'
+        owner.save()
+        response = self.client.get('/evac/api/evacassignment/%s/bundle/' % evac_assignment.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['people'][0]['phone'], '5550000')
+
+    def test_dar_submission(self):
+        shelter = Shelter.objects.create(name='Fairgrounds', incident=self.incident)
+        species = Species.objects.create(name='cat', category=SpeciesCategory.objects.create(name='cat'))
+        owner = Person.objects.create(first_name='Sue', last_name='Smith', incident=self.incident)
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+        done = ServiceRequest.objects.create(address="1 Main St.", status='assigned', incident=self.incident)
+        done.owners.add(owner)
+        missed = ServiceRequest.objects.create(address="2 Main St.", status='assigned', incident=self.incident)
+        found = Animal.objects.create(name='Tom', request=done, status='REPORTED', species=species, animal_count=3, incident=self.incident)
+        hidden = Animal.objects.create(name='Kit', request=missed, status='REPORTED', species=species, incident=self.incident)
+        for service_request in (done, missed):
+            AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_request, animals={})
+
+        sr_updates = [{
+            'id': done.id, 'priority': 1, 'directions': 'Gate code 1234', 'date_completed': '2026-10-18T10:00:00Z', 'notes': 'All good', 'forced_entry': False,
+            'owner_contact_id': owner.id, 'owner_contact_time': '2026-10-18T09:00:00Z', 'owner_contact_note': 'Called owner',
+            'animals': [
+                # Two of the three cats were sheltered, one was left in place.
+                {'id': found.id, 'id_for_incident': found.id_for_incident, 'animal_count': 2, 'status': 'SHELTERED', 'shelter': shelter.id, 'species': 'cat'},
+                {'original_id': found.id, 'animal_count': 1, 'status': 'SHELTERED IN PLACE', 'shelter': None, 'species': 'cat'},
+                {'request': done.id, 'name': 'Stray', 'animal_count': 1, 'status': 'SHELTERED', 'shelter': shelter.id, 'species': 'cat', 'animal_notes': 'Shy', 'new': True},
+            ],
+        }, {
+            'id': missed.id, 'priority': 2, 'directions': '', 'unable_to_complete': True,
+            'animals': [{'id': hidden.id, 'id_for_incident': hidden.id_for_incident, 'animal_count': 1, 'status': 'REPORTED', 'shelter': None, 'species': 'cat'}],
+        }]
+        self.client.force_authenticate(self.user)
+        with patch.object(map_event_coalescer, 'add') as add, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/evac/api/evacassignment/{evac_assignment.id}/', {'start_time': '2026-10-18T08:00:00Z', 'sr_updates': sr_updates}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Maps are told of the SR that was reopened.
+        add.assert_called_once()
+        self.assertIn({'entity': 'service_request', 'id': missed.id, 'status': 'open'}, [
+            {key: event[key] for key in ('entity', 'id', 'status')} for event in add.call_args[0][1]
+        ])
+
+        found.refresh_from_db()
+        self.assertEqual((found.animal_count, found.status, found.shelter_id, found.address), (2, 'SHELTERED', shelter.id, '1 Main St.'))
+        self.assertIsNotNone(found.intake_date)
+        copy = Animal.objects.get(request=done, status='SHELTERED IN PLACE')
+        self.assertEqual((copy.name, copy.animal_count, list(copy.owners.all())), ('Tom', 1, []))
+        stray = Animal.objects.get(name='Stray')
+        self.assertEqual((stray.behavior_notes, stray.shelter_id, list(stray.owners.all())), ('Shy', shelter.id, [owner]))
+        self.assertEqual(len({found.id_for_incident, copy.id_for_incident, stray.id_for_incident}), 3)
+        self.assertEqual(Animal.objects.search(['Stray']).get(), stray)
+        self.assertEqual(Action.objects.filter(verb='sheltered animal').count(), 4)
+
+        assigned_request = AssignedRequest.objects.get(dispatch_assignment=evac_assignment)
+        self.assertEqual(assigned_request.service_request, done)
+        self.assertEqual(set(assigned_request.animals), {str(found.id), str(copy.id), str(stray.id)})
+        self.assertEqual((assigned_request.visit_note.notes, assigned_request.owner_contact.owner, assigned_request.owner_contact.owner_contact_note), ('All good', owner, 'Called owner'))
+        done.refresh_from_db()
+        missed.refresh_from_db()
+        self.assertEqual((done.priority, done.directions, done.sip, done.status), (1, 'Gate code 1234', True, 'assigned'))
+        self.assertEqual(missed.status, 'open')
+        self.assertTrue(Action.objects.filter(verb='opened service request', target_object_id=str(missed.id)).exists())
+
+        # Resubmitting updates the existing VisitNote rather than adding another.
+        sr_updates[0]['animals'] = [{'id': found.id, 'animal_count': 2, 'status': 'SHELTERED', 'shelter': shelter.id}]
+        sr_updates[0]['notes'] = 'Revised'
+        response = self.client.patch(f'/evac/api/evacassignment/{evac_assignment.id}/', {'start_time': '2026-10-18T08:00:00Z', 'sr_updates': sr_updates[:1]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(VisitNote.objects.get().notes, 'Revised')
+
+    def test_close_map_event(self):
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+        AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=ServiceRequest.objects.create(address="1 Main St.", status='assigned', incident=self.incident), animals={})
+        self.client.force_authenticate(self.user)
+        with patch.object(map_event_coalescer, 'add') as add, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/evac/api/evacassignment/{evac_assignment.id}/', {'closed': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        add.assert_called_once_with(self.incident.slug, [{'entity': 'evac_assignment', 'id': evac_assignment.id, 'id_for_incident': evac_assignment.id_for_incident, 'status': 'closed', 'team': 'Team A'}])
+
+    def test_dar_submission_queries(self):
+        shelter = Shelter.objects.create(name='Fairgrounds', incident=self.incident)
+        self.client.force_authenticate(self.user)
+
+        def submit(sr_count, animal_count):
+            evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+            sr_updates = []
+            for _ in range(sr_count):
+                service_request = ServiceRequest.objects.create(address="1 Main St.", status='assigned', incident=self.incident)
+                AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_request, animals={})
+                animals = [Animal.objects.create(name='Rex', request=service_request, incident=self.incident) for _ in range(animal_count)]
+                sr_updates.append({'id': service_request.id, 'priority': 2, 'directions': '', 'date_completed': '2026-10-18T10:00:00Z', 'notes': '', 'forced_entry': False, 'animals': [
+                    {'id': animal.id, 'animal_count': 1, 'status': 'SHELTERED', 'shelter': shelter.id} for animal in animals
+                ]})
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(f'/evac/api/evacassignment/{evac_assignment.id}/', {'start_time': '2026-10-18T08:00:00Z', 'sr_updates': sr_updates}, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        # Warm the ContentType cache.
+        submit(1, 1)
+        small = submit(2, 2)
+        large = submit(20, 10)
+        # The form is saved with the same number of queries whatever its size.
+        self.assertEqual(small, large)
+        self.assertEqual(Animal.objects.filter(status='SHELTERED', shelter=shelter).count(), 205)
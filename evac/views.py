@@ -1,26 +1,28 @@
 from django.db import transaction
-from django.db.models import Count, Exists, OuterRef, Prefetch, Q
-from django.http import HttpResponse, JsonResponse
-import json
-import io
-from copy import deepcopy
-from wsgiref.util import FileWrapper
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime, timedelta
 from rest_framework import filters, permissions, serializers, viewsets
 from rest_framework.decorators import action as drf_action
-from actstream import action
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from actstream.models import Action
 
-from animals.models import Animal, Species
+from animals.models import Animal
 from animals.views import MultipleFieldLookupMixin
-from animals.serializers import AnimalSerializer
-from evac.models import AssignedRequest, DispatchTeam, EvacAssignment, EvacTeamMember, email_on_creation
+from evac.bundle import add_image_urls, build_bundle, encode_bundle, get_bundle_version
+from evac.dar import DARSubmission
+from evac.models import AssignedRequest, DispatchTeam, EvacAssignment, EvacTeamMember, build_animal_snapshots, email_on_creation, refresh_team_assignments
+from evac.planner import plan_assignments
 from evac.serializers import DispatchTeamSerializer, DeployEvacAssignmentSerializer, EvacAssignmentSerializer, MapEvacAssignmentSerializer, EvacTeamMemberSerializer
-from hotline.models import ServiceRequest, VisitNote
+from hotline.caltopo import CaltopoPusher
+from hotline.geojson import stream_geojson
+from hotline.managers import ANIMAL_COUNT_FIELDS
+from hotline.models import ServiceRequest, ServiceRequestNote
 from incident.models import Incident, Organization
-from people.models import OwnerContact, Person
-from shelter.models import Room, Shelter
+from people.models import Person
+from shelter.models import Shelter
+from activity import buffered_actions, build_action, send_action
+from consumers import build_map_event, queue_map_events
+from pagination import KeysetPagination
 
 class EvacTeamMemberViewSet(viewsets.ModelViewSet):
 
@@ -49,8 +51,6 @@ class EvacTeamMemberViewSet(viewsets.ModelViewSet):
         queryset = EvacTeamMember.objects.all()
         if self.request.GET.get('training'):
             queryset = queryset.filter(incident__organization__slug=self.request.GET.get('organization'), incident__training=self.request.GET.get('training') == 'true')
-        queryset = (queryset
-        .annotate(is_assigned=Exists(EvacAssignment.objects.filter(team__team_members__id=OuterRef("id"), end_time=None, service_requests__isnull=False))))
         return queryset
 
 class DispatchTeamViewSet(viewsets.ModelViewSet):
@@ -60,7 +60,7 @@ class DispatchTeamViewSet(viewsets.ModelViewSet):
     serializer_class = DispatchTeamSerializer
 
     def get_queryset(self):
-        queryset = DispatchTeam.objects.all().annotate(is_assigned=Exists(EvacAssignment.objects.filter(team_id=OuterRef("id"), end_time=None, service_requests__isnull=False, incident__slug=self.request.GET.get('incident')))).order_by('-dispatch_date')
+        queryset = DispatchTeam.objects.all().order_by('-dispatch_date')
         is_map = self.request.query_params.get('map', '')
         if self.request.GET.get('incident'):
             queryset = queryset.filter(incident__slug=self.request.GET.get('incident'))
@@ -68,7 +68,8 @@ class DispatchTeamViewSet(viewsets.ModelViewSet):
         if is_map == 'true':
             yesterday = datetime.today() - timedelta(days=1)
             y_mid = datetime.combine(yesterday,datetime.min.time())
-            queryset = queryset.filter(Q(is_assigned=True) | Q(dispatch_date__gte=y_mid)).filter(team_members__show=True).distinct()
+            queryset = queryset.filter(Q(is_assigned=True) | Q(dispatch_date__gte=y_mid))
+            queryset = queryset.filter(Exists(DispatchTeam.team_members.through.objects.filter(dispatchteam_id=OuterRef('id'), evacteammember__show=True)))
 
         return queryset
 
@@ -98,12 +99,16 @@ class DispatchTeamViewSet(viewsets.ModelViewSet):
             elif self.request.data.get('remove_team_member'):
                 team.team_members.remove(self.request.data.get('remove_team_member'))
 
+class EvacAssignmentPagination(KeysetPagination):
+    ordering = ('-start_time', '-id')
+
 class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
 
     queryset = EvacAssignment.objects.all()
     lookup_fields = ['pk', 'incident', 'id_for_incident']
     search_fields = ['team__name', 'team__team_members__first_name', 'team__team_members__last_name', 'service_requests__address', 'service_requests__city', 'service_requests__animal__name',]
     filter_backends = (filters.SearchFilter,)
+    pagination_class = EvacAssignmentPagination
     permission_classes = [permissions.IsAuthenticated, ]
     serializer_class = EvacAssignmentSerializer
     deploy_serializer_class = DeployEvacAssignmentSerializer
@@ -120,7 +125,7 @@ class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = EvacAssignment.objects.filter(service_requests__isnull=False, assigned_requests__isnull=False).distinct().order_by('-start_time').select_related('team').prefetch_related(Prefetch('service_requests',
-                    ServiceRequest.objects
+                    ServiceRequest.objects.with_animal_counts()
             .exclude(status='CANCELED')
             .annotate(
                 injured=Exists(Animal.objects.filter(request_id=OuterRef("id"), injured="yes"))
@@ -133,8 +138,12 @@ class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
             .select_related('reporter')
             # .prefetch_related('evacuation_assignments')
         )).prefetch_related(Prefetch('team', DispatchTeam.objects.prefetch_related('team_members'))).prefetch_related(Prefetch('assigned_requests',
-        AssignedRequest.objects.select_related('service_request', 'owner_contact', 'visit_note').prefetch_related('service_request__owners', 'service_request__ownercontact_set',).prefetch_related(Prefetch(
-                'service_request__animal_set', queryset=Animal.objects.exclude(status='CANCELED'), to_attr='animals'))))
+        AssignedRequest.objects.select_related('service_request', 'owner_contact', 'visit_note').prefetch_related('service_request__owners', 'service_request__ownercontact_set',)
+        .prefetch_related('visit_note__assigned_request__service_request', 'visit_note__assigned_request__dispatch_assignment').prefetch_related(Prefetch(
+                'service_request__animal_set', queryset=Animal.objects.exclude(status='CANCELED').select_related('species__category'), to_attr='animals'))
+        .prefetch_related(Prefetch('service_request__notes', ServiceRequestNote.objects.select_related('author')))
+        .prefetch_related(Prefetch('service_request__assignedrequest_set', AssignedRequest.objects.select_related('visit_note').order_by(F('visit_note__date_completed').desc(nulls_first=True))
+            .prefetch_related('visit_note__assigned_request__service_request', 'visit_note__assigned_request__dispatch_assignment')))))
 
         # Exclude DAs without SRs when fetching for a map.
         is_map = self.request.query_params.get('map', self.request.query_params.get('deploy_map', ''))
@@ -157,14 +166,11 @@ class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
         return queryset
 
     # When creating, update all service requests to be assigned status.
+    @transaction.atomic
     def perform_create(self, serializer):
         if serializer.is_valid():
 
-            total_das = EvacAssignment.objects.select_for_update().filter(incident__slug=self.request.data.get('incident_slug')).values_list('id', flat=True)
-            with transaction.atomic():
-                count = len(total_das)
-                serializer.validated_data['id_for_incident'] = count + 1
-
+            # id_for_incident is allocated by EvacAssignment.save().
             timestamp = None
             if ServiceRequest.objects.filter(pk__in=self.request.data['service_requests'], status='assigned').exists():
                 raise serializers.ValidationError(['Duplicate assigned service request error.', list(ServiceRequest.objects.filter(pk__in=self.request.data['service_requests'], status='assigned').values_list('id', flat=True))])
@@ -177,49 +183,45 @@ class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
             evac_assignment = serializer.save()
             service_requests = ServiceRequest.objects.filter(pk__in=self.request.data['service_requests'])
             service_requests.update(status="assigned")
-            action.send(self.request.user, verb='created evacuation assignment', target=evac_assignment)
-            for service_request in service_requests:
-                action.send(self.request.user, verb='assigned service request', target=service_request)
-                animals_dict = {}
-                full_animal_set = AnimalSerializer(service_request.animal_set.all().filter(status__in=['REPORTED', 'REPORTED (EVAC REQUESTED)', 'REPORTED (SIP REQUESTED)', 'SHELTERED IN PLACE', 'UNABLE TO LOCATE']), many=True, required=False, read_only=True).data
-                for animal in full_animal_set:
-                    animals_dict[animal["id"]] = {
-                        'id_for_incident':animal["id_for_incident"],
-                        'animal_count':animal["animal_count"],
-                        'status':animal["status"],
-                        'sex':animal["sex"],
-                        'age':animal["age"],
-                        'name':animal["name"],
-                        'size':animal["size"],
-                        'species':animal["species_string"],
-                        'color_notes':animal["color_notes"],
-                        'pcolor':animal["pcolor"],
-                        'scolor':animal["scolor"],
-                        'shelter':'',
-                        'room':'',
-                        'animal_notes':animal["behavior_notes"],
-                        'medical_notes':animal["medical_notes"],
-                        'aggressive':animal["aggressive"],
-                        'aco_required':animal["aco_required"],
-                        'injured':animal["injured"],
-                        'fixed':animal["fixed"],
-                        'confined':animal["confined"],
-                        'last_seen':animal["last_seen"],
-                    }
-                AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_request, animals=animals_dict, timestamp=timestamp)
-
-            # Send email notification of creation.
+            service_requests = list(service_requests.order_by('id'))
+
+            # Snapshot every SR's animals with one query and write the AssignedRequests and Actions in bulk.
+            snapshots = build_animal_snapshots([service_request.id for service_request in service_requests])
+            AssignedRequest.objects.bulk_create([
+                AssignedRequest(dispatch_assignment=evac_assignment, service_request=service_request, animals=snapshots[service_request.id], timestamp=timestamp)
+                for service_request in service_requests
+            ])
+            # bulk_create() skips the AssignedRequest signals that maintain is_assigned.
+            refresh_team_assignments([team.id])
+            Action.objects.bulk_create(
+                [build_action(self.request.user, 'created evacuation assignment', evac_assignment)] +
+                [build_action(self.request.user, 'assigned service request', service_request) for service_request in service_requests]
+            )
+            evac_assignment.order_route()
+
+            # Queue email notification of creation.
             email_on_creation(evac_assignment)
-            # Notify maps that there is updated data.
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)("map", {"type":"new_data"})
+            # Notify maps for this incident of the new DA and its newly assigned SRs.
+            events = [build_map_event(evac_assignment, 'evac_assignment')]
+            events.extend(build_map_event(service_request, 'service_request') for service_request in service_requests)
+            queue_map_events(evac_assignment.incident.slug, events)
+
+            # Respond with the DA loaded through the list prefetches rather than fetching per SR.
+            serializer.instance = self.get_queryset().filter(pk=evac_assignment.pk).first() or evac_assignment
 
+    @transaction.atomic
+    @buffered_actions()
     def perform_update(self, serializer):
         if serializer.is_valid():
             # Only add end_time on first update if all SRs are complete.
             if not serializer.instance.end_time and self.request.data.get('closed'):
                 serializer.validated_data['end_time'] = datetime.now()
+            map_event = build_map_event(serializer.instance, 'evac_assignment')
             evac_assignment = serializer.save()
+            events = []
+            # Notify maps if the DA was closed or changed teams.
+            if build_map_event(evac_assignment, 'evac_assignment') != map_event:
+                events.append(build_map_event(evac_assignment, 'evac_assignment'))
 
             # Add Service Request to DA if included.
             if self.request.data.get('new_service_request'):
@@ -231,226 +233,109 @@ class EvacAssignmentViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                 if old_da:
                     old_da.service_requests.remove(service_requests[0])
                 # Add SR to selected DA.
-                animals_dict = {}
-                full_animal_set = AnimalSerializer(service_requests[0].animal_set.filter(status__in=['REPORTED', 'REPORTED (EVAC REQUESTED)', 'REPORTED (SIP REQUESTED)', 'SHELTERED IN PLACE', 'UNABLE TO LOCATE']), many=True, required=False, read_only=True).data
-                for animal in full_animal_set:
-                    animals_dict[animal["id"]] = {
-                        "id_for_incident": animal["id_for_incident"],
-                        'animal_count':animal["animal_count"],
-                        "name": animal["name"],
-                        "sex": animal["sex"],
-                        "age": animal["age"],
-                        "size": animal["size"],
-                        "species": animal["species_string"],
-                        "status": animal["status"],
-                        "color_notes": animal["color_notes"],
-                        "pcolor": animal["pcolor"],
-                        "scolor": animal["scolor"],
-                        "last_seen": animal["last_seen"],
-                        "shelter": animal["shelter"],
-                        "room": animal["room"],
-                        'animal_notes':animal["behavior_notes"],
-                        "medical_notes": animal["medical_notes"],
-                        'aggressive':animal["aggressive"],
-                        'aco_required':animal["aco_required"],
-                        'injured':animal["injured"],
-                        "fixed": animal["fixed"],
-                        "confined": animal["confined"],
-                    }
+                animals_dict = build_animal_snapshots([service_requests[0].id], include_location=True)[service_requests[0].id]
                 AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=service_requests[0], animals=animals_dict)
-                action.send(self.request.user, verb='assigned service request', target=service_requests[0])
-
-            for service_request in self.request.data.get('sr_updates', []):
-                animals_dict = {}
-                sr = ServiceRequest.objects.get(id=service_request['id'])
-                # sr_status = 'open' if service_request.get('unable_to_complete', '') else 'assigned'
-                for animal_dict in service_request['animals']:
-                    id = animal_dict.get("id", None)
-                    if id:
-                      Animal.objects.filter(id=id).update(animal_count=animal_dict.get("animal_count", 1))
-                      animals_dict[id] = {
-                          "id_for_incident": animal_dict.get("id_for_incident"),
-                          'animal_count':animal_dict.get("animal_count", 1),
-                          "name": animal_dict.get("name"),
-                          "age": animal_dict.get("age"),
-                          "sex": animal_dict.get("sex"),
-                          "size": animal_dict.get("size"),
-                          "species": animal_dict.get("species"),
-                          "status": animal_dict.get("status"),
-                          "color_notes": animal_dict.get("color_notes"),
-                          "pcolor": animal_dict.get("pcolor"),
-                          "scolor": animal_dict.get("scolor"),
-                          "last_seen": animal_dict.get("last_seen"),
-                          "shelter": animal_dict.get("shelter"),
-                          "room": animal_dict.get("room"),
-                          'animal_notes':animal_dict.get("animal_notes"),
-                          "medical_notes": animal_dict.get("medical_notes"),
-                          'aggressive':animal_dict.get("aggressive"),
-                          'aco_required':animal_dict.get("aco_required"),
-                          'injured':animal_dict.get("injured"),
-                          "fixed": animal_dict.get("fixed"),
-                          "confined": animal_dict.get("confined"),
-                      }
-                    elif animal_dict.get("original_id", None):
-                        with transaction.atomic():
-                            animal = Animal.objects.get(id=animal_dict["original_id"])
-                            new_animal = deepcopy(animal)
-                            new_animal.id = None
-                            new_animal.medical_record = None
-                            new_animal.animal_count = animal_dict["animal_count"]
-                            new_animal.save()
-                            new_animal.owners.set(animal.owners.all())
-                            id = new_animal.id
-                            animals_dict[id] = {
-                                "id_for_incident":new_animal.id_for_incident,
-                                'animal_count':animal_dict.get("animal_count", 1),
-                                "name": animal_dict.get("name"),
-                                "age": animal_dict.get("age"),
-                                "sex": animal_dict.get("sex"),
-                                "size": animal_dict.get("size"),
-                                "species": animal_dict.get("species"),
-                                "status": animal_dict.get("status"),
-                                "color_notes": animal_dict.get("color_notes"),
-                                "pcolor": animal_dict.get("pcolor"),
-                                "scolor": animal_dict.get("scolor"),
-                                "last_seen": animal_dict.get("last_seen"),
-                                "shelter": animal_dict.get("shelter"),
-                                "room": animal_dict.get("room"),
-                                'animal_notes':animal_dict.get("animal_notes"),
-                                "medical_notes": animal_dict.get("medical_notes"),
-                                'aggressive':animal_dict.get("aggressive"),
-                                'aco_required':animal_dict.get("aco_required"),
-                                'injured':animal_dict.get("injured"),
-                                "fixed": animal_dict.get("fixed"),
-                                "confined": animal_dict.get("confined"),
-                            }
-                    else:
-                        sr = ServiceRequest.objects.get(id=animal_dict.get("request"))
-                        new_animal_dict = animal_dict.copy()
-                        new_animal_dict["request"] = sr
-                        new_animal_dict["room"] = Room.objects.get(id=animal_dict.get("room")) if animal_dict.get("room") else None
-                        new_animal_dict["shelter"] = Shelter.objects.get(id=animal_dict.get("shelter")) if animal_dict.get("shelter") else None
-                        new_animal_dict["species"] = Species.objects.get(name=animal_dict.get("species"))
-                        new_animal_dict["incident"] = Incident.objects.get(slug=self.request.GET.get('incident'))
-                        new_animal_dict["behavior_notes"] = new_animal_dict["animal_notes"]
-                        # Clear out extraneous keys not used for animal creation if present.
-                        new_animal_dict.pop("animal_notes", None)
-                        new_animal_dict.pop("priority", None)
-                        new_animal_dict.pop("presenting_complaints", None)
-                        new_animal_dict.pop("concern", None)
-                        new_animal_dict.pop("caution", None)
-                        new_animal_dict.pop("new", None)
-                        new_animal = Animal.objects.create(**new_animal_dict)
-                        new_animal.owners.set(sr.owners.all())
-                        id = new_animal.id
-
-                        animals_dict[id] = {
-                          "id_for_incident":new_animal.id_for_incident,
-                          'animal_count':animal_dict["animal_count"],
-                          "name": animal_dict.get("name"),
-                          "age": animal_dict.get("age"),
-                          "sex": animal_dict.get("sex"),
-                          "size": animal_dict.get("size"),
-                          "species": animal_dict.get("species"),
-                          "status": animal_dict.get("status"),
-                          "color_notes": animal_dict.get("color_notes"),
-                          "pcolor": animal_dict.get("pcolor"),
-                          "scolor": animal_dict.get("scolor"),
-                          "last_seen": animal_dict.get("last_seen"),
-                          "shelter": animal_dict.get("shelter"),
-                          "room": animal_dict.get("room"),
-                          'animal_notes':animal_dict.get("animal_notes"),
-                          "medical_notes": animal_dict.get("medical_notes"),
-                          'aggressive':animal_dict.get("aggressive"),
-                          'aco_required':animal_dict.get("aco_required"),
-                          'injured':animal_dict.get("injured"),
-                          "fixed": animal_dict.get("fixed"),
-                          "confined": animal_dict.get("confined"),
-                        }
-                    # Record status change if applicable.
-                    animal = Animal.objects.get(pk=id)
-                    new_status = animal_dict.get('status')
-                    if animal.status != new_status:
-                        action.send(self.request.user, verb=f'changed animal status to {new_status}', target=animal)
-                    new_shelter = animal_dict.get('shelter', None)
-                    new_room = animal_dict.get('room', None)
-                    intake_date = animal.intake_date
-                    if animal.shelter != new_shelter:
-                        action.send(self.request.user, verb='sheltered animal', target=animal)
-                        action.send(self.request.user, verb='sheltered animal', target=animal.shelter, action_object=animal)
-                        intake_date = animal.intake_date if animal.intake_date else datetime.now()
-                    # Update shelter, room, and intake_date info.
-                    Animal.objects.filter(id=id).update(status=new_status, shelter=new_shelter, room=new_room, intake_date=intake_date)
-                    # Update animal found location with SR location if blank.
-                    if not animal.address:
-                        Animal.objects.filter(id=id).update(address=sr.address, city=sr.city, state=sr.state, zip_code=sr.zip_code, latitude=sr.latitude, longitude=sr.longitude)
-
-                # Update the relevant SR fields.
-                assigned_request = AssignedRequest.objects.get(service_request=service_request['id'], dispatch_assignment=evac_assignment.id)
-                # Update SIP/UTL.
-                sr.update_sip_utl()
-                assigned_request.animals = animals_dict
-
-                # Only make these changes if saving a DAR Form.
-                if self.request.data.get('start_time'):
-                    sr_followup_date = service_request.get('followup_date', sr.followup_date)
-                    assigned_request.followup_date = sr_followup_date
-                    sr.followup_date=sr_followup_date
-                    sr.priority=service_request['priority']
-                    sr.directions=service_request['directions']
-                    sr.save()
-                    # Only create VisitNote on first update, otherwise update existing VisitNote.
-                    if service_request.get('date_completed'):
-                        if not assigned_request.visit_note:
-                            visit_note = VisitNote.objects.create(date_completed=service_request['date_completed'], notes=service_request['notes'], forced_entry=service_request['forced_entry'])
-                            assigned_request.visit_note = visit_note
-                        else:
-                            VisitNote.objects.filter(assigned_request=assigned_request).update(date_completed=service_request['date_completed'], notes=service_request.get('notes', ''), forced_entry=service_request.get('forced_entry', False))
-
-                    # Create OwnerContact object if provided.
-                    owner = Person.objects.get(pk=service_request['owner_contact_id']) if service_request.get('owner_contact_id') else None
-                    owner_contact_time = service_request['owner_contact_time'] if service_request.get('owner_contact_time') else None
-                    owner_contact_note = service_request['owner_contact_note'] if service_request.get('owner_contact_note') else ''
-                    if owner or owner_contact_time or owner_contact_note:
-                        # Only create OwnerContact on first update, otherwise update existing OwnerContact.
-                        if not assigned_request.owner_contact:
-                            owner_contact = OwnerContact.objects.create(owner=owner, owner_contact_note=service_request['owner_contact_note'], owner_contact_time=owner_contact_time)
-                            assigned_request.owner_contact = owner_contact
-                        else:
-                            OwnerContact.objects.filter(assigned_request=assigned_request).update(owner=owner, owner_contact_note=service_request['owner_contact_note'], owner_contact_time=owner_contact_time)
-
-                assigned_request.save()
-                if service_request.get('unable_to_complete', False):
-                    evac_assignment.service_requests.remove(sr)
-                    evac_assignment.assigned_requests.remove(assigned_request)
-
-                sr.update_status(self.request.user)
-
-            action.send(self.request.user, verb='updated evacuation assignment', target=evac_assignment)
+                send_action(self.request.user, verb='assigned service request', target=service_requests[0])
+                events.append(build_map_event(service_requests[0], 'service_request'))
+
+            # Apply DAR form results in bulk.
+            DARSubmission(evac_assignment, self.request.user).submit(self.request.data.get('sr_updates', []), is_dar_form=bool(self.request.data.get('start_time')))
+
+            send_action(self.request.user, verb='updated evacuation assignment', target=evac_assignment)
+            if events:
+                queue_map_events(evac_assignment.incident.slug, events)
+
+            # Respond with the DA loaded through the list prefetches rather than fetching per SR.
+            serializer.instance = self.get_queryset().filter(pk=evac_assignment.pk).first() or evac_assignment
+
+    @drf_action(detail=False, methods=['GET'], name='Plan Assignments')
+    def plan(self, request):
+        incident = Incident.objects.get(slug=request.GET.get('incident'))
+        try:
+            team_count = int(request.GET.get('teams', 0))
+            max_stops = int(request.GET.get('max_stops', 0)) or None
+        except ValueError:
+            raise serializers.ValidationError({'teams': ['Expected a number.']})
+
+        # Plan for the teams dispatched since yesterday that are not on an open DA, or for a given number of new teams.
+        if team_count > 0:
+            teams = [None] * team_count
+        else:
+            y_mid = datetime.combine(datetime.today() - timedelta(days=1), datetime.min.time())
+            teams = [{'id': team.id, 'name': team.name} for team in DispatchTeam.objects.filter(incident=incident, show=True, dispatch_date__gte=y_mid, is_assigned=False).order_by('id')]
+        if not teams:
+            raise serializers.ValidationError({'teams': ['No available teams.']})
+
+        service_requests = list(ServiceRequest.objects.filter(incident=incident, status='open').with_animal_counts()
+            .annotate(injured=Exists(Animal.objects.filter(request_id=OuterRef('id'), injured='yes')))
+            .values('id', 'id_for_incident', 'latitude', 'longitude', 'priority', 'followup_date', 'aco_required', 'injured', *[field for field, _ in ANIMAL_COUNT_FIELDS]))
+        located = []
+        for sr in service_requests:
+            sr['animal_count'] = sum(sr.pop(field) for field, _ in ANIMAL_COUNT_FIELDS)
+            if sr['latitude'] is not None and sr['longitude'] is not None:
+                located.append(sr)
+        proposals, unassigned = plan_assignments(located, teams, max_stops)
+
+        details = {sr['id']: {
+            'id': sr['id'], 'id_for_incident': sr['id_for_incident'], 'latitude': float(sr['latitude']), 'longitude': float(sr['longitude']),
+            'priority': sr['priority'], 'aco_required': sr['aco_required'], 'injured': sr['injured'], 'animal_count': sr['animal_count'],
+        } for sr in located}
+        for proposal in proposals:
+            proposal['service_requests'] = [details[sr_id] for sr_id in proposal['service_requests']]
+        data = {
+            'proposals': proposals,
+            'unassigned': [sr['id'] for sr in service_requests if sr['latitude'] is None or sr['longitude'] is None] + unassigned,
+        }
+        return JsonResponse(data)
 
     @drf_action(detail=True, methods=['GET'], name='Download GeoJSON')
     def download(self, request, pk=None):
         ea = EvacAssignment.objects.get(id=pk)
-        data = ea.get_geojson()
-        data_string = json.dumps(data)
-        json_file = io.StringIO()
-        json_file.write(data_string)
-        json_file.seek(0)
-
-        wrapper = FileWrapper(json_file)
-        response = HttpResponse(wrapper, content_type='application/json')
+        response = StreamingHttpResponse(stream_geojson(ea.service_requests.all()), content_type='application/json')
         response['Content-Disposition'] = 'attachement; filename=DAR-' + str(ea.id_for_incident) + '.geojson'
         return response
 
-    @drf_action(detail=True, methods=['GET'], name='Push GeoJSON')
-    def push(self, request, pk=None):
+    @drf_action(detail=True, methods=['GET'], name='Offline Bundle')
+    def bundle(self, request, pk=None):
+        ea = EvacAssignment.objects.select_related('team').get(id=pk)
+        bundle = build_bundle(ea)
+        etag = '"%s"' % get_bundle_version(bundle)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=304)
+        else:
+            add_image_urls(bundle)
+            compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+            response = HttpResponse(encode_bundle(bundle, compress), content_type='application/json')
+            if compress:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        # Clients may keep bundles offline but must revalidate while connected.
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @drf_action(detail=True, methods=['POST'], name='Order Route')
+    def route(self, request, pk=None):
         ea = EvacAssignment.objects.get(id=pk)
-        data = {}
-        for sr in ea.service_requests.all():
-            success = True
+        # Optionally start the route from a staging shelter or a "lat,lon" point.
+        start = None
+        if request.data.get('shelter'):
+            shelter = Shelter.objects.get(id=request.data.get('shelter'))
+            if shelter.latitude is not None and shelter.longitude is not None:
+                start = (float(shelter.latitude), float(shelter.longitude))
+        elif request.data.get('start'):
             try:
-                sr.push_json()
-            except:
-                success = False
-            data[sr.id] = {'status': success}
+                start = tuple(float(value) for value in str(request.data.get('start')).split(','))
+            except ValueError:
+                start = ()
+            if len(start) != 2:
+                raise serializers.ValidationError({'start': ['Expected "latitude,longitude".']})
+        distance = ea.order_route(start)
+        data = {'service_requests': list(ea.assigned_requests.values_list('service_request_id', flat=True)), 'distance_km': round(distance, 3)}
+        return JsonResponse(data)
+
+    @drf_action(detail=True, methods=['GET'], name='Push GeoJSON')
+    def push(self, request, pk=None):
+        ea = EvacAssignment.objects.select_related('incident').get(id=pk)
+        data = CaltopoPusher(ea.incident).push(ea.service_requests.all())
         return JsonResponse(data)
@@ -301,7 +301,7 @@ function AnimalSearch({ incident, organization }) {
             if (lazyAnimalImage?.image) {
               animal.lazyImage = lazyAnimalImage.image
             } else if (animal.front_image) {
-              const imgData = await promiseImage(animal.front_image);
+              const imgData = await promiseImage(animal.front_image_thumbnail || animal.front_image);
               animal.lazyImage = imgData;
               addLazyAnimalImage(animal.id, imgData);
             }
@@ -51,7 +51,7 @@ async function buildAnimalCareScheduleContent(pdf, animals) {
       pdf.resetDocumentLeftMargin();
     }
 
-    const imageSrc = animal.front_image;
+    const imageSrc = animal.front_image_thumbnail || animal.front_image;
     let graphicOptions = {
       display: 'inline',
       maxHeight: 75,
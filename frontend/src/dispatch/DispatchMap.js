@@ -238,7 +238,7 @@ function Deploy({ incident, organization }) {
 
   // Locally working websocket connection.
   // TODO: bring back?
-  // useWebSocket('ws://' + window.location.host.replace('localhost:3000', 'localhost:8000') + '/ws/map_data/', {
+  // useWebSocket('ws://' + window.location.host.replace('localhost:3000', 'localhost:8000') + '/ws/map_data/' + incident + '/', {
   //   onMessage: (e) => {
   //     setNewData(true)
   //   },
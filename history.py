@@ -0,0 +1,57 @@
+from actstream.models import Action
+from django.contrib.contenttypes.models import ContentType
+from django.shortcuts import get_object_or_404
+from rest_framework.decorators import action as drf_action
+
+from location.utils import build_action_string
+from pagination import KeysetPagination
+
+
+class ActionHistoryPagination(KeysetPagination):
+    # Served by the (target_content_type, target_object_id, timestamp) index.
+    ordering = ('-timestamp', '-id')
+    page_size = 25
+    optional = False
+
+
+def get_target_actions(target):
+    """
+    Returns the actions targeting target, newest first, with actors and action objects
+    fetched in one query per content type.
+    """
+    return (
+        Action.objects.filter(target_content_type=ContentType.objects.get_for_model(target), target_object_id=str(target.pk))
+        .prefetch_related('actor', 'action_object')
+        .order_by('-timestamp', '-id')
+    )
+
+def get_action_history(serializer, obj):
+    """
+    Returns the action strings of obj for single object responses. Objects serialized
+    in a list have none, and their history is paged through /history/ instead.
+    """
+    if 'target_actions' in getattr(obj, '_prefetched_objects_cache', {}):
+        actions = obj.target_actions.all()
+    elif serializer.parent is None:
+        actions = get_target_actions(obj)
+    else:
+        return []
+    return [build_action_string(action) for action in actions]
+
+
+class ActionHistoryMixin(object):
+    """
+    Adds a /<pk>/history/ route to a ViewSet that pages through the actions targeting an object.
+    """
+
+    @drf_action(detail=True, methods=['GET'], name='History')
+    def history(self, request, pk=None):
+        target = get_object_or_404(self.get_queryset().model, pk=pk)
+        paginator = ActionHistoryPagination()
+        actions = paginator.paginate_queryset(get_target_actions(target), request, view=self)
+        data = []
+        for action in actions:
+            # The target is already known, so don't look it up again.
+            action.target = target
+            data.append({'id': action.id, 'verb': action.verb, 'timestamp': action.timestamp, 'description': build_action_string(action)})
+        return paginator.get_paginated_response(data)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import sartopo_python
+from django.conf import settings
+
+from .geojson import build_feature_description, get_species_counts
+
+logger = logging.getLogger(__name__)
+
+def build_marker_payload(service_request, description):
+    return {
+        'lat': float(service_request.latitude),
+        'lon': float(service_request.longitude),
+        'title': "SR#" + str(service_request.id_for_incident),
+        'color': '#FF0000',
+        'symbol': 'circle-n',
+        'description': description,
+    }
+
+def hash_marker_payload(payload, map_id):
+    # Includes the map, so SRs are pushed again when an incident is pointed at a new map.
+    return hashlib.sha256(json.dumps({'map': map_id, 'marker': payload}, sort_keys=True).encode('utf-8')).hexdigest()
+
+class CaltopoPusher(object):
+    """
+    Pushes ServiceRequest markers to an incident's Caltopo map.
+
+    One SartopoSession is opened per map and shared by every push. SRs whose marker
+    payload and map are unchanged since their last push are skipped unless forced, and
+    the rest are pushed concurrently, updating existing markers in place.
+    """
+
+    def __init__(self, incident, max_workers=None):
+        self.incident = incident
+        self.max_workers = max_workers or getattr(settings, 'CALTOPO_MAX_WORKERS', 4)
+        self.session = None
+
+    def open_session(self):
+        if not self.session:
+            self.session = sartopo_python.SartopoSession(getattr(settings, 'CALTOPO_DOMAIN', 'sartopo.com'),
+                self.incident.caltopo_map_id,
+                id=settings.CALTOPO_ID,
+                key=settings.CALTOPO_KEY,
+                accountId=settings.CALTOPO_ACCOUNT_ID,
+                sync=False,
+            )
+        return self.session
+
+    def push_marker(self, service_request, payload):
+        session = self.open_session()
+        feature_id = None
+        # Edit the existing marker if there is one, otherwise (or if it was removed from the map) add a new one.
+        if service_request.caltopo_feature_id:
+            feature_id = session.addMarker(existingId=service_request.caltopo_feature_id, **payload)
+        if not feature_id:
+            feature_id = session.addMarker(**payload)
+        return feature_id
+
+    def push(self, service_requests, force=False):
+        """
+        Pushes the given ServiceRequests and returns {service_request.id: {'status': bool, 'skipped': bool}}.
+
+        force pushes unchanged SRs too, e.g. to restore markers deleted on Caltopo.
+        """
+        service_requests = list(service_requests)
+        results = {}
+        species_counts = get_species_counts([service_request.id for service_request in service_requests])
+        pending = []
+        for service_request in service_requests:
+            if service_request.latitude is None or service_request.longitude is None:
+                results[service_request.id] = {'status': False, 'skipped': False}
+                continue
+            payload = build_marker_payload(service_request, build_feature_description(service_request, species_counts.get(service_request.id, {})))
+            payload_hash = hash_marker_payload(payload, self.incident.caltopo_map_id)
+            if not force and service_request.caltopo_feature_id and service_request.caltopo_feature_hash == payload_hash:
+                results[service_request.id] = {'status': True, 'skipped': True}
+            else:
+                pending.append((service_request, payload, payload_hash))
+
+        if not pending:
+            return results
+
+        try:
+            self.open_session()
+        except Exception:
+            logger.exception('Unable to open Caltopo map %s', self.incident.caltopo_map_id)
+            for service_request, _, _ in pending:
+                results[service_request.id] = {'status': False, 'skipped': False}
+            return results
+
+        def push_pending(item):
+            service_request, payload, _ = item
+            try:
+                return self.push_marker(service_request, payload)
+            except Exception:
+                logger.exception('Caltopo error on SR#%s', service_request.id_for_incident)
+                return None
+
+        # Only the HTTP requests run in the pool; database writes stay on this thread.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            feature_ids = list(executor.map(push_pending, pending))
+
+        pushed = []
+        for (service_request, _, payload_hash), feature_id in zip(pending, feature_ids):
+            results[service_request.id] = {'status': bool(feature_id), 'skipped': False}
+            if feature_id:
+                service_request.caltopo_feature_id = feature_id
+                service_request.caltopo_feature_hash = payload_hash
+                pushed.append(service_request)
+        from .models import ServiceRequest
+        ServiceRequest.objects.bulk_update(pushed, ['caltopo_feature_id', 'caltopo_feature_hash'])
+        return results
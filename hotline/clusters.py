@@ -0,0 +1,67 @@
+from django.db.models import Count, F, FloatField, IntegerField, Sum
+from django.db.models.functions import Cast, Floor
+
+from .managers import ANIMAL_COUNT_FIELDS
+
+# Grid cells per 256px map tile, so a cell is ~64px wide at any zoom.
+CELLS_PER_TILE = 4
+# From this zoom on, SRs are returned individually instead of clustered.
+MAX_CLUSTER_ZOOM = 15
+
+def get_cell_size(zoom):
+    # Width of a grid cell in degrees at the given zoom.
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+def cell_expressions(prefix, cell_size):
+    return {
+        'cell_x': Cast(Floor(Cast(F(prefix + 'longitude'), FloatField()) / cell_size), IntegerField()),
+        'cell_y': Cast(Floor(Cast(F(prefix + 'latitude'), FloatField()) / cell_size), IntegerField()),
+    }
+
+def cluster_service_requests(service_requests, zoom):
+    """
+    Groups geolocated ServiceRequests into grid cells for the given zoom.
+
+    Returns a list of clusters with the SR count by status and priority, the summed
+    animal counts by status (as on MapServiceRequestSerializer), and the cell centroid.
+    Uses two grouped queries regardless of the number of SRs.
+    """
+    from animals.models import Animal
+
+    cell_size = get_cell_size(zoom)
+    service_requests = service_requests.exclude(latitude=None).exclude(longitude=None).order_by()
+
+    clusters = {}
+    rows = (
+        service_requests.annotate(**cell_expressions('', cell_size))
+        .values('cell_x', 'cell_y', 'status', 'priority')
+        .annotate(count=Count('id'), latitude_sum=Sum(Cast('latitude', FloatField())), longitude_sum=Sum(Cast('longitude', FloatField())))
+    )
+    for row in rows:
+        cluster = clusters.setdefault((row['cell_x'], row['cell_y']), {
+            'count': 0, 'latitude': 0, 'longitude': 0, 'status': {}, 'priority': {}, 'bounds': [
+                row['cell_x'] * cell_size, row['cell_y'] * cell_size, (row['cell_x'] + 1) * cell_size, (row['cell_y'] + 1) * cell_size,
+            ],
+            **{field: 0 for field, _ in ANIMAL_COUNT_FIELDS},
+        })
+        cluster['count'] += row['count']
+        cluster['latitude'] += row['latitude_sum']
+        cluster['longitude'] += row['longitude_sum']
+        cluster['status'][row['status']] = cluster['status'].get(row['status'], 0) + row['count']
+        cluster['priority'][row['priority']] = cluster['priority'].get(row['priority'], 0) + row['count']
+
+    fields = {status: field for field, status in ANIMAL_COUNT_FIELDS}
+    animal_rows = (
+        Animal.objects.filter(request__in=service_requests.values('id'), status__in=fields.keys()).order_by()
+        .annotate(**cell_expressions('request__', cell_size))
+        .values('cell_x', 'cell_y', 'status').annotate(total=Sum('animal_count'))
+    )
+    for row in animal_rows:
+        cluster = clusters.get((row['cell_x'], row['cell_y']))
+        if cluster:
+            cluster[fields[row['status']]] += row['total']
+
+    for cluster in clusters.values():
+        cluster['latitude'] = round(cluster['latitude'] / cluster['count'], 6)
+        cluster['longitude'] = round(cluster['longitude'] / cluster['count'], 6)
+    return [clusters[cell] for cell in sorted(clusters)]
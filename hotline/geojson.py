@@ -0,0 +1,77 @@
+import json
+import re
+
+from django.db.models import Count
+
+FEATURE_STATUSES = [('Reported','REPORTED'), ('Reported (Evac Requested)','REPORTED (EVAC REQUESTED)'), ('Reported (SIP Requested)','REPORTED (SIP REQUESTED)'), ('SIP','SHELTERED IN PLACE'), ('UTL', 'UNABLE TO LOCATE')]
+# Species names that are their own plural.
+UNCOUNTABLE_SPECIES = ['sheep', 'cattle']
+
+def parse_ids(value):
+    # Accepts both "id=1&id=2&" (as sent by the SR search page) and "1,2".
+    return [int(id) for id in re.findall(r'\d+', value or '')]
+
+def get_species_counts(service_request_ids):
+    """
+    Returns {service_request_id: {status: {species_name: count}}} for the given SRs in one query.
+    """
+    from animals.models import Animal
+
+    species_counts = {}
+    counts = (
+        Animal.objects.filter(request_id__in=service_request_ids, status__in=[status for _, status in FEATURE_STATUSES])
+        .order_by().values('request_id', 'status', 'species__name').annotate(count=Count('id'))
+        .order_by('request_id', 'status', 'species__name')
+    )
+    for row in counts:
+        statuses = species_counts.setdefault(row['request_id'], {status:{} for _, status in FEATURE_STATUSES})
+        statuses[row['status']][row['species__name'] or 'unknown'] = row['count']
+    return species_counts
+
+def build_feature_description(service_request, species_counts):
+    description = service_request.location_output.rsplit(',', 1)[0]  + " ("
+    count = 0
+    for label, status in FEATURE_STATUSES:
+        if len(species_counts.get(status, {}).items()) > 0:
+            if count > 0:
+                description += '; '
+            count+= 1
+            description += label + ': ' + ', '.join(f'{value} {key}' + ('s' if value != 1 and key not in UNCOUNTABLE_SPECIES else '') for key, value in species_counts[status].items()) #123 Ranch Rd, Napa CA (1 cat, 2 dogs)
+    description += ")"
+    return description
+
+def build_feature_json(service_request, description):
+    return {
+      "geometry":{
+          "coordinates":[
+            str(service_request.longitude),
+            str(service_request.latitude),
+            0,
+            0
+          ],
+          "type":"Point"
+      },
+      "id":service_request.id_for_incident,
+      "type":"Feature",
+      "properties":{
+          "marker-symbol":"circle-n",
+          "marker-color":"#FF0000",
+          "description":description,
+          "title": "SR#" + str(service_request.id_for_incident),
+          "class":"Marker",
+      }
+    }
+
+def stream_geojson(service_requests):
+    """
+    Yields a GeoJSON FeatureCollection for the given ServiceRequest queryset.
+
+    Uses two queries regardless of size: the species counts for every SR, then the SRs
+    themselves read through a server-side cursor.
+    """
+    species_counts = get_species_counts(service_requests.values('id'))
+    yield '{"features":['
+    for index, service_request in enumerate(service_requests.iterator()):
+        description = build_feature_description(service_request, species_counts.get(service_request.id, {}))
+        yield (',' if index else '') + json.dumps(build_feature_json(service_request, description))
+    yield ']}'
@@ -1,8 +1,44 @@
 from django.db import models
-from managers import ActionHistoryQueryset
+from django.db.models.functions import Coalesce
+from managers import ActionHistoryQueryset, LocationQueryset, SearchVectorQueryset, UpdatedAtQueryset
+
+# Per-status animal counts shown on the SR map, as (field, animal status).
+ANIMAL_COUNT_FIELDS = (
+    ('reported_animals', 'REPORTED'),
+    ('reported_evac', 'REPORTED (EVAC REQUESTED)'),
+    ('reported_sheltered_in_place', 'REPORTED (SIP REQUESTED)'),
+    ('sheltered_in_place', 'SHELTERED IN PLACE'),
+    ('unable_to_locate', 'UNABLE TO LOCATE'),
+)
+
+class ServiceRequestQueryset(UpdatedAtQueryset, LocationQueryset, SearchVectorQueryset, ActionHistoryQueryset):
+    search_vector_fields = (
+        ('address', 'B'), ('city', 'C'), ('animal__name', 'A'),
+        ('owners__first_name', 'A'), ('owners__last_name', 'A'), ('reporter__first_name', 'A'), ('reporter__last_name', 'A'),
+    )
 
-class ServiceRequestQueryset(ActionHistoryQueryset):
     def with_images(self):
         return self.prefetch_related(
             models.Prefetch("servicerequestimage_set", to_attr="images")
-        )
\ No newline at end of file
+        )
+
+    def with_animal_counts(self):
+        """
+        Annotates the per-status animal counts and aco_required flag used by MapServiceRequestSerializer.
+
+        Each count is a correlated subquery rather than a Sum over an animal join so that
+        later search/status filters that join animals cannot inflate the totals.
+        """
+        from animals.models import Animal
+
+        def status_count(status):
+            counts = (
+                Animal.objects.filter(request=models.OuterRef('pk'), status=status)
+                .order_by().values('request').annotate(total=models.Sum('animal_count')).values('total')
+            )
+            return Coalesce(models.Subquery(counts, output_field=models.IntegerField()), 0)
+
+        return self.annotate(
+            **{field: status_count(status) for field, status in ANIMAL_COUNT_FIELDS},
+            aco_required=models.Exists(Animal.objects.filter(request=models.OuterRef('pk'), aco_required='yes').exclude(status='CANCELED')),
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotline', '0026_servicerequestnote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['incident', '-timestamp', 'id'], name='sr_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotline', '0028_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequest',
+            name='caltopo_feature_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
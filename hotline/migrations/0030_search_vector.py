@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from managers import build_search_vector
+
+
+SEARCH_VECTOR_FIELDS = (
+    ('address', 'B'), ('city', 'C'), ('animal__name', 'A'),
+    ('owners__first_name', 'A'), ('owners__last_name', 'A'), ('reporter__first_name', 'A'), ('reporter__last_name', 'A'),
+)
+
+def populate_search_vector(apps, schema_editor):
+    ServiceRequest = apps.get_model('hotline', 'ServiceRequest')
+    ServiceRequest.objects.update(search_vector=build_search_vector(ServiceRequest, SEARCH_VECTOR_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotline', '0029_caltopo_feature_hash'),
+        ('animals', '0038_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequest',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='sr_search_idx'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
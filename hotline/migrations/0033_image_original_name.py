@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotline', '0032_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequestimage',
+            name='original_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -1,17 +1,21 @@
-import sartopo_python
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models, transaction
-from django.conf import settings
-from actstream import action
-from django.core.mail import send_mass_mail
+from activity import send_action
+from consumers import build_map_event, queue_map_events
 from django.template.loader import render_to_string
 from django.contrib.sites.models import Site
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save
 from django.contrib.auth import get_user_model
 from accounts.models import ShelterlyUser
+from images import ImageDerivatives
 from location.models import Location
 from people.models import Person
+from .caltopo import CaltopoPusher
+from .geojson import build_feature_description, build_feature_json, get_species_counts
 from .managers import ServiceRequestQueryset
-from incident.models import Incident, IncidentNotification
+from incident.models import Incident, IncidentCounter, IncidentNotification
+from outbox.models import queue_email
 
 User = get_user_model()
 
@@ -35,6 +39,7 @@ class ServiceRequest(Location):
 
     #pre_fields
     timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     directions = models.TextField(blank=True)
     verbal_permission = models.BooleanField(default=False)
     key_provided = models.BooleanField(default=False)
@@ -43,6 +48,8 @@ class ServiceRequest(Location):
     sip = models.BooleanField(default=False)
     utl = models.BooleanField(default=False)
     caltopo_feature_id = models.CharField(blank=True, max_length=100)
+    caltopo_feature_hash = models.CharField(blank=True, max_length=64)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     #post_fields
     followup_date = models.DateTimeField(auto_now=False, auto_now_add=False, blank=True, null=True)
@@ -73,13 +80,17 @@ class ServiceRequest(Location):
         if Animal.objects.filter(status__in=['CANCELED'], request=self).count() == self.animal_set.count():
             AssignedRequest.objects.filter(service_request=self, dispatch_assignment__end_time=None).delete()
 
-        if self.status != status:
+        changed = self.status != status
+        if changed:
             status_verb = 'opened' if status == 'open' else status
-            action.send(user, verb=f'{status_verb} service request', target=self)
+            send_action(user, verb=f'{status_verb} service request', target=self)
 
         self.status = status
         self.save()
 
+        if changed:
+            queue_map_events(self.incident.slug, [build_map_event(self, 'service_request')])
+
     def update_sip_utl(self):
         from animals.models import Animal
         sip = self.sip
@@ -96,76 +107,18 @@ class ServiceRequest(Location):
         self.save()
 
     def get_feature_description(self):
-        species_counts = {'REPORTED':{}, 'REPORTED (EVAC REQUESTED)':{}, 'REPORTED (SIP REQUESTED)':{}, 'SHELTERED IN PLACE':{}, 'UNABLE TO LOCATE':{}}
-        for animal in self.animal_set.filter(status__in=['REPORTED', 'REPORTED (EVAC REQUESTED)', 'REPORTED (SIP REQUESTED)', 'SHELTERED IN PLACE', 'UNABLE TO LOCATE']):
-            species_counts[animal.status][animal.species.name] = species_counts[animal.status].get(animal.species.name, 0) + 1
-        description = self.location_output.rsplit(',', 1)[0]  + " ("
-        count = 0
-        for status in [('Reported','REPORTED'), ('Reported (Evac Requested)','REPORTED (EVAC REQUESTED)'), ('Reported (SIP Requested)','REPORTED (SIP REQUESTED)'), ('SIP','SHELTERED IN PLACE'), ('UTL', 'UNABLE TO LOCATE')]:
-            if len(species_counts[status[1]].items()) > 0:
-                if count > 0:
-                    description += '; ' 
-                count+= 1
-                description += status[0] + ': ' + ', '.join(f'{value} {key}' + ('s' if value != 1 and animal.species.name != 'sheep' and animal.species.name != 'cattle' else '') for key, value in species_counts[status[1]].items()) #123 Ranch Rd, Napa CA (1 cat, 2 dogs)
-        description += ")"
-        return description
+        return build_feature_description(self, get_species_counts([self.id]).get(self.id, {}))
 
     def get_feature_json(self):
-        description = self.get_feature_description()
-        feature_json = {
-          "geometry":{
-              "coordinates":[
-                str(self.longitude),
-                str(self.latitude),
-                0,
-                0
-              ],
-              "type":"Point"
-          },
-          "id":self.id_for_incident,
-          "type":"Feature",
-          "properties":{
-              "marker-symbol":"circle-n",
-              "marker-color":"#FF0000",
-              "description":description,
-              "title": "SR#" + str(self.id_for_incident),
-              "class":"Marker",
-          }
-        }
-        return feature_json
+        return build_feature_json(self, self.get_feature_description())
 
     def push_json(self):
-        sts = sartopo_python.SartopoSession('sartopo.com',
-            self.incident.caltopo_map_id,
-            id=settings.CALTOPO_ID,
-            key=settings.CALTOPO_KEY,
-            accountId=settings.CALTOPO_ACCOUNT_ID,
-            sync=False,
-        )
-        # If the SR has already previously been pushed to Caltopo, it will have
-        # a caltopo_feature_id, try to remove old object to create new one.
-        if self.caltopo_feature_id:
-            try:
-                sts.delMarker(markerOrId=self.caltopo_feature_id)
-            except:
-                pass
-        payload = {
-            'title': "SR#" + str(self.id_for_incident),
-            'color': '#FF0000',
-            'symbol': 'circle-n',
-            'description': self.get_feature_description()
-        }
-        lon = self.longitude
-        lat = self.latitude
-        self.caltopo_feature_id = sts.addMarker(lon=lon, lat=lat, **payload)
-        self.save()
+        return CaltopoPusher(self.incident).push([self])[self.id]['status']
 
     def save(self, *args, **kwargs):
         if not self.pk:
-            total_srs = ServiceRequest.objects.select_for_update().filter(incident=self.incident).values_list('id', flat=True)
             with transaction.atomic():
-                count = len(total_srs)
-                self.id_for_incident = count + 1
+                self.id_for_incident = IncidentCounter.next_value(ServiceRequest, self.incident_id)
                 super(ServiceRequest, self).save(*args, **kwargs)
         else:
             super(ServiceRequest, self).save(*args, **kwargs)
@@ -174,15 +127,21 @@ class ServiceRequest(Location):
 
     class Meta:
         ordering = ['-timestamp']
-
-# Send email to hotline users on creation.
+        indexes = [
+            # Keyset pagination for ServiceRequestViewSet.
+            models.Index(fields=['incident', '-timestamp', 'id'], name='sr_keyset_idx'),
+            GinIndex(fields=['search_vector'], name='sr_search_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='sr_latlon_idx'),
+        ]
+
+# Queue email to hotline users on creation.
 def email_on_creation(sender, instance, **kwargs):
     if kwargs["created"]:
         # Send email here.
         incident_notifications = IncidentNotification.objects.filter(incident=instance.incident)
         user_emails = [inc_not.user.email for inc_not in incident_notifications.all()]
         if len(user_emails) > 0:
-            message = (
+            queue_email(
                 "Service Request #" + str(instance.id_for_incident) + " Created for Shelterly",
                 render_to_string(
                     'service_request_creation_email.txt',
@@ -198,12 +157,28 @@ def email_on_creation(sender, instance, **kwargs):
                 "DoNotReply@shelterly.org",
                 user_emails,
             )
-            send_mass_mail((message,))
 
 post_save.connect(email_on_creation, sender=ServiceRequest)
 
+# Reindex the SR and the animals that index its address.
+def refresh_search_vector(sender, instance, **kwargs):
+    from animals.models import Animal
+    ServiceRequest.objects.filter(pk=instance.pk).refresh_search_vector()
+    Animal.objects.filter(request=instance).refresh_search_vector()
+
+post_save.connect(refresh_search_vector, sender=ServiceRequest)
+
+def owners_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            ServiceRequest.objects.filter(pk__in=pk_set or []).refresh_search_vector()
+        else:
+            ServiceRequest.objects.filter(pk=instance.pk).refresh_search_vector()
+
+m2m_changed.connect(owners_changed, sender=ServiceRequest.owners.through)
+
 
-class ServiceRequestImage(models.Model):
+class ServiceRequestImage(ImageDerivatives):
 
     image = models.ImageField(upload_to='images/')
     name = models.CharField(max_length=25, blank=True)
@@ -2,7 +2,8 @@ from rest_framework import serializers
 
 from .models import ServiceRequest, ServiceRequestNote, VisitNote
 from animals.serializers import SimpleAnimalSerializer, ModestAnimalSerializer, AnimalSerializer
-from location.utils import build_full_address, build_action_string
+from history import get_action_history
+from location.utils import build_full_address
 
 class VisitNoteSerializer(serializers.ModelSerializer):
 
@@ -12,19 +13,24 @@ class VisitNoteSerializer(serializers.ModelSerializer):
     dispatch_assignment = serializers.SerializerMethodField()
     service_request = serializers.SerializerMethodField()
 
+    def get_assigned_request(self, obj):
+        # Uses the prefetched assigned_request when available.
+        assigned_requests = obj.assigned_request.all()
+        return assigned_requests[0] if assigned_requests else None
+
     def get_address(self, obj):
-        if obj.assigned_request.first():
-            return obj.assigned_request.first().service_request.location_output
+        if self.get_assigned_request(obj):
+            return self.get_assigned_request(obj).service_request.location_output
         return None
 
     def get_dispatch_assignment(self, obj):
-        if obj.assigned_request.first():
-            return obj.assigned_request.first().dispatch_assignment.id_for_incident
+        if self.get_assigned_request(obj):
+            return self.get_assigned_request(obj).dispatch_assignment.id_for_incident
         return None
     
     def get_service_request(self, obj):
-        if obj.assigned_request.first():
-            return obj.assigned_request.first().service_request.id_for_incident
+        if self.get_assigned_request(obj):
+            return self.get_assigned_request(obj).service_request.id_for_incident
         return None
 
     def get_team_name(self, obj):
@@ -79,81 +85,45 @@ class MapServiceRequestSerializer(BarebonesServiceRequestSerializer):
 
     # Custom field for if any animal is ACO Required. If it is aggressive or "Other" species.
     def get_aco_required(self, obj):
+        # Use the ServiceRequestQueryset.with_animal_counts() annotation when available.
+        if hasattr(obj, 'aco_required'):
+            return obj.aco_required
         # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
         try:
             return bool([animal for animal in obj.animals if animal.aco_required == 'yes'])
         except AttributeError:
             return obj.animal_set.filter(aco_required='yes').exists()
 
-    # Custom field for determining if an SR contains REPORTED animals.
-    def get_reported_animals(self, obj):
+    # Sums animal_count for the animals of an SR with the given status.
+    def get_status_count(self, obj, field, status):
+        # Use the ServiceRequestQueryset.with_animal_counts() annotation when available.
+        if hasattr(obj, field):
+            return getattr(obj, field)
         # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
-        count = 0
         try:
-            for animal in obj.animals:
-                if animal.status == 'REPORTED':
-                    count += animal.animal_count
-            return count
+            return sum(animal.animal_count for animal in obj.animals if animal.status == status)
         except AttributeError:
-            for animal in obj.animal_set.filter(status='REPORTED'):
-                count += animal.animal_count
-            return count
+            return sum(obj.animal_set.filter(status=status).values_list('animal_count', flat=True))
+
+    # Custom field for determining if an SR contains REPORTED animals.
+    def get_reported_animals(self, obj):
+        return self.get_status_count(obj, 'reported_animals', 'REPORTED')
 
     # Custom field for determining if an SR contains REPORTED (EVAC REQUESTED) animals.
     def get_reported_evac(self, obj):
-        # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
-        count = 0
-        try:
-            for animal in obj.animals:
-                if animal.status == 'REPORTED (EVAC REQUESTED)':
-                    count += animal.animal_count
-            return count
-        except AttributeError:
-            for animal in obj.animal_set.filter(status='REPORTED (EVAC REQUESTED)'):
-                count += animal.animal_count
-            return count
+        return self.get_status_count(obj, 'reported_evac', 'REPORTED (EVAC REQUESTED)')
 
     # Custom field for determining that count of REPORTED (SIP REQUESTED) animals.
     def get_reported_sheltered_in_place(self, obj):
-        # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
-        count = 0
-        try:
-            for animal in obj.animals:
-                if animal.status == 'REPORTED (SIP REQUESTED)':
-                    count += animal.animal_count
-            return count
-        except AttributeError:
-            for animal in obj.animal_set.filter(status='REPORTED (SIP REQUESTED)'):
-                count += animal.animal_count
-            return count
+        return self.get_status_count(obj, 'reported_sheltered_in_place', 'REPORTED (SIP REQUESTED)')
 
     # Custom field for determining that count of SHELTERED IN PLACE animals.
     def get_sheltered_in_place(self, obj):
-        # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
-        count = 0
-        try:
-            for animal in obj.animals:
-                if animal.status == 'SHELTERED IN PLACE':
-                    count += animal.animal_count
-            return count
-        except AttributeError:
-            for animal in obj.animal_set.filter(status='SHELTERED IN PLACE'):
-                count += animal.animal_count
-            return count
+        return self.get_status_count(obj, 'sheltered_in_place', 'SHELTERED IN PLACE')
 
     # Custom field for determining that count of UNABLE TO LOCATE animals.
     def get_unable_to_locate(self, obj):
-        # Performs list comp. on prefetched queryset of animals for this SR to avoid hitting db again.
-        count = 0
-        try:
-            for animal in obj.animals:
-                if animal.status == 'UNABLE TO LOCATE':
-                    count += animal.animal_count
-            return count
-        except AttributeError:
-            for animal in obj.animal_set.filter(status='UNABLE TO LOCATE'):
-                count += animal.animal_count
-            return count
+        return self.get_status_count(obj, 'unable_to_locate', 'UNABLE TO LOCATE')
 
     class Meta:
         model = ServiceRequest
@@ -196,13 +166,13 @@ class SimpleServiceRequestSerializer(MapServiceRequestSerializer):
 
     def get_images(self, obj):
         try:
-            return [{'id':sr_image.id, 'url':sr_image.image.url, 'name':sr_image.name} for sr_image in obj.images]
+            return [{'id':sr_image.id, 'url':sr_image.image.url, 'thumbnail':sr_image.get_url('thumbnail'), 'medium':sr_image.get_url('medium'), 'name':sr_image.name} for sr_image in obj.images]
         except IndexError:
             return []
         except AttributeError:
             # Should only hit this when returning a single object after create.
             try:
-                return [{'id':sr_image.id, 'url':sr_image.image.url, 'name':sr_image.name} for sr_image in obj.servicerequestimage_set.all()]
+                return [{'id':sr_image.id, 'url':sr_image.image.url, 'thumbnail':sr_image.get_url('thumbnail'), 'medium':sr_image.get_url('medium'), 'name':sr_image.name} for sr_image in obj.servicerequestimage_set.all()]
             except AttributeError:
                 return []
 
@@ -257,4 +227,4 @@ class ServiceRequestSerializer(SimpleServiceRequestSerializer):
 
     # Custom field for the action history list.
     def get_action_history(self, obj):
-        return [build_action_string(action) for action in obj.target_actions.all()]
+        return get_action_history(self, obj)
@@ -1,3 +1,13 @@
+import json
+import threading
+import uuid
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from django.test import override_settings
+from django.utils import timezone
 from rest_framework.test import APITestCase
 
 from accounts.models import ShelterlyUser
@@ -5,6 +15,33 @@ from animals.models import Animal
 from hotline.models import ServiceRequest
 from people.models import Person
 from incident.models import Incident
+from hotline.caltopo import CaltopoPusher
+from consumers import MapEventCoalescer, map_event_coalescer, map_group_name
+
+class FakeCaltopoHandler(BaseHTTPRequestHandler):
+    # Minimal stand-in for the Caltopo map API used by sartopo_python.
+
+    def send_json(self, result):
+        body = json.dumps({'status':'ok', 'timestamp':1, 'result':result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        self.send_json({'timestamp':1, 'ids':{}, 'state':{'features':[]}})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(('POST', self.path))
+        feature_id = self.path.rstrip('/').split('/')[-1] if not self.path.endswith('/Marker') else str(uuid.uuid4())
+        self.send_json({'id':feature_id})
+
+    def log_message(self, *args):
+        pass
+
 
 class TestViews(APITestCase):
 
@@ -71,3 +108,230 @@ class TestViews(APITestCase):
         response = self.client.post(f'/hotline/api/servicerequests/', {'reporter':self.person.pk, 'address':"123 Main St.", 'city':'Springfield', 'state':'MA', 'directions':"Turn left.", 'latitude':0, 'longitude':0, 'incident_slug':self.new_incident.slug}, format='json')
         self.assertEqual(response.status_code, 201)
         self.assertTrue(ServiceRequest.objects.filter(reporter=self.person.pk, address='123 Main St.', directions="Turn left.").exists())
+
+    def test_id_for_incident_counter(self):
+        new_incident = Incident.objects.create(name='Test5', slug='test5', latitude=0, longitude=0)
+        first = ServiceRequest.objects.create(directions="Turn left", incident=new_incident)
+        second = ServiceRequest.objects.create(directions="Turn right", incident=new_incident)
+        self.assertEqual((first.id_for_incident, second.id_for_incident), (1, 2))
+        # Counters are per incident and per model.
+        self.assertEqual(Animal.objects.create(name='Henry', incident=new_incident).id_for_incident, 1)
+        # Deleting a row never hands out a duplicate id.
+        second.delete()
+        self.assertEqual(ServiceRequest.objects.create(directions="Go straight", incident=new_incident).id_for_incident, 3)
+
+    def test_get_service_requests_paginated(self):
+        for directions in ['Turn right', 'Go straight']:
+            ServiceRequest.objects.create(directions=directions, incident=self.incident)
+        self.client.force_authenticate(self.user)
+        ids = []
+        url = '/hotline/api/servicerequests/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(sr['id'] for sr in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(sorted(ids), list(ServiceRequest.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+        # Map requests keep their own ordering and are never paginated.
+        response = self.client.get('/hotline/api/servicerequests/?landingmap=true&page_size=2')
+        self.assertIsInstance(response.json(), list)
+
+    def test_service_requests_since(self):
+        other_sr = ServiceRequest.objects.create(directions="Turn right", latitude=0, longitude=0, incident=self.incident)
+        Animal.objects.create(request=other_sr, name='Henry', incident=self.incident)
+        ServiceRequest.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        Animal.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+        self.client.force_authenticate(self.user)
+        other_sr.animal_set.update(status='REPORTED (EVAC REQUESTED)')
+        response = self.client.get('/hotline/api/servicerequests/', {'incident': self.incident.slug, 'since': since, 'map': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([sr['id'] for sr in response.json()['results']], [other_sr.id])
+        self.assertEqual(response.json()['removed'], [])
+        ServiceRequest.objects.filter(id=other_sr.id).update(status='canceled')
+        response = self.client.get('/hotline/api/servicerequests/', {'incident': self.incident.slug, 'since': response.json()['sync_token'], 'map': 'true'})
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(response.json()['removed'], [other_sr.id])
+
+    def test_service_requests_since_invalid(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/hotline/api/servicerequests/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    # The Postgres layer keeps one connection pool per event loop, and each async_to_sync call below runs on a new one.
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_create_service_request_map_event(self):
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(map_group_name(self.incident.slug), channel_name)
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/hotline/api/servicerequests/', {'reporter':self.person.pk, 'address':"123 Main St.", 'directions':"Turn left.", 'latitude':1.5, 'longitude':2.5, 'incident_slug':self.incident.slug}, format='json')
+        self.assertEqual(response.status_code, 201)
+        map_event_coalescer.flush(self.incident.slug)
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message['type'], 'map_events')
+        self.assertEqual(message['events'], [{'entity':'service_request', 'id':response.json()['id'], 'id_for_incident':response.json()['id_for_incident'], 'status':'open', 'priority':2, 'latitude':1.5, 'longitude':2.5}])
+
+    def test_update_service_request_map_event(self):
+        self.client.force_authenticate(self.user)
+        with patch.object(map_event_coalescer, 'add') as add, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/hotline/api/servicerequests/{self.service_request.pk}/', {'status':'canceled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        add.assert_called_once()
+        self.assertEqual([(event['id'], event['status']) for event in add.call_args[0][1]], [(self.service_request.id, 'canceled')])
+
+    def test_transfer_animals_reindexed(self):
+        new_request = ServiceRequest.objects.create(address="9 Elm St.", incident=self.incident)
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(f'/hotline/api/servicerequests/{self.service_request.pk}/', {'new_request_id':new_request.id, 'animal_ids':[self.animal.id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Animal.objects.search(['Elm'])), [self.animal])
+        self.assertEqual(list(ServiceRequest.objects.search(['bella'])), [new_request])
+
+    def test_map_events_coalesced(self):
+        coalescer = MapEventCoalescer(window=60)
+        with patch('consumers.send_map_events') as send_map_events:
+            coalescer.add(self.incident.slug, [{'entity':'service_request', 'id':1, 'status':'open'}])
+            coalescer.add(self.incident.slug, [{'entity':'service_request', 'id':2, 'status':'open'}, {'entity':'service_request', 'id':1, 'status':'assigned'}])
+            send_map_events.assert_not_called()
+            coalescer.flush(self.incident.slug)
+        send_map_events.assert_called_once_with(self.incident.slug, [{'entity':'service_request', 'id':2, 'status':'open'}, {'entity':'service_request', 'id':1, 'status':'assigned'}])
+
+    def test_map_events_without_threads(self):
+        # Under Lambda a timer could be frozen with the process, so events are sent right away.
+        with patch.dict('os.environ', {'AWS_LAMBDA_FUNCTION_NAME': 'shelterly'}):
+            coalescer = MapEventCoalescer(window=60)
+        with patch('consumers.send_map_events') as send_map_events:
+            coalescer.add(self.incident.slug, [{'entity':'service_request', 'id':1, 'status':'open'}])
+        send_map_events.assert_called_once_with(self.incident.slug, [{'entity':'service_request', 'id':1, 'status':'open'}])
+        self.assertEqual(coalescer.timers, {})
+
+    def test_service_request_animal_counts(self):
+        Animal.objects.create(request=self.service_request, name='Henry', animal_count=3, status='REPORTED (EVAC REQUESTED)', aco_required='yes', incident=self.incident)
+        Animal.objects.create(request=self.service_request, name='Rex', status='UNABLE TO LOCATE', incident=self.incident)
+        Animal.objects.create(request=self.service_request, name='Spot', status='CANCELED', aco_required='yes', incident=self.incident)
+        sr = ServiceRequest.objects.with_animal_counts().get(id=self.service_request.id)
+        self.assertEqual((sr.reported_animals, sr.reported_evac, sr.reported_sheltered_in_place, sr.sheltered_in_place, sr.unable_to_locate, sr.aco_required), (1, 3, 0, 0, 1, True))
+        self.client.force_authenticate(self.user)
+        # Searching on animal names must not inflate the counts.
+        response = self.client.get('/hotline/api/servicerequests/', {'search': 'Henry'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['reported_evac'], 3)
+        self.assertEqual(response.json()[0]['reported_animals'], 1)
+
+    def test_download_all_geojson(self):
+        other_sr = ServiceRequest.objects.create(address="123 Main St.", city="Napa", state="CA", latitude=1, longitude=2, incident=self.incident)
+        Animal.objects.create(request=other_sr, name='Henry', incident=self.incident)
+        Animal.objects.create(request=other_sr, name='Rex', incident=self.incident)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get('/hotline/api/servicerequests/download_all/', {'ids': f'id={self.service_request.id}&id={other_sr.id}&'})
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['features']), 2)
+        self.assertEqual(data['features'][1]['properties']['description'], '123 Main St., Napa (Reported: 2 unknowns)')
+        self.assertEqual(data['features'][1]['geometry']['coordinates'][:2], ['2.000000', '1.000000'])
+
+    def test_caltopo_push(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCaltopoHandler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.incident.caltopo_map_id = 'ABC123'
+        self.incident.save()
+        srs = [ServiceRequest.objects.create(address=f"{i} Main St.", city="Napa", state="CA", latitude=1, longitude=i, incident=self.incident) for i in range(1, 4)]
+        with override_settings(CALTOPO_DOMAIN=f'127.0.0.1:{server.server_address[1]}'):
+            results = CaltopoPusher(self.incident, max_workers=2).push(srs + [self.service_request])
+            self.assertEqual([results[sr.id] for sr in srs], [{'status':True, 'skipped':False}] * 3)
+            # No coordinates to push.
+            self.assertEqual(results[self.service_request.id], {'status':False, 'skipped':False})
+            # One map sync for the session, then one marker per SR.
+            self.assertEqual([method for method, _ in server.requests], ['GET', 'POST', 'POST', 'POST'])
+
+            # Unchanged SRs are skipped and a changed SR updates its existing marker.
+            server.requests = []
+            Animal.objects.create(request=srs[0], name='Rex', incident=self.incident)
+            srs = list(ServiceRequest.objects.filter(id__in=[sr.id for sr in srs]).order_by('id'))
+            results = CaltopoPusher(self.incident).push(srs)
+        self.assertEqual([results[sr.id]['skipped'] for sr in srs], [False, True, True])
+        self.assertEqual(server.requests[1], ('POST', f'/api/v1/map/ABC123/Marker/{srs[0].caltopo_feature_id}'))
+        self.assertEqual(len(server.requests), 2)
+
+        with override_settings(CALTOPO_DOMAIN=f'127.0.0.1:{server.server_address[1]}'):
+            # Forcing re-sends unchanged SRs.
+            results = CaltopoPusher(self.incident).push(srs[1:2], force=True)
+            self.assertEqual(results[srs[1].id], {'status':True, 'skipped':False})
+            # Every SR is pushed again to a new map.
+            self.incident.caltopo_map_id = 'DEF456'
+            self.incident.save()
+            srs = list(ServiceRequest.objects.filter(id__in=[sr.id for sr in srs]).order_by('id'))
+            results = CaltopoPusher(self.incident).push(srs)
+        self.assertEqual([results[sr.id]['skipped'] for sr in srs], [False, False, False])
+
+    def test_full_text_search(self):
+        other_sr = ServiceRequest.objects.create(address="12 Elm St.", city="Napa", incident=self.incident)
+        Animal.objects.create(request=other_sr, name='Doe', incident=self.incident)
+        self.client.force_authenticate(self.user)
+        # Every term must prefix-match a word indexed for the SR.
+        response = self.client.get('/hotline/api/servicerequests/', {'search': 'ja do'})
+        self.assertEqual([sr['id'] for sr in response.json()], [self.service_request.id])
+        response = self.client.get('/hotline/api/servicerequests/', {'search': 'doe'})
+        self.assertEqual(sorted(sr['id'] for sr in response.json()), sorted([self.service_request.id, other_sr.id]))
+        # Renaming the owner reindexes their SRs.
+        self.person.last_name = 'Smith'
+        self.person.save()
+        response = self.client.get('/hotline/api/servicerequests/', {'search': 'jane smi'})
+        self.assertEqual([sr['id'] for sr in response.json()], [self.service_request.id])
+        response = self.client.get('/people/api/person/', {'search': 'bel'})
+        self.assertEqual([person['id'] for person in response.json()], [self.person.id])
+
+    def test_location_filters(self):
+        napa = ServiceRequest.objects.create(address="1 Main St.", latitude=38.297, longitude=-122.286, incident=self.incident)
+        sonoma = ServiceRequest.objects.create(address="2 Main St.", latitude=38.292, longitude=-122.458, incident=self.incident)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/hotline/api/servicerequests/', {'bbox': '-122.3,38.2,-122.2,38.4'})
+        self.assertEqual([sr['id'] for sr in response.json()], [napa.id])
+        # Napa and Sonoma are ~15km apart.
+        response = self.client.get('/hotline/api/servicerequests/', {'near': '38.297,-122.286', 'within_km': 10})
+        self.assertEqual([sr['id'] for sr in response.json()], [napa.id])
+        response = self.client.get('/hotline/api/servicerequests/', {'near': '38.297,-122.286', 'within_km': 20})
+        self.assertEqual(sorted(sr['id'] for sr in response.json()), sorted([napa.id, sonoma.id]))
+        # Points just inside the radius on either axis are found.
+        north = ServiceRequest.objects.create(address="3 Main St.", latitude=38.297 + 0.0899, longitude=-122.286, incident=self.incident)
+        east = ServiceRequest.objects.create(address="4 Main St.", latitude=38.297, longitude=-122.286 + 0.1145, incident=self.incident)
+        self.assertEqual(sorted(ServiceRequest.objects.within_radius(38.297, -122.286, 10).values_list('id', flat=True)), sorted([napa.id, north.id, east.id]))
+        response = self.client.get('/hotline/api/servicerequests/', {'bbox': '-122.3,38.2'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_map_clusters(self):
+        for longitude, priority in ((-122.286, 1), (-122.287, 2), (-122.458, 2)):
+            sr = ServiceRequest.objects.create(address="1 Main St.", latitude=38.297, longitude=longitude, priority=priority, incident=self.incident)
+            Animal.objects.create(request=sr, name='Rex', animal_count=2, incident=self.incident)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get('/hotline/api/servicerequests/clusters/', {'incident': self.incident.slug, 'zoom': 10})
+        clusters = response.json()['clusters']
+        self.assertEqual([cluster['count'] for cluster in clusters], [1, 2])
+        self.assertEqual(clusters[1]['priority'], {'1': 1, '2': 1})
+        self.assertEqual(clusters[1]['status'], {'open': 2})
+        self.assertEqual(clusters[1]['reported_animals'], 4)
+        self.assertAlmostEqual(clusters[1]['longitude'], -122.2865)
+        response = self.client.get('/hotline/api/servicerequests/clusters/', {'incident': self.incident.slug, 'zoom': 10, 'search': 'main'})
+        self.assertEqual(sum(cluster['count'] for cluster in response.json()['clusters']), 3)
+        response = self.client.get('/hotline/api/servicerequests/clusters/', {'incident': self.incident.slug, 'zoom': 16, 'bbox': '-122.3,38.2,-122.2,38.4'})
+        self.assertEqual(response.json()['clusters'], [])
+        self.assertEqual(len(response.json()['service_requests']), 2)
+
+    def test_reunite_animals_patches_dispatch_snapshots(self):
+        from evac.models import AssignedRequest, DispatchTeam, EvacAssignment
+        other = Animal.objects.create(request=self.service_request, name='max', status='DECEASED', incident=self.incident)
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=self.incident), incident=self.incident)
+        snapshots = {str(self.animal.id): {'name': 'bella', 'status': 'REPORTED'}, str(other.id): {'name': 'max', 'status': 'DECEASED'}}
+        assigned_request = AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=self.service_request, animals=snapshots)
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(f'/hotline/api/servicerequests/{self.service_request.id}/', {'reunite_animals': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        assigned_request.refresh_from_db()
+        self.assertEqual(assigned_request.animals, {str(self.animal.id): {'name': 'bella', 'status': 'REUNITED'}, str(other.id): {'name': 'max', 'status': 'DECEASED'}})
@@ -1,32 +1,42 @@
-import io
-import json
 
 from evac.models import EvacAssignment
 from django.db import transaction
 from django.db.models import Case, Count, Exists, OuterRef, Prefetch, Q, When, Value, BooleanField
-from django.http import HttpResponse, JsonResponse
-from actstream import action
+from django.http import JsonResponse, StreamingHttpResponse
 from datetime import datetime, timedelta
 from .serializers import BarebonesServiceRequestSerializer, ServiceRequestSerializer, ServiceRequestNoteSerializer, MapServiceRequestSerializer, SimpleServiceRequestSerializer, VisitNoteSerializer
+from .caltopo import CaltopoPusher
+from .clusters import MAX_CLUSTER_ZOOM, cluster_service_requests
+from .geojson import parse_ids, stream_geojson
 from .ordering import MyCustomOrdering
-from wsgiref.util import FileWrapper
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from pagination import KeysetPagination
+from search import FullTextSearchFilter
+from sync import DeltaSyncMixin
+from consumers import build_map_event, queue_map_events
 
 from animals.models import Animal
 from animals.views import MultipleFieldLookupMixin
 from hotline.models import ServiceRequest, ServiceRequestImage, ServiceRequestNote, VisitNote
 from incident.models import Incident
+from activity import buffered_actions, send_action
+from history import ActionHistoryMixin
+from location.filters import LocationFilter
 from evac.models import AssignedRequest
 
-from rest_framework import filters, permissions, serializers, viewsets
+from rest_framework import permissions, serializers, viewsets
 from rest_framework.decorators import action as drf_action
 
-class ServiceRequestViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
+class ServiceRequestPagination(KeysetPagination):
+    ordering = ('incident_id', '-timestamp', 'id')
+    # Maps need every SR, in MyCustomOrdering's priority order.
+    unpaginated_query_params = ('landingmap', 'map')
+
+class ServiceRequestViewSet(ActionHistoryMixin, DeltaSyncMixin, MultipleFieldLookupMixin, viewsets.ModelViewSet):
     queryset = ServiceRequest.objects.all()
     lookup_fields = ['pk', 'incident', 'id_for_incident']
-    search_fields = ['address', 'city', 'animal__name', 'owners__last_name', 'reporter__last_name']
-    filter_backends = (filters.SearchFilter, MyCustomOrdering)
+    filter_backends = (FullTextSearchFilter, LocationFilter, MyCustomOrdering)
+    pagination_class = ServiceRequestPagination
+    sync_related_fields = ('animal', 'assignedrequest')
     permission_classes = [permissions.IsAuthenticated, ]
     serializer_class = SimpleServiceRequestSerializer
     light_serializer_class = BarebonesServiceRequestSerializer
@@ -49,37 +59,35 @@ class ServiceRequestViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         if serializer.is_valid():
 
-            total_srs = ServiceRequest.objects.select_for_update().filter(incident__slug=self.request.data.get('incident_slug')).values_list('id', flat=True)
-            with transaction.atomic():
-                count = len(total_srs)
-                serializer.validated_data['id_for_incident'] = count + 1
-
+            # id_for_incident is allocated by ServiceRequest.save().
             if self.request.data.get('incident_slug'):
                 serializer.validated_data['incident'] = Incident.objects.get(slug=self.request.data.get('incident_slug'))
 
             service_request = serializer.save()
-            action.send(self.request.user, verb='created service request', target=service_request)
+            send_action(self.request.user, verb='created service request', target=service_request)
 
-            # Notify maps that there is new data.
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)("map", {"type":"new_data"})
+            # Notify maps for this incident of the new SR.
+            queue_map_events(service_request.incident.slug, [build_map_event(service_request, 'service_request')])
 
+    @transaction.atomic
+    @buffered_actions()
     def perform_update(self, serializer):
         from evac.models import AssignedRequest
 
         if serializer.is_valid():
 
+            map_event = build_map_event(serializer.instance, 'service_request')
             service_request = serializer.save()
 
+            # Notify maps if the SR's status, priority or location was changed.
+            if build_map_event(service_request, 'service_request') != map_event:
+                queue_map_events(service_request.incident.slug, [build_map_event(service_request, 'service_request')])
+
             if service_request.status == 'canceled':
                 service_request.animal_set.update(status='CANCELED')
-                action.send(self.request.user, verb='canceled service request', target=service_request)
+                send_action(self.request.user, verb='canceled service request', target=service_request)
 
-                for assigned_request in AssignedRequest.objects.filter(service_request=service_request, dispatch_assignment__end_time=None):
-                    for animal in service_request.animal_set.all():
-                        if assigned_request.animals.get(str(animal.id)):
-                            assigned_request.animals[str(animal.id)]['status'] = 'CANCELED'
-                    assigned_request.save()
+                AssignedRequest.objects.filter(service_request=service_request, dispatch_assignment__end_time=None).patch_animal_fields(service_request.animal_set.values_list('id', flat=True), status='CANCELED')
 
             elif self.request.FILES.keys():
               # Create new files from uploads
@@ -95,25 +103,27 @@ class ServiceRequestViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
                 sr = ServiceRequest.objects.get(id=self.request.data.get('new_request_id'))
                 animals = Animal.objects.filter(id__in=self.request.data.get('animal_ids'))
                 animals.update(request=sr)
+                # update() skips the post_save reindexing of the animals and both SRs.
+                animals.refresh_search_vector()
+                ServiceRequest.objects.filter(id__in=[service_request.id, sr.id]).refresh_search_vector()
                 for animal in animals:
-                    action.send(self.request.user, verb='transferred this animal from SR#' + str(service_request.id_for_incident) + ' to SR#' + str(sr.id_for_incident), target=animal)
-                action.send(self.request.user, verb='transferred animals to SR#' + str(sr.id_for_incident), target=service_request)
-                action.send(self.request.user, verb='transferred animals from SR#' + str(service_request.id_for_incident) + ' to here', target=sr)
+                    send_action(self.request.user, verb='transferred this animal from SR#' + str(service_request.id_for_incident) + ' to SR#' + str(sr.id_for_incident), target=animal)
+                send_action(self.request.user, verb='transferred animals to SR#' + str(sr.id_for_incident), target=service_request)
+                send_action(self.request.user, verb='transferred animals from SR#' + str(service_request.id_for_incident) + ' to here', target=sr)
 
             elif self.request.data.get('reunite_animals'):
-                for animal in service_request.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']):
-                    action.send(self.request.user, verb=f'changed animal status to reunited', target=animal)
-                    for assigned_request in AssignedRequest.objects.filter(service_request=serializer.instance.id, dispatch_assignment__end_time=None):
-                        assigned_request.animals[str(serializer.instance.id)]['status'] = 'REUNITED'
-                        assigned_request.save()
+                animals = list(service_request.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']))
+                for animal in animals:
+                    send_action(self.request.user, verb=f'changed animal status to reunited', target=animal)
+                AssignedRequest.objects.filter(service_request=service_request, dispatch_assignment__end_time=None).patch_animal_fields([animal.id for animal in animals], status='REUNITED')
                 service_request.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']).update(status='REUNITED', shelter=None, room=None)
                 service_request.update_status(self.request.user)
             else:
-                action.send(self.request.user, verb='updated service request', target=service_request)
+                send_action(self.request.user, verb='updated service request', target=service_request)
 
     def get_queryset(self):
         queryset = (
-            ServiceRequest.objects.all()
+            ServiceRequest.objects.with_animal_counts()
             .annotate(
                 injured=Exists(Animal.objects.filter(request_id=OuterRef("id"), injured="yes"))
             )
@@ -142,61 +152,65 @@ class ServiceRequestViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
     @drf_action(detail=True, methods=['GET'], name='Download GeoJSON')
     def download(self, request, pk=None):
         sr = ServiceRequest.objects.get(id=pk)
-        data = {"features":[sr.get_feature_json()]}
-        data_string = json.dumps(data)
-        json_file = io.StringIO()
-        json_file.write(data_string)
-        json_file.seek(0)
-
-        wrapper = FileWrapper(json_file)
-        response = HttpResponse(wrapper, content_type='application/json')
+        response = StreamingHttpResponse(stream_geojson(ServiceRequest.objects.filter(id=sr.id)), content_type='application/json')
         response['Content-Disposition'] = 'attachement; filename=SR-' + str(sr.id_for_incident) + '.geojson'
         return response
 
     @drf_action(detail=False, methods=['GET'], name='Download All GeoJSON')
     def download_all(self, request):
-        json_file = io.StringIO()
-        features = []
-        for id in self.request.GET.get('ids').replace('&','').split('id='):
-            if id:
-                sr = ServiceRequest.objects.get(id=id)
-                features.append(sr.get_feature_json())
-
-        data = {"features":features}
-        data_string = json.dumps(data)
-        json_file.write(data_string)
-        json_file.seek(0)
-        wrapper = FileWrapper(json_file)
-        response = HttpResponse(wrapper, content_type='application/json')
+        # Export the listed SRs, or every geolocated SR for an incident.
+        if self.request.GET.get('ids'):
+            service_requests = ServiceRequest.objects.filter(id__in=parse_ids(self.request.GET.get('ids')))
+        else:
+            service_requests = ServiceRequest.objects.filter(incident__slug=self.request.GET.get('incident')).exclude(Q(latitude=None) | Q(longitude=None)).exclude(status='canceled')
+        response = StreamingHttpResponse(stream_geojson(service_requests.order_by('id_for_incident')), content_type='application/json')
         response['Content-Disposition'] = 'attachement; filename=SRs' + '.geojson'
         return response
 
     @drf_action(detail=True, methods=['GET'], name='Push GeoJSON')
     def push(self, request, pk=None):
-        sr = ServiceRequest.objects.get(id=pk)
-        success = True
-        try:
-            sr.push_json()
-        except Exception as error:
-            print ("Caltopo Error on SR#" + str(sr.id) + ": " + error)
-            success = False
-        data = {sr.id_for_incident: {'status': success}}
+        sr = ServiceRequest.objects.select_related('incident').get(id=pk)
+        # Pushing a single SR always re-sends it, in case its marker was deleted on Caltopo.
+        results = CaltopoPusher(sr.incident).push([sr], force=True)
+        data = {sr.id_for_incident: results[sr.id]}
         return JsonResponse(data)
 
     @drf_action(detail=False, methods=['GET'], name='Push All GeoJSON')
     def push_all(self, request):
         data = {}
-        for sr_id in self.request.GET.get('ids').replace('&','').split('id='):
-            if sr_id:
-                sr = ServiceRequest.objects.get(id=sr_id)
-                success = True
-                try:
-                    sr.push_json()
-                except:
-                    success = False
-                data[sr.id_for_incident] = {'status': success}
+        service_requests = ServiceRequest.objects.filter(id__in=parse_ids(self.request.GET.get('ids'))).select_related('incident').order_by('id_for_incident')
+        # One Caltopo session per incident map.
+        by_incident = {}
+        for sr in service_requests:
+            by_incident.setdefault(sr.incident_id, []).append(sr)
+        for srs in by_incident.values():
+            results = CaltopoPusher(srs[0].incident).push(srs)
+            for sr in srs:
+                data[sr.id_for_incident] = results[sr.id]
         return JsonResponse(data)
 
+    @drf_action(detail=False, methods=['GET'], name='Map Clusters')
+    def clusters(self, request):
+        from rest_framework import response
+        try:
+            zoom = min(max(int(request.query_params.get('zoom', 0)), 0), 22)
+        except ValueError:
+            raise serializers.ValidationError({'zoom': ['A whole number is required.']})
+        # The SRs shown on the landing map, narrowed by any search/bbox filters.
+        queryset = (
+            self.filter_queryset(ServiceRequest.objects.filter(incident__slug=request.GET.get('incident')))
+            .filter(Exists(Animal.objects.filter(request_id=OuterRef('id'))))
+            .exclude(status='canceled')
+        )
+        if request.query_params.get('status', '') in ('open', 'assigned', 'closed'):
+            queryset = queryset.filter(status=request.query_params['status'])
+
+        # Expand to individual SRs once zoomed in far enough.
+        if zoom >= MAX_CLUSTER_ZOOM:
+            service_requests = self.get_queryset().filter(id__in=queryset.exclude(Q(latitude=None) | Q(longitude=None)).values('id')).order_by('priority', 'followup_date', '-id')
+            return response.Response({'zoom': zoom, 'clusters': [], 'service_requests': MapServiceRequestSerializer(service_requests, many=True).data})
+        return response.Response({'zoom': zoom, 'clusters': cluster_service_requests(queryset, zoom), 'service_requests': []})
+
     @drf_action(detail=True, methods=['GET'], name='Remove from Active Dispatch')
     def remove_active(self, request, pk=None):
         from rest_framework import response
@@ -222,4 +236,4 @@ class ServiceRequestNoteViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
 
             serializer.save()
-            action.send(self.request.user, verb='added a note', target=ServiceRequest.objects.get(id=self.request.data.get('service_request')))
+            send_action(self.request.user, verb='added a note', target=ServiceRequest.objects.get(id=self.request.data.get('service_request')))
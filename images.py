@@ -0,0 +1,119 @@
+import os
+import uuid
+from io import BytesIO
+from urllib.parse import unquote, urlparse
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+# Longest side in pixels of each WebP derivative.
+DERIVATIVE_SIZES = {'thumbnail': 256, 'medium': 1024}
+# Originals are recompressed as JPEG no larger than this.
+ORIGINAL_MAX_SIZE = 2560
+
+
+class ImageDerivatives(models.Model):
+    """
+    Adds resized copies of an uploaded image, written by the process_images worker.
+
+    Rows are pending until processed_at is set, and serializers fall back to the
+    original upload until then.
+    """
+    thumbnail = models.ImageField(blank=True, editable=False)
+    medium = models.ImageField(blank=True, editable=False)
+    processed_at = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
+    processing_error = models.TextField(blank=True, editable=False)
+    # The uploaded name, so clients holding URLs from before processing can still refer to the image.
+    original_name = models.CharField(max_length=255, blank=True, editable=False)
+
+    def get_url(self, size=None):
+        derivative = getattr(self, size) if size else None
+        return derivative.url if derivative else self.image.url
+
+    class Meta:
+        abstract = True
+
+def encode_image(image, max_size, format, **options):
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format, **options)
+    return buffer.getvalue()
+
+def build_derivatives(file):
+    """
+    Returns (original, {size: derivative}) encoded from an image file.
+
+    The original is re-encoded as JPEG and the derivatives as WebP. EXIF data such as GPS
+    coordinates is dropped from all of them, after it has been used to rotate the image upright.
+    """
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            # Flatten transparency onto white, as JPEG has no alpha channel.
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        original = encode_image(image, ORIGINAL_MAX_SIZE, 'JPEG', quality=85, optimize=True, progressive=True)
+        derivatives = {size: encode_image(image, max_size, 'WEBP', quality=80, method=4) for size, max_size in DERIVATIVE_SIZES.items()}
+    return original, derivatives
+
+def process_image(instance):
+    """
+    Replaces instance.image with a stripped, recompressed copy and writes its derivatives, without saving instance.
+
+    The original upload is deleted once the surrounding transaction commits.
+    """
+    original_name = instance.image.name
+    storage = instance.image.storage
+    try:
+        with instance.image.open('rb') as file:
+            original, derivatives = build_derivatives(file)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        instance.processing_error = str(error)
+    else:
+        # Write to a new name, as storages that overwrite (like S3) would otherwise replace the upload in place.
+        stem = '%s_%s' % (os.path.splitext(original_name)[0], uuid.uuid4().hex[:8])
+        instance.original_name = original_name
+        instance.image.name = storage.save(stem + '.jpg', ContentFile(original))
+        for size, content in derivatives.items():
+            getattr(instance, size).name = storage.save('%s_%s.webp' % (stem, size), ContentFile(content))
+        # Keep the upload until the row points elsewhere, in case the batch is rolled back.
+        if instance.image.name != original_name:
+            transaction.on_commit(lambda: storage.delete(original_name))
+        instance.processing_error = ''
+    instance.processed_at = timezone.now()
+
+def process_pending_images(model, batch_size=20):
+    # SKIP LOCKED lets concurrent workers claim different rows instead of waiting.
+    with transaction.atomic():
+        instances = list(model.objects.select_for_update(skip_locked=True).filter(processed_at=None).order_by('id')[:batch_size])
+        for instance in instances:
+            process_image(instance)
+        model.objects.bulk_update(instances, ['image', 'original_name', 'thumbnail', 'medium', 'processed_at', 'processing_error'])
+    return len(instances)
+
+def get_image_models():
+    return [model for model in apps.get_models() if issubclass(model, ImageDerivatives)]
+
+def sign_image_urls(images):
+    """
+    Signs the URLs of many images and their derivatives at once, when the storage can batch them,
+    so that later .url lookups are cache hits.
+    """
+    files = [file for image in images for file in (image.image, image.thumbnail, image.medium) if file]
+    if files and hasattr(files[0].storage, 'urls'):
+        files[0].storage.urls([file.name for file in files])
+
+def url_matches_file(url, file):
+    # Compares by storage name, ignoring the host, any storage prefix and signing parameters.
+    return unquote(urlparse(url).path).endswith('/' + file.name)
+
+def url_matches_image(url, instance):
+    # Also matches URLs of the upload from before it was processed and renamed.
+    path = unquote(urlparse(url).path)
+    return url_matches_file(url, instance.image) or bool(instance.original_name and path.endswith('/' + instance.original_name))
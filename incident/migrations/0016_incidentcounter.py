@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0015_auto_20240930_1910'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=50)),
+                ('value', models.IntegerField(default=0)),
+                ('incident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='incident.incident')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='incidentcounter',
+            constraint=models.UniqueConstraint(fields=('incident', 'entity'), name='unique_incident_counter'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0016_incidentcounter'),
+        ('actstream', '0003_add_follow_flag'),
+    ]
+
+    # Serves the newest-first /history/ pages of a single object. actstream owns the table, so the index is added here.
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS actstream_action_target_history_idx ON actstream_action (target_content_type_id, target_object_id, timestamp DESC, id DESC)',
+            'DROP INDEX IF EXISTS actstream_action_target_history_idx',
+        ),
+    ]
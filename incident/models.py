@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
@@ -56,6 +57,48 @@ class Incident(models.Model):
         ordering = ['name']
 
 
+class IncidentCounter(models.Model):
+
+    incident = models.ForeignKey(Incident, on_delete=models.CASCADE)
+    entity = models.CharField(max_length=50)
+    value = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '%s %s: %s' % (self.incident, self.entity, self.value)
+
+    @classmethod
+    def next_value(cls, model, incident_id):
+        """
+        Returns the next id_for_incident for the given model and incident.
+
+        Locks a single counter row, so creation cost stays constant as the incident grows.
+        Must be called inside the transaction that saves the new object.
+        """
+        return cls.next_values(model, incident_id, 1)[0]
+
+    @classmethod
+    def next_values(cls, model, incident_id, count):
+        """
+        Reserves count consecutive id_for_incident values for objects created with bulk_create.
+        """
+        entity = model._meta.label_lower
+        with transaction.atomic():
+            counter, created = cls.objects.select_for_update().get_or_create(
+                incident_id=incident_id,
+                entity=entity,
+                # Seed from existing rows the first time a counter is used for an incident.
+                defaults={'value': lambda: model.objects.filter(incident_id=incident_id).aggregate(max_id=Max('id_for_incident'))['max_id'] or 0},
+            )
+            counter.value += count
+            counter.save(update_fields=['value'])
+        return range(counter.value - count + 1, counter.value + 1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['incident', 'entity'], name='unique_incident_counter'),
+        ]
+
+
 class IncidentNotification(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
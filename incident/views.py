@@ -1,7 +1,7 @@
 from datetime import datetime, date
 from django.utils import timezone
 from django.contrib.sites.models import Site
-from django.core.mail import send_mail
+from django.db import transaction
 from django.template.loader import render_to_string
 from rest_framework import permissions, status, viewsets
 from rest_framework.response import Response
@@ -10,6 +10,7 @@ from rest_framework.decorators import action
 from accounts.models import ShelterlyUser
 from incident.models import Incident, Organization, TemporaryAccess, IncidentNotification
 from incident.serializers import IncidentSerializer, IncidentNotificationSerializer, OrganizationSerializer, TemporaryAccessSerializer
+from outbox.models import queue_email
 
 
 # Provides view for User API calls.
@@ -29,6 +30,7 @@ class IncidentViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @transaction.atomic
     def perform_create(self, serializer):
         if serializer.is_valid():
 
@@ -46,7 +48,7 @@ class IncidentViewSet(viewsets.ModelViewSet):
                             'incident_name': inc.name,
                             'incident_slug': inc.slug
                     }
-                    send_mail(
+                    queue_email(
                         # title:
                         "%s has started a New Incident: %s!" % (inc.organization.name, inc.name),
                         # message:
@@ -58,8 +60,7 @@ class IncidentViewSet(viewsets.ModelViewSet):
                         "DoNotReply@shelterly.org",
                         # to:
                         emails,
-                        fail_silently=False,
-                        html_message = render_to_string(
+                        html_body = render_to_string(
                             'new_incident_email.html',
                             message_data
                         ).strip()
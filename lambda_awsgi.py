@@ -1,6 +1,7 @@
 from apig_wsgi import make_lambda_handler
 import os
 
+from django.core.management import call_command
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
@@ -8,3 +9,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 application = get_wsgi_application()
 
 lambda_handler = make_lambda_handler(application)
+
+def send_outbox_handler(event, context):
+    # Run on a schedule (e.g. an EventBridge rule every few minutes) to retry emails that failed to send on commit.
+    call_command('send_outbox', '--once')
+
+def process_images_handler(event, context):
+    # Run on a schedule to strip uploads and generate their thumbnails, as there is no process_images worker.
+    call_command('process_images', '--once')
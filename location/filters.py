@@ -0,0 +1,31 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class LocationFilter(BaseFilterBackend):
+    """
+    Filters Location-derived models to a map viewport with ?bbox=minLon,minLat,maxLon,maxLat
+    or to a radius with ?near=lat,lon&within_km=.
+
+    The view's queryset must be a LocationQueryset.
+    """
+
+    def parse_floats(self, request, param, count):
+        try:
+            values = [float(value) for value in request.query_params[param].split(',')]
+        except ValueError:
+            values = []
+        if len(values) != count:
+            raise ValidationError({param: ['Expected %s comma separated numbers.' % count]})
+        return values
+
+    def filter_queryset(self, request, queryset, view):
+        if request.query_params.get('bbox'):
+            queryset = queryset.within_bbox(*self.parse_floats(request, 'bbox', 4))
+        if request.query_params.get('near'):
+            latitude, longitude = self.parse_floats(request, 'near', 2)
+            within_km = self.parse_floats(request, 'within_km', 1)[0] if request.query_params.get('within_km') else 0
+            if within_km <= 0:
+                raise ValidationError({'within_km': ['A positive distance is required with near.']})
+            queryset = queryset.within_radius(latitude, longitude, within_km)
+        return queryset
@@ -1,2 +1,90 @@
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from accounts.models import ShelterlyUser
+from animals.models import Animal
+from evac.models import AssignedRequest, DispatchTeam, EvacAssignment
+from hotline.models import ServiceRequest
+from incident.models import Incident
+from location.tiles import project, tile_bounds
+from shelter.models import Shelter
+
+def read_varint(data, position):
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+def read_fields(data):
+    # Minimal protobuf reader: yields (field number, value) for varint and length-delimited fields.
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        if key & 0x7 == 0:
+            value, position = read_varint(data, position)
+        elif key & 0x7 == 1:
+            value, position = data[position:position + 8], position + 8
+        else:
+            length, position = read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        yield key >> 3, value
+
+class TestTiles(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ShelterlyUser.objects.create_user(email="test@test.com", cell_phone="5555555", password="test", is_active=True)
+        cls.incident = Incident.objects.create(name='Napa Fire', slug='napafire', latitude=38.3, longitude=-122.3)
+        cls.service_request = ServiceRequest.objects.create(address="1 Main St.", latitude=38.297, longitude=-122.286, incident=cls.incident)
+        cls.other_request = ServiceRequest.objects.create(address="2 Main St.", latitude=38.31, longitude=-122.27, incident=cls.incident)
+        cls.shelter = Shelter.objects.create(name='Fairgrounds', latitude=38.29, longitude=-122.28, incident=cls.incident)
+        Animal.objects.create(name='Rex', status='SHELTERED', animal_count=3, shelter=cls.shelter, incident=cls.incident)
+        evac_assignment = EvacAssignment.objects.create(team=DispatchTeam.objects.create(name='Team A', incident=cls.incident), incident=cls.incident)
+        AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=cls.service_request, animals={})
+        AssignedRequest.objects.create(dispatch_assignment=evac_assignment, service_request=cls.other_request, animals={})
+
+    def get_layers(self, content):
+        layers = {}
+        for _, layer in read_fields(content):
+            fields = list(read_fields(layer))
+            name = [value for number, value in fields if number == 1][0].decode()
+            layers[name] = [dict(read_fields(feature)) for number, feature in fields if number == 2]
+        return layers
+
+    def test_projection(self):
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(12, 656, 1575)
+        self.assertEqual(project(12, 656, 1575, min_lon, max_lat), (0, 0))
+        self.assertEqual(project(12, 656, 1575, max_lon, min_lat), (4096, 4096))
+
+    def test_get_tile(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/location/tiles/{self.incident.slug}/12/656/1575.mvt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        layers = self.get_layers(response.content)
+        self.assertEqual(sorted(feature[1] for feature in layers['service_requests']), sorted([self.service_request.id, self.other_request.id]))
+        self.assertEqual([feature[1] for feature in layers['shelters']], [self.shelter.id])
+        # One LineString route for the open DA.
+        self.assertEqual([feature[3] for feature in layers['dispatch_assignments']], [2])
+
+        # Unchanged data revalidates against the ETag, and changes produce a new version.
+        etag = response['ETag']
+        response = self.client.get(f'/location/tiles/{self.incident.slug}/12/656/1575.mvt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.service_request.priority = 1
+        self.service_request.save()
+        response = self.client.get(f'/location/tiles/{self.incident.slug}/12/656/1575.mvt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # Renaming a DA's team relabels its route.
+        etag = response['ETag']
+        DispatchTeam.objects.update(name='Team B')
+        response = self.client.get(f'/location/tiles/{self.incident.slug}/12/656/1575.mvt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # An empty tile elsewhere still has the layers.
+        response = self.client.get(f'/location/tiles/{self.incident.slug}/12/0/0.mvt')
+        self.assertEqual({name: len(features) for name, features in self.get_layers(response.content).items()}, {'service_requests': 0, 'shelters': 0, 'dispatch_assignments': 0})
@@ -0,0 +1,189 @@
+import hashlib
+import math
+import struct
+
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum
+
+# Tile coordinate space and the margin of neighbouring data included around each tile, in tile units.
+EXTENT = 4096
+BUFFER = 64
+
+MOVE_TO = 1
+LINE_TO = 2
+POINT = 1
+LINESTRING = 2
+
+def tile_bounds(z, x, y, buffer=0):
+    # Returns (min_lon, min_lat, max_lon, max_lat) of a web mercator tile, grown by buffer tile units.
+    n = 2 ** z
+    margin = buffer / EXTENT
+
+    def lon(tile_x):
+        return tile_x / n * 360.0 - 180.0
+
+    def lat(tile_y):
+        tile_y = min(max(tile_y, 0), n)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return (lon(x - margin), lat(y + 1 + margin), lon(x + 1 + margin), lat(y - margin))
+
+def project(z, x, y, longitude, latitude):
+    # Projects a lon/lat onto the tile's integer coordinate space.
+    n = 2 ** z
+    latitude = min(max(float(latitude), -85.0511), 85.0511)
+    tile_x = (float(longitude) + 180.0) / 360.0 * n
+    tile_y = (1 - math.log(math.tan(math.radians(latitude)) + 1 / math.cos(math.radians(latitude))) / math.pi) / 2 * n
+    return (round((tile_x - x) * EXTENT), round((tile_y - y) * EXTENT))
+
+def encode_varint(value):
+    value &= 0xFFFFFFFFFFFFFFFF
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def encode_field(number, wire_type, payload):
+    key = encode_varint((number << 3) | wire_type)
+    if wire_type == 2:
+        return key + encode_varint(len(payload)) + payload
+    return key + payload
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return encode_field(7, 0, encode_varint(int(value)))
+    if isinstance(value, int):
+        return encode_field(6, 0, encode_varint(zigzag(value)))
+    if isinstance(value, float):
+        return encode_field(3, 1, struct.pack('<d', value))
+    return encode_field(1, 2, str(value).encode('utf-8'))
+
+def encode_geometry(geometry_type, points):
+    # Points are encoded as a single MoveTo, lines as a MoveTo followed by LineTos,
+    # each with zigzagged deltas from the previous position.
+    commands = []
+    cursor = (0, 0)
+    for index, point in enumerate(points):
+        if index == 0:
+            commands.append(MOVE_TO | (1 << 3))
+        elif index == 1 and geometry_type == LINESTRING:
+            commands.append(LINE_TO | ((len(points) - 1) << 3))
+        commands.extend([zigzag(point[0] - cursor[0]), zigzag(point[1] - cursor[1])])
+        cursor = point
+    return b''.join(encode_varint(command) for command in commands)
+
+def encode_layer(name, features):
+    """
+    Encodes a Mapbox Vector Tile (v2) layer.
+
+    features is a list of (id, geometry_type, points, properties) with points already
+    projected into tile coordinates.
+    """
+    keys, values = {}, {}
+    encoded_features = b''
+    for feature_id, geometry_type, points, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = (
+            encode_field(1, 0, encode_varint(feature_id)) +
+            encode_field(2, 2, b''.join(encode_varint(tag) for tag in tags)) +
+            encode_field(3, 0, encode_varint(geometry_type)) +
+            encode_field(4, 2, encode_geometry(geometry_type, points))
+        )
+        encoded_features += encode_field(2, 2, feature)
+    layer = (
+        encode_field(15, 0, encode_varint(2)) +
+        encode_field(1, 2, name.encode('utf-8')) +
+        encoded_features +
+        b''.join(encode_field(3, 2, key.encode('utf-8')) for key in keys) +
+        b''.join(encode_field(4, 2, encode_value(value)) for _, value in values) +
+        encode_field(5, 0, encode_varint(EXTENT))
+    )
+    return encode_field(3, 2, layer)
+
+def get_data_version(incident):
+    """
+    Returns a short hash that changes whenever the data drawn on an incident's tiles changes.
+    """
+    from animals.models import Animal
+    from evac.models import AssignedRequest, EvacAssignment
+    from hotline.models import ServiceRequest
+    from shelter.models import Shelter
+
+    state = [
+        ServiceRequest.objects.filter(incident=incident).aggregate(count=Count('id'), updated=Max('updated_at')),
+        Animal.objects.filter(incident=incident).order_by().aggregate(count=Count('id'), updated=Max('updated_at')),
+        AssignedRequest.objects.filter(dispatch_assignment__incident=incident).aggregate(count=Count('id'), updated=Max('updated_at')),
+        EvacAssignment.objects.filter(incident=incident).aggregate(count=Count('id'), closed=Count('end_time')),
+        # Routes are labelled with their team, which can change or be renamed without touching the AssignedRequests.
+        list(EvacAssignment.objects.filter(incident=incident, end_time=None).order_by('id').values_list('id', 'team_id', 'team__name')),
+        list(Shelter.objects.filter(incident=incident).order_by('id').values_list('id', 'name', 'latitude', 'longitude')),
+    ]
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()[:16]
+
+def build_tile(incident, z, x, y):
+    """
+    Returns the encoded tile with service_requests, shelters and dispatch_assignments layers.
+    """
+    from animals.models import Animal
+    from evac.models import AssignedRequest
+    from hotline.models import ServiceRequest
+    from shelter.models import Shelter
+
+    bounds = tile_bounds(z, x, y, BUFFER)
+
+    service_requests = (
+        ServiceRequest.objects.filter(incident=incident).exclude(status='canceled').within_bbox(*bounds)
+        .with_animal_counts().annotate(injured=Exists(Animal.objects.filter(request_id=OuterRef('id'), injured='yes')))
+        .order_by('id')
+    )
+    sr_features = [(sr.id, POINT, [project(z, x, y, sr.longitude, sr.latitude)], {
+        'id_for_incident': sr.id_for_incident,
+        'status': sr.status,
+        'priority': sr.priority,
+        'injured': sr.injured,
+        'aco_required': sr.aco_required,
+    }) for sr in service_requests]
+
+    shelters = (
+        Shelter.objects.filter(incident=incident).within_bbox(*bounds)
+        .annotate(sheltered=Sum('animal__animal_count', filter=Q(animal__status='SHELTERED')))
+        .order_by('id')
+    )
+    shelter_features = [(shelter.id, POINT, [project(z, x, y, shelter.longitude, shelter.latitude)], {
+        'name': shelter.name,
+        'sheltered': shelter.sheltered or 0,
+    }) for shelter in shelters]
+
+    # Open DA routes through their SRs, kept when any part of the route touches the tile.
+    routes = {}
+    assigned_requests = (
+        AssignedRequest.objects.filter(dispatch_assignment__incident=incident, dispatch_assignment__end_time=None)
+        .exclude(service_request__latitude=None).exclude(service_request__longitude=None)
+        .order_by('dispatch_assignment_id', F('route_order').asc(nulls_last=True), 'id')
+        .values_list('dispatch_assignment_id', 'dispatch_assignment__id_for_incident', 'dispatch_assignment__team__name', 'service_request__latitude', 'service_request__longitude')
+    )
+    for da_id, id_for_incident, team_name, latitude, longitude in assigned_requests:
+        route = routes.setdefault(da_id, {'properties': {'id_for_incident': id_for_incident, 'team': team_name}, 'points': []})
+        route['points'].append((float(longitude), float(latitude)))
+    route_features = []
+    for da_id, route in sorted(routes.items()):
+        longitudes = [point[0] for point in route['points']]
+        latitudes = [point[1] for point in route['points']]
+        if len(route['points']) < 2 or max(longitudes) < bounds[0] or min(longitudes) > bounds[2] or max(latitudes) < bounds[1] or min(latitudes) > bounds[3]:
+            continue
+        route_features.append((da_id, LINESTRING, [project(z, x, y, *point) for point in route['points']], route['properties']))
+
+    return (
+        encode_layer('service_requests', sr_features) +
+        encode_layer('shelters', shelter_features) +
+        encode_layer('dispatch_assignments', route_features)
+    )
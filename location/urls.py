@@ -1,5 +1,9 @@
+from django.urls import path
+
+from location import views
 
 app_name = 'location'
 
 urlpatterns = [
+    path('tiles/<str:incident>/<int:z>/<int:x>/<int:y>.mvt', views.TileView.as_view(), name='tile'),
 ]
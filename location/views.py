@@ -1,2 +1,38 @@
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import permissions
+from rest_framework.views import APIView
 
+from incident.models import Incident
+from location.tiles import build_tile, get_data_version
 
+# Tiles are cached under the incident data version, so old entries are never served and only need to expire.
+TILE_CACHE_TIMEOUT = 60 * 60 * 24
+
+def get_cached_tile(incident, version, z, x, y):
+    key = 'tile:%s:%s:%s:%s:%s' % (incident.id, version, z, x, y)
+    tile = cache.get(key)
+    if tile is None:
+        tile = build_tile(incident, z, x, y)
+        cache.set(key, tile, TILE_CACHE_TIMEOUT)
+    return tile
+
+# Serves SR, shelter and DA route layers for an incident as Mapbox Vector Tiles.
+class TileView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, incident, z, x, y):
+        if z > 22 or x >= 2 ** z or y >= 2 ** z:
+            raise Http404
+        incident = get_object_or_404(Incident, slug=incident)
+        version = get_data_version(incident)
+        etag = '"%s"' % version
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(get_cached_tile(incident, version, z, x, y), content_type='application/vnd.mapbox-vector-tile')
+        response['ETag'] = etag
+        # Clients may keep tiles but must revalidate, since the version changes with the incident data.
+        response['Cache-Control'] = 'private, no-cache'
+        return response
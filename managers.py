@@ -1,9 +1,136 @@
-from django.db import models
+import math
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, models, transaction
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+from django.utils import timezone
 from actstream.models import Action
 
+# Mean earth radius used for haversine distances.
+EARTH_RADIUS_KM = 6371.0
+
 
 class ActionHistoryQueryset(models.QuerySet):
     def with_history(self):
         return self.prefetch_related(
             models.Prefetch("target_actions", Action.objects.prefetch_related("actor", "target", "action_object"))
         )
+
+
+class UpdatedAtQueryset(models.QuerySet):
+    def update(self, **kwargs):
+        # QuerySet.update() skips auto_now fields, so keep updated_at current for delta sync.
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def bulk_update_values(self, objs, fields, batch_size=1000):
+        """
+        Writes fields of objs like bulk_update(), joining against a VALUES list instead of
+        building a CASE per row and field, which is far cheaper for hundreds of rows.
+        """
+        objs = list(objs)
+        meta = self.model._meta
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        columns = [meta.get_field(name) for name in fields if name != 'updated_at'] + [meta.get_field('updated_at')]
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(meta.db_table)
+        pk = quote(meta.pk.column)
+        assignments = ', '.join('%s = v.%s::%s' % (quote(field.column), quote(field.column), field.cast_db_type(connection)) for field in columns)
+        names = ', '.join(quote(field.column) for field in [meta.pk] + columns)
+        with transaction.atomic(using=self.db, savepoint=False), connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                rows = ', '.join(['(%s)' % ', '.join(['%s'] * (len(columns) + 1))] * len(batch))
+                params = [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in batch for field in [meta.pk] + columns]
+                cursor.execute('UPDATE %s SET %s FROM (VALUES %s) AS v (%s) WHERE %s.%s = v.%s::%s' % (
+                    table, assignments, rows, names, table, pk, pk, meta.pk.cast_db_type(connection)
+                ), params)
+
+
+def build_search_vector(model, fields):
+    """
+    Returns a weighted SearchVector over (lookup, weight) fields of model.
+
+    Lookups that span relations are aggregated into one string per row with a
+    correlated subquery, so the vector can be written with a single-table UPDATE.
+    """
+    vector = None
+    for lookup, weight in fields:
+        if '__' in lookup:
+            text = (
+                model._base_manager.filter(pk=models.OuterRef('pk'))
+                .order_by().values('pk').annotate(text=StringAgg(lookup, ' ')).values('text')
+            )
+            expression = models.Subquery(text, output_field=models.TextField())
+        else:
+            expression = models.F(lookup)
+        part = SearchVector(expression, weight=weight, config='simple')
+        vector = part if vector is None else vector + part
+    return vector
+
+
+class LocationQueryset(models.QuerySet):
+    def within_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        queryset = self.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+        # A viewport that crosses the antimeridian has min_lon > max_lon.
+        if min_lon <= max_lon:
+            return queryset.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+        return queryset.filter(models.Q(longitude__gte=min_lon) | models.Q(longitude__lte=max_lon))
+
+    def within_radius(self, latitude, longitude, km):
+        """
+        Filters to rows within km of (latitude, longitude), annotated with distance_km.
+
+        Rows are first narrowed to the enclosing box so the lat/lon index is used, then
+        checked against the haversine distance.
+        """
+        # The box must enclose the haversine circle, so derive it from the same radius, with a
+        # margin for the rounding of stored coordinates.
+        angle = km / EARTH_RADIUS_KM * 1.001
+        lat_delta = math.degrees(angle) + 1e-6
+        if math.sin(angle) < math.cos(math.radians(latitude)):
+            lon_delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude)))) + 1e-6
+        else:
+            # The circle contains a pole, so spans every longitude.
+            lon_delta = 180
+        if lon_delta < 180:
+            min_lon = (longitude - lon_delta + 540) % 360 - 180
+            max_lon = (longitude + lon_delta + 540) % 360 - 180
+            queryset = self.within_bbox(min_lon, latitude - lat_delta, max_lon, latitude + lat_delta)
+        else:
+            queryset = self.filter(latitude__gte=latitude - lat_delta, latitude__lte=latitude + lat_delta)
+
+        lat = Radians(Cast('latitude', models.FloatField()))
+        lon = Radians(Cast('longitude', models.FloatField()))
+        origin_lat = math.radians(latitude)
+        haversine = Power(Sin((lat - origin_lat) / 2), 2) + math.cos(origin_lat) * Cos(lat) * Power(Sin((lon - math.radians(longitude)) / 2), 2)
+        distance = 2 * EARTH_RADIUS_KM * ASin(Sqrt(haversine))
+        return queryset.annotate(distance_km=distance).filter(distance_km__lte=km)
+
+
+class SearchVectorQueryset(models.QuerySet):
+    # (lookup, weight) pairs indexed into the model's search_vector field.
+    search_vector_fields = ()
+
+    def refresh_search_vector(self):
+        kwargs = {'search_vector': build_search_vector(self.model, self.search_vector_fields)}
+        # Reindexing isn't a change to the row itself, so leave updated_at alone.
+        if any(field.name == 'updated_at' for field in self.model._meta.concrete_fields):
+            kwargs['updated_at'] = models.F('updated_at')
+        return self.update(**kwargs)
+
+    def search(self, terms):
+        """
+        Filters to rows whose search_vector matches every term as a word prefix, best matches first.
+        """
+        terms = [re.sub(r"['\\]", '', term) for term in terms]
+        terms = [term for term in terms if term]
+        if not terms:
+            return self
+        query = SearchQuery(' & '.join("'%s':*" % term for term in terms), search_type='raw', config='simple')
+        return self.filter(search_vector=query).annotate(search_rank=SearchRank(models.F('search_vector'), query)).order_by('-search_rank', 'pk')
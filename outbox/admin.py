@@ -0,0 +1,8 @@
+from django.contrib import admin
+
+from outbox.models import OutboxEmail
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'created_at', 'send_after', 'attempts', 'sent_at')
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from outbox.models import OutboxEmail, claim_emails, send_emails
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbox emails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send one batch and exit.')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = self.send_batch(options['batch_size'])
+            if options['once']:
+                break
+            if not sent:
+                time.sleep(options['interval'])
+
+    def send_batch(self, batch_size):
+        emails = claim_emails(OutboxEmail.objects.all(), batch_size)
+        if not emails:
+            return 0
+        sent = send_emails(emails)
+        if sent < len(emails):
+            self.stderr.write('%s of %s emails failed and will be retried.' % (len(emails) - sent, len(emails)))
+        return len(emails)
@@ -0,0 +1,128 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the send_outbox worker.
+
+    Rows are written in the same transaction as the change that triggered them, so
+    an email is only sent if that change is committed. Where no worker runs, rows are
+    sent once that transaction commits, and failures are retried by send_outbox --once.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.subject
+
+    def retry_later(self, error):
+        # Exponential backoff: OUTBOX_RETRY_DELAY, then 2x, 4x... capped at one day.
+        self.attempts += 1
+        delay = min(settings.OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1), 86400)
+        self.send_after = timezone.now() + timedelta(seconds=delay)
+        self.last_error = str(error)
+
+    class Meta:
+        ordering = ['send_after', 'id']
+        indexes = [
+            # Only unsent rows are ever scanned by the worker.
+            models.Index(fields=['send_after', 'id'], name='outbox_pending_idx', condition=Q(sent_at=None)),
+        ]
+
+def worker_running():
+    # send_outbox runs as a uwsgi attach-daemon (config/uwsgi_config.ini). Lambda and runserver have no worker.
+    if settings.OUTBOX_SEND_ON_COMMIT is not None:
+        return not settings.OUTBOX_SEND_ON_COMMIT
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        return False
+    try:
+        import uwsgi
+    except ImportError:
+        return False
+    return True
+
+def claim_emails(queryset, batch_size):
+    """
+    Returns up to batch_size due emails from queryset, leased to the caller for OUTBOX_CLAIM_TIMEOUT seconds.
+
+    The lease is committed before returning, so emails are sent without holding row locks
+    or a transaction open, and are picked up again if the sender dies before recording them.
+    """
+    with transaction.atomic():
+        # SKIP LOCKED lets concurrent workers claim different rows instead of waiting.
+        emails = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(sent_at=None, send_after__lte=timezone.now(), attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+            .order_by('send_after', 'id')[:batch_size]
+        )
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(send_after=timezone.now() + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT))
+    return emails
+
+def send_emails(emails):
+    """
+    Sends claimed emails over one connection and records the results. Returns the number sent.
+    """
+    # Group messages going to the same recipients so each group succeeds or retries together.
+    groups = {}
+    for email in emails:
+        groups.setdefault((email.from_email, tuple(email.recipients)), []).append(email)
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            email.retry_later(error)
+    else:
+        for group in groups.values():
+            messages = []
+            for email in group:
+                message = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.recipients, connection=connection)
+                if email.html_body:
+                    message.attach_alternative(email.html_body, 'text/html')
+                messages.append(message)
+            try:
+                connection.send_messages(messages)
+            except Exception as error:
+                for email in group:
+                    email.retry_later(error)
+            else:
+                for email in group:
+                    email.sent_at = timezone.now()
+        connection.close()
+
+    OutboxEmail.objects.bulk_update(emails, ['attempts', 'send_after', 'last_error', 'sent_at'])
+    return len([email for email in emails if email.sent_at])
+
+def send_now(email_id):
+    try:
+        send_emails(claim_emails(OutboxEmail.objects.filter(id=email_id), 1))
+    except Exception:
+        # The email stays queued for send_outbox --once.
+        logger.exception('Unable to send outbox email %s', email_id)
+
+def queue_email(subject, body, from_email, recipients, html_body=''):
+    recipients = sorted(set(recipient for recipient in recipients if recipient))
+    if recipients:
+        email = OutboxEmail.objects.create(subject=subject, body=body, html_body=html_body or '', from_email=from_email, recipients=recipients)
+        if not worker_running():
+            transaction.on_commit(lambda: send_now(email.id))
+        return email
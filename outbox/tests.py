@@ -0,0 +1,73 @@
+from io import StringIO
+from unittest.mock import patch
+from django.core import mail
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from accounts.models import ShelterlyUser
+from hotline.models import ServiceRequest
+from incident.models import Incident, IncidentNotification, Organization
+from outbox.models import OutboxEmail, queue_email
+
+class TestOutbox(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ShelterlyUser.objects.create_user(email="test@test.com", cell_phone="5555555", password="test", is_active=True)
+        cls.organization = Organization.objects.create(name='Test', slug='test')
+        cls.incident = Incident.objects.create(name='Test', slug='test', organization=cls.organization, latitude=0, longitude=0)
+        OutboxEmail.objects.all().delete()
+
+    def test_service_request_email_queued(self):
+        IncidentNotification.objects.create(incident=self.incident, user=self.user)
+        ServiceRequest.objects.create(directions="Turn left", incident=self.incident)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.get().recipients, ['test@test.com'])
+        call_command('send_outbox', '--once')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(mail.outbox[0].subject.startswith('Service Request #'))
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
+
+    def test_batched_per_recipients(self):
+        queue_email('One', 'Body', 'DoNotReply@shelterly.org', ['a@test.com', 'b@test.com'])
+        queue_email('Two', 'Body', 'DoNotReply@shelterly.org', ['b@test.com', 'a@test.com'])
+        queue_email('Three', 'Body', 'DoNotReply@shelterly.org', ['c@test.com'], html_body='<p>Body</p>')
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', autospec=True, return_value=1) as send_messages:
+            call_command('send_outbox', '--once')
+        self.assertEqual([[message.subject for message in call.args[1]] for call in send_messages.call_args_list], [['One', 'Two'], ['Three']])
+
+    def test_retry_with_backoff(self):
+        queue_email('Retry', 'Body', 'DoNotReply@shelterly.org', ['a@test.com'])
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('Relay down')):
+            call_command('send_outbox', '--once', stderr=StringIO())
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.attempts, email.last_error, email.sent_at), (1, 'Relay down', None))
+        self.assertGreater(email.send_after, timezone.now())
+        # Not retried until the backoff has passed.
+        call_command('send_outbox', '--once')
+        self.assertEqual(len(mail.outbox), 0)
+        OutboxEmail.objects.update(send_after=timezone.now())
+        call_command('send_outbox', '--once')
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(OUTBOX_SEND_ON_COMMIT=True)
+    def test_sent_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email('Now', 'Body', 'DoNotReply@shelterly.org', ['a@test.com'])
+            self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
+
+    def test_claimed_before_sending(self):
+        queue_email('Claimed', 'Body', 'DoNotReply@shelterly.org', ['a@test.com'])
+        leases = []
+        def send_messages(backend, messages):
+            # Other workers must see the row as taken while it is being sent.
+            leases.append(OutboxEmail.objects.filter(send_after__gt=timezone.now()).exists())
+            return len(messages)
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', autospec=True, side_effect=send_messages):
+            call_command('send_outbox', '--once')
+        self.assertEqual(leases, [True])
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
@@ -1,7 +1,12 @@
 from django.db import models
-from managers import ActionHistoryQueryset
+from managers import ActionHistoryQueryset, LocationQueryset, SearchVectorQueryset
+
+class PersonQueryset(LocationQueryset, SearchVectorQueryset, ActionHistoryQueryset):
+    search_vector_fields = (
+        ('first_name', 'A'), ('last_name', 'A'), ('address', 'B'), ('city', 'C'), ('phone', 'A'), ('email', 'A'),
+        ('drivers_license', 'A'), ('animal__name', 'B'), ('reporter_animals__name', 'B'),
+    )
 
-class PersonQueryset(ActionHistoryQueryset):
     def with_images(self):
         return self.prefetch_related(
             models.Prefetch("personimage_set", to_attr="images")
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from managers import build_search_vector
+
+
+SEARCH_VECTOR_FIELDS = (
+    ('first_name', 'A'), ('last_name', 'A'), ('address', 'B'), ('city', 'C'), ('phone', 'A'), ('email', 'A'),
+    ('drivers_license', 'A'), ('animal__name', 'B'), ('reporter_animals__name', 'B'),
+)
+
+def populate_search_vector(apps, schema_editor):
+    Person = apps.get_model('people', 'Person')
+    Person.objects.update(search_vector=build_search_vector(Person, SEARCH_VECTOR_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0020_auto_20231206_1336'),
+        ('animals', '0038_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='person_search_idx'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
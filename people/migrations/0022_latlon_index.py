@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0021_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['latitude', 'longitude'], name='person_latlon_idx'),
+        ),
+    ]
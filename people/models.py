@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.signals import post_save
 from incident.models import Incident
+from images import ImageDerivatives
 from location.models import Location
 from .managers import PersonQueryset
 
@@ -16,6 +20,7 @@ class Person(Location):
     drivers_license = models.CharField(max_length=50, blank=True)
     email = models.CharField(max_length=200, blank=True)
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = PersonQueryset.as_manager()
 
@@ -28,8 +33,22 @@ class Person(Location):
 
     class Meta:
         ordering = ('first_name',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='person_search_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='person_latlon_idx'),
+        ]
 
-class PersonImage(models.Model):
+# Reindex the person and the SRs and animals that index their name.
+def refresh_search_vector(sender, instance, **kwargs):
+    from animals.models import Animal
+    from hotline.models import ServiceRequest
+    Person.objects.filter(pk=instance.pk).refresh_search_vector()
+    ServiceRequest.objects.filter(models.Q(owners=instance) | models.Q(reporter=instance)).refresh_search_vector()
+    Animal.objects.filter(models.Q(owners=instance) | models.Q(reporter=instance)).refresh_search_vector()
+
+post_save.connect(refresh_search_vector, sender=Person)
+
+class PersonImage(ImageDerivatives):
 
     image = models.ImageField(upload_to='images/')
     name = models.CharField(max_length=25, blank=True)
@@ -2,7 +2,8 @@ import re
 from rest_framework import serializers
 from animals.models import Animal
 from .models import OwnerContact, Person
-from location.utils import build_full_address, build_action_string
+from history import get_action_history
+from location.utils import build_full_address
 from hotline.models import ServiceRequest
 
 class SimplePersonSerializer(serializers.ModelSerializer):
@@ -81,13 +82,13 @@ class PersonSerializer(SimplePersonSerializer):
 
     def get_images(self, obj):
         try:
-            return [{'id':sr_image.id, 'url':sr_image.image.url, 'name':sr_image.name} for sr_image in obj.images]
+            return [{'id':sr_image.id, 'url':sr_image.image.url, 'thumbnail':sr_image.get_url('thumbnail'), 'medium':sr_image.get_url('medium'), 'name':sr_image.name} for sr_image in obj.images]
         except IndexError:
             return []
         except AttributeError:
             # Should only hit this when returning a single object after create.
             try:
-                return [{'id':sr_image.id, 'url':sr_image.image.url, 'name':sr_image.name} for sr_image in obj.personimage_set.all()]
+                return [{'id':sr_image.id, 'url':sr_image.image.url, 'thumbnail':sr_image.get_url('thumbnail'), 'medium':sr_image.get_url('medium'), 'name':sr_image.name} for sr_image in obj.personimage_set.all()]
             except AttributeError:
                 return []
 
@@ -111,4 +112,4 @@ class HeavyPersonSerializer(PersonSerializer):
 
     # Custom field for the action history.
     def get_action_history(self, obj):
-        return [build_action_string(action) for action in obj.target_actions.all()]
\ No newline at end of file
+        return get_action_history(self, obj)
\ No newline at end of file
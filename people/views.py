@@ -1,19 +1,27 @@
+from django.db import transaction
 from django.db.models import Exists, OuterRef, Prefetch, Q
-from rest_framework import filters, permissions, serializers, viewsets
-from actstream import action
+from rest_framework import permissions, serializers, viewsets
 
 from animals.models import Animal
 from hotline.models import ServiceRequest
 from incident.models import Incident, Organization
+from activity import buffered_actions, send_action
+from history import ActionHistoryMixin
+from location.filters import LocationFilter
 from people.models import OwnerContact, Person, PersonChange, PersonImage
 from people.serializers import OwnerContactSerializer, PersonSerializer, HeavyPersonSerializer, SimplePersonSerializer
+from pagination import KeysetPagination
+from search import FullTextSearchFilter
 
 
+class PersonPagination(KeysetPagination):
+    ordering = ('first_name', 'id')
+
 # Provides view for Person API calls.
-class PersonViewSet(viewsets.ModelViewSet):
+class PersonViewSet(ActionHistoryMixin, viewsets.ModelViewSet):
     queryset = Person.objects.all()
-    search_fields = ['first_name', 'last_name', 'address', 'city', 'phone', 'email', 'drivers_license', 'animal__name', 'reporter_animals__name',]
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (FullTextSearchFilter, LocationFilter)
+    pagination_class = PersonPagination
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = PersonSerializer
     light_serializer_class = SimplePersonSerializer
@@ -29,7 +37,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         return super(PersonViewSet, self).get_serializer_class()
 
     def get_queryset(self):
-        queryset = Person.objects.with_history().all()
+        queryset = Person.objects.all()
         if self.request.GET.get('training'):
             queryset = queryset.filter(incident__organization__slug=self.request.GET.get('organization'), incident__training=self.request.GET.get('training') == 'true')
         queryset = (
@@ -83,7 +91,7 @@ class PersonViewSet(viewsets.ModelViewSet):
             serializer.validated_data['phone'] = ''.join(char for char in serializer.validated_data.get('phone', '') if char.isdigit())
             serializer.validated_data['alt_phone'] = ''.join(char for char in serializer.validated_data.get('alt_phone', '') if char.isdigit())
             person = serializer.save()
-            action.send(self.request.user, verb='created person', target=person)
+            send_action(self.request.user, verb='created person', target=person)
 
             # If an owner is being added to an existing SR, add the owner to the SR and update all SR animals with the owner.
             if self.request.data.get('request'):
@@ -110,6 +118,8 @@ class PersonViewSet(viewsets.ModelViewSet):
                 for service_request in ServiceRequest.objects.filter(Q(owners=owner)|Q(reporter=owner)):
                     service_request.owners.add(person)
 
+    @transaction.atomic
+    @buffered_actions()
     def perform_update(self, serializer):
         from evac.models import AssignedRequest
 
@@ -133,13 +143,12 @@ class PersonViewSet(viewsets.ModelViewSet):
 
             if self.request.data.get('reunite_animals'):
                 requests = []
-                for animal in person.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']):
-                    action.send(self.request.user, verb=f'changed animal status to reunited', target=animal)
+                animals = list(person.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']).select_related('request'))
+                for animal in animals:
+                    send_action(self.request.user, verb=f'changed animal status to reunited', target=animal)
                     if animal.request and animal.request not in requests:
                         requests.append(animal.request)
-                        for assigned_request in AssignedRequest.objects.filter(service_request=animal.request.id, dispatch_assignment__end_time=None):
-                            assigned_request.animals[str(person.id)]['status'] = 'REUNITED'
-                            assigned_request.save()
+                AssignedRequest.objects.filter(service_request__in=requests, dispatch_assignment__end_time=None).patch_animal_fields([animal.id for animal in animals], status='REUNITED')
                 person.animal_set.exclude(status__in=['DECEASED', 'NO FURTHER ACTION', 'REUNITED']).update(status='REUNITED', shelter=None, room=None)
                 for service_request in requests:
                     service_request.update_status(self.request.user)
@@ -178,7 +187,7 @@ class PersonViewSet(viewsets.ModelViewSet):
                     service_request.owners.add(person)
             else:
                 # Record update action.
-                action.send(self.request.user, verb='updated person', target=person)
+                send_action(self.request.user, verb='updated person', target=person)
 
 class OwnerContactViewSet(viewsets.ModelViewSet):
 
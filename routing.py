@@ -1,11 +1,11 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
 # import app.routing
-from django.urls import re_path, url
+from django.urls import re_path
 from consumers import WSConsumer
 websocket_urlpatterns = [
-    re_path(url(r'^ws/map_data/'), WSConsumer.as_asgi()),
+    re_path(r'^ws/map_data/(?P<incident_slug>[^/]+)/$', WSConsumer.as_asgi()),
 ]
-# the websocket will open at 127.0.0.1:8000/ws/<room_name>
+# the websocket will open at 127.0.0.1:8000/ws/map_data/<incident_slug>/
 application = ProtocolTypeRouter({
     'websocket':
         URLRouter(
@@ -0,0 +1,17 @@
+from rest_framework.filters import SearchFilter
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter backed by the model's indexed search_vector instead of icontains
+    lookups across joins. Matches each search term as a word prefix and orders
+    results by rank.
+
+    The view's queryset must be a SearchVectorQueryset.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return queryset.search(search_terms)
@@ -35,6 +35,9 @@ SHELTERLY_VERSION = __version__
 CALTOPO_ID = os.environ.get('CALTOPO_ID')
 CALTOPO_KEY = os.environ.get('CALTOPO_KEY')
 CALTOPO_ACCOUNT_ID = os.environ.get('CALTOPO_ACCOUNT_ID')
+CALTOPO_DOMAIN = os.environ.get('CALTOPO_DOMAIN', 'sartopo.com')
+# Max concurrent marker pushes per Caltopo map.
+CALTOPO_MAX_WORKERS = 4
 
 DEBUG = False
 USE_S3 = True
@@ -60,6 +63,14 @@ EMAIL_PORT = '465'
 EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASSWORD')
 EMAIL_USE_SSL = True
+# Outbox worker (manage.py send_outbox) retry settings.
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 60
+# Seconds a claimed email is reserved for its sender before another worker may retry it.
+OUTBOX_CLAIM_TIMEOUT = 300
+# Send emails when their transaction commits instead of leaving them to the worker.
+# None sends on commit unless running under uwsgi, where send_outbox is attached as a daemon.
+OUTBOX_SEND_ON_COMMIT = None
 
 # Application definition
 INSTALLED_APPS = [
@@ -80,6 +91,7 @@ INSTALLED_APPS = [
     'hotline',
     'incident',
     'location',
+    'outbox',
     'people',
     'rest_framework',
     'knox',
@@ -144,6 +156,9 @@ CHANNEL_LAYERS = {
         },
     },
 }
+# Seconds to buffer map websocket events per incident before broadcasting them together.
+# Buffering runs on a timer thread, so under uwsgi it needs enable-threads; 0 broadcasts immediately.
+MAP_EVENT_WINDOW = 0.5
 SITE_ID = 1
 
 # Database
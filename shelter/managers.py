@@ -0,0 +1,4 @@
+from managers import ActionHistoryQueryset, LocationQueryset
+
+class ShelterQueryset(LocationQueryset, ActionHistoryQueryset):
+    pass
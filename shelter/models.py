@@ -3,6 +3,7 @@ from incident.models import Incident
 from people.models import Person
 from location.models import Location
 from managers import ActionHistoryQueryset
+from .managers import ShelterQueryset
 # Create your models here.
 
 class BaseShelterModel(models.Model):
@@ -25,6 +26,8 @@ class Shelter(BaseShelterModel, Location):
     active = models.BooleanField(default=True)
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE)
 
+    objects = ShelterQueryset.as_manager()
+
     @property
     def location_type(self):
         return 'shelter'
@@ -32,6 +35,11 @@ class Shelter(BaseShelterModel, Location):
     @property
     def rooms(self):
         return Room.objects.filter(building__shelter=self)
+
+    class Meta(BaseShelterModel.Meta):
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='shelter_latlon_idx'),
+        ]
     
 
 class Building(BaseShelterModel):
@@ -3,7 +3,8 @@ from rest_framework import serializers
 from actstream.models import target_stream
 
 from .models import *
-from location.utils import build_full_address, build_action_string
+from history import get_action_history
+from location.utils import build_full_address
 from animals.models import Animal
 
 class SimpleIntakeSummarySerializer(serializers.ModelSerializer):
@@ -62,7 +63,7 @@ class RoomSerializer(SimpleRoomSerializer):
                 return AnimalSerializer(obj.animal_set.exclude(status='CANCELED'), many=True, required=False, read_only=True).data
 
     def get_action_history(self, obj):
-        return [build_action_string(action) for action in obj.target_actions.all()]
+        return get_action_history(self, obj)
 
     def get_shelter(self, obj):
         return obj.building.shelter.id
@@ -76,7 +77,7 @@ class SimpleBuildingSerializer(serializers.ModelSerializer):
     rooms = SimpleRoomSerializer(source='room_set', many=True, required=False, read_only=True)
 
     def get_action_history(self, obj):
-        return [build_action_string(action) for action in obj.target_actions.all()]
+        return get_action_history(self, obj)
 
     class Meta:
         model = Building
@@ -9,10 +9,13 @@ from rest_framework import permissions
 from .serializers import ShelterSerializer, ModestShelterSerializer, BuildingSerializer, SimpleBuildingSerializer, RoomSerializer, IntakeSummarySerializer
 from animals.models import Animal
 from incident.models import Incident, Organization
+from history import ActionHistoryMixin
+from location.filters import LocationFilter
 from vet.models import MedicalRecord, VetRequest
 
-class ShelterViewSet(viewsets.ModelViewSet):
+class ShelterViewSet(ActionHistoryMixin, viewsets.ModelViewSet):
     serializer_class = ShelterSerializer
+    filter_backends = (LocationFilter,)
     permission_classes = [permissions.IsAuthenticated, ]
 
     def get_serializer_class(self):
@@ -57,7 +60,7 @@ class ShelterViewSet(viewsets.ModelViewSet):
             .prefetch_related(
                 Prefetch(
                     "building_set",
-                    Building.objects.with_history()
+                    Building.objects
                     .annotate(
                         animal_count=Sum(
                             "room__animal__animal_count", filter=~Q(room__animal__status="CANCELED")&Q(room__animal__incident__slug=self.request.GET.get('incident'))
@@ -66,22 +69,22 @@ class ShelterViewSet(viewsets.ModelViewSet):
                     .prefetch_related(
                         Prefetch(
                             "room_set",
-                            Room.objects.with_history().annotate(
+                            Room.objects.annotate(
                                 animal_count=Sum(
                                     "animal__animal_count", filter=~Q(animal__status="CANCELED")&Q(animal__incident__slug=self.request.GET.get('incident'))
                                 )
-                            ).prefetch_related(Prefetch('animal_set',Animal.objects.with_images().prefetch_related('owners').exclude(status='CANCELED').filter(incident__slug=self.request.GET.get('incident')), to_attr='animals')).order_by('name')
+                            ).prefetch_related(Prefetch('animal_set',Animal.objects.with_images().with_latest_vitals().prefetch_related('owners').exclude(status='CANCELED').filter(incident__slug=self.request.GET.get('incident')), to_attr='animals')).order_by('name')
                         )
                     ).order_by('name'),
                 )
             )
-            .with_history().prefetch_related(Prefetch('animal_set', Animal.objects.filter(room=None, incident__slug=self.request.GET.get('incident', '')).exclude(status='CANCELED'), to_attr="unroomed_animals"))).distinct().order_by('name')
+            .prefetch_related(Prefetch('animal_set', Animal.objects.filter(room=None, incident__slug=self.request.GET.get('incident', '')).exclude(status='CANCELED'), to_attr="unroomed_animals"))).distinct().order_by('name')
         if self.request.GET.get('medical', '') == 'true':
             queryset = queryset.filter(animal__medical_record__isnull=False)
         return queryset
 
 
-class BuildingViewSet(viewsets.ModelViewSet):
+class BuildingViewSet(ActionHistoryMixin, viewsets.ModelViewSet):
     # add permissions
     queryset = Building.objects.all()
     # serializer_class = SimpleBuildingSerializer
@@ -103,7 +106,7 @@ class BuildingViewSet(viewsets.ModelViewSet):
             action.send(self.request.user, verb='updated building', target=building)
 
     def get_queryset(self):
-        return Building.objects.with_history().all().prefetch_related(
+        return Building.objects.all().prefetch_related(
             Prefetch(
                 "room_set",
                 Room.objects
@@ -113,7 +116,7 @@ class BuildingViewSet(viewsets.ModelViewSet):
             )
         )
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(ActionHistoryMixin, viewsets.ModelViewSet):
     # add permissions
 
     serializer_class = RoomSerializer
@@ -132,13 +135,12 @@ class RoomViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return (
             Room.objects.select_related("building__shelter")
-            .with_history()
             .prefetch_related(
                 Prefetch(
                     "animal_set",
                     Animal.objects.select_related("request", "shelter")
-                    .with_history()
                     .with_images()
+                    .with_latest_vitals()
                     .exclude(status="CANCELED")
                     .filter(incident__slug=self.request.GET.get('incident'))
                     .prefetch_related("owners"),
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+# Rows written by transactions that commit after a sync token was issued can carry
+# an updated_at slightly older than the token, so re-send a short window of changes.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class DeltaSyncMixin(object):
+    """
+    Adds a ?since=<sync_token> mode to a ViewSet list endpoint.
+
+    Every list response carries an X-Sync-Token header. Passing it back as since returns
+    only the rows changed after it, along with the ids of changed rows that no longer
+    belong in the list (e.g. canceled), so clients can patch a local cache.
+    """
+    sync_related_fields = ()
+
+    def get_sync_queryset(self):
+        queryset = self.get_queryset().model.objects.all()
+        if self.request.GET.get('incident'):
+            queryset = queryset.filter(incident__slug=self.request.GET.get('incident'))
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        sync_token = timezone.now().isoformat()
+        if 'since' not in request.query_params:
+            response = super(DeltaSyncMixin, self).list(request, *args, **kwargs)
+            response['X-Sync-Token'] = sync_token
+            return response
+
+        since = parse_datetime(request.query_params.get('since', '').replace(' ', '+'))
+        if not since:
+            raise ValidationError({'since': 'Invalid sync token.'})
+        since = since - SYNC_OVERLAP
+
+        # Rows are also considered changed when a nested relation they serialize has changed.
+        changed = Q(updated_at__gte=since)
+        for field in self.sync_related_fields:
+            changed |= Q(**{'%s__updated_at__gte' % field: since})
+        changed_ids = set(self.get_sync_queryset().filter(changed).values_list('id', flat=True))
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(id__in=changed_ids)
+        data = self.get_serializer(queryset, many=True).data
+        removed = changed_ids - {row['id'] for row in data}
+
+        response = Response({'sync_token': sync_token, 'results': data, 'removed': sorted(removed)})
+        response['X-Sync-Token'] = sync_token
+        return response
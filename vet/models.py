@@ -5,6 +5,7 @@ from django.db.models import Q
 from datetime import datetime
 
 from animals.models import Animal
+from images import ImageDerivatives
 from vet.managers import MedicalRecordQueryset
 
 User = get_user_model()
@@ -77,7 +78,7 @@ class MedicalRecord(models.Model):
 
     objects = MedicalRecordQueryset.as_manager()
 
-class MedicalRecordImage(models.Model):
+class MedicalRecordImage(ImageDerivatives):
 
     image = models.ImageField(upload_to='images/')
     name = models.CharField(max_length=25, blank=True)
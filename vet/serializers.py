@@ -219,13 +219,13 @@ class MedicalRecordSerializer(serializers.ModelSerializer):
 
     def get_images(self, obj):
         try:
-            return [{'id':mr_image.id, 'url':mr_image.image.url, 'name':mr_image.name} for mr_image in obj.images]
+            return [{'id':mr_image.id, 'url':mr_image.image.url, 'thumbnail':mr_image.get_url('thumbnail'), 'medium':mr_image.get_url('medium'), 'name':mr_image.name} for mr_image in obj.images]
         except IndexError:
             return []
         except AttributeError:
             # Should only hit this when returning a single object after create.
             try:
-                return [{'id':mr_image.id, 'url':mr_image.image.url, 'name':mr_image.name} for mr_image in obj.medicalrecordimage_set.all()]
+                return [{'id':mr_image.id, 'url':mr_image.image.url, 'thumbnail':mr_image.get_url('thumbnail'), 'medium':mr_image.get_url('medium'), 'name':mr_image.name} for mr_image in obj.medicalrecordimage_set.all()]
             except AttributeError:
                 return []
 
@@ -96,6 +96,8 @@ class ExamViewSet(viewsets.ModelViewSet):
 
                 # Update Animal with animal data.
                 Animal.objects.filter(id=self.request.data.get('animal_id')).update(age=self.request.data.get('age'), sex=self.request.data.get('sex'), microchip=self.request.data.get('microchip', ''), fixed=self.request.data.get('fixed', ''))
+                # update() skips the post_save reindexing of the microchip.
+                Animal.objects.filter(id=self.request.data.get('animal_id')).refresh_search_vector()
                 # Create ExamAnswer objects.
                 for k,v in self.request.data.items():
                     if k not in ['open', 'assignee', 'age', 'sex', 'microchip', 'fixed', 'confirm_sex_age', 'confirm_chip', 'temperature', 'temperature_method', 'weight', 'weight_unit', 'weight_estimated', 'pulse', 'respiratory_rate'] and '_notes' not in k and '_id' not in k and self.request.data.get(k + '_id'):
@@ -107,6 +109,8 @@ class ExamViewSet(viewsets.ModelViewSet):
                 MedicalRecord.objects.filter(id=self.request.data.get('medrecord_id')).update(medical_plan=self.request.data.get('medical_plan'))
                 exam = serializer.save()
                 Animal.objects.filter(id=self.request.data.get('animal_id')).update(age=self.request.data.get('age'), sex=self.request.data.get('sex'), microchip=self.request.data.get('microchip', ''), fixed=self.request.data.get('fixed', ''))
+                # update() skips the post_save reindexing of the microchip.
+                Animal.objects.filter(id=self.request.data.get('animal_id')).refresh_search_vector()
                 for k,v in self.request.data.items():
                     if k not in ['open', 'assignee', 'age', 'sex', 'microchip', 'fixed', 'confirm_sex_age', 'confirm_chip', 'temperature', 'temperature_method', 'weight', 'weight_unit', 'weight_estimated', 'pulse', 'respiratory_rate'] and '_notes' not in k and '_id' not in k and self.request.data.get(k + '_id'):
                         ExamAnswer.objects.update_or_create(exam=exam, question=ExamQuestion.objects.get(id=self.request.data.get(k + '_id')), defaults={'answer':v, 'answer_notes':self.request.data.get(k + '_notes', '')})